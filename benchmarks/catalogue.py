@@ -0,0 +1,203 @@
+# inbuilt libraries
+import json
+import random
+from datetime import datetime, timedelta
+
+
+SIZES = {
+    "1k": 1000,
+    "10k": 10000,
+    "100k": 100000
+}
+# metadata_modified grows with the dataset index, so `metadata_modified asc` is the index order
+START = datetime(2020, 1, 1)
+STEP = timedelta(minutes=7, seconds=13)
+
+LANGUAGES = [
+    ("http://publications.europa.eu/resource/authority/language/SPA", "es"),
+    ("http://publications.europa.eu/resource/authority/language/ENG", "en"),
+]
+THEMES = ["ac", "ad", "af", "am", "au", "br", "bu", "cp", "el", "er", "ge", "gg", "gn", "hb", "hh", "hy", "lc", "lu", "mf", "mr", "nz", "of", "oi", "pd", "pf", "ps", "rs", "sd", "so", "sr", "su", "tn", "us"]
+TOPICS = ["biota", "boundaries", "climatologyMeteorologyAtmosphere", "economy", "elevation", "environment", "geoscientificInformation", "health", "imageryBaseMapsEarthCover", "inlandWaters", "location", "oceans", "planningCadastre", "society", "structure", "transportation", "utilitiesCommunication"]
+SPATIAL_SCOPES = ["national", "regional", "local", "european", "global"]
+RIGHTS = ["INSPIRE_Directive_Article13_1a", "INSPIRE_Directive_Article13_1b", "INSPIRE_Directive_Article13_1e", "noLimitations"]
+REPRESENTATION_TYPES = ["vector", "grid", "tin", "textTable"]
+# (format, mimetype, service)
+RESOURCE_FORMATS = [
+    ("http://publications.europa.eu/resource/authority/file-type/CSV", "text/csv", False),
+    ("http://publications.europa.eu/resource/authority/file-type/GEOJSON", "application/geo+json", False),
+    ("http://publications.europa.eu/resource/authority/file-type/SHP", "application/x-shapefile", False),
+    ("http://publications.europa.eu/resource/authority/file-type/ZIP", "application/zip", False),
+    ("http://publications.europa.eu/resource/authority/file-type/PDF", "application/pdf", False),
+    ("WMS", "", True),
+    ("WFS", "", True),
+    ("WMTS", "", True),
+]
+WORDS = ("red de estaciones calidad del aire hidrografía cuencas carreteras parcelas catastro límites administrativos "
+         "usos del suelo ortofoto modelo digital del terreno edificios direcciones espacios protegidos hábitats "
+         "zonas inundables geología acuíferos ruido población municipios costas ríos lagos embalses").split()
+ENGLISH_WORDS = ("monitoring network air quality hydrography river basins roads parcels cadastre administrative units "
+                 "land use orthophoto elevation model buildings addresses protected sites habitats flood zones "
+                 "geology aquifers noise population municipalities coastline rivers lakes reservoirs").split()
+# Spain, as the default bbox of the CKAN template
+BBOX = (-9.3, 36.0, 3.3, 43.8)
+SERVICE_TYPE = "http://inspire.ec.europa.eu/metadata-codelist/ResourceType/service"
+DATASET_TYPE = "http://inspire.ec.europa.eu/metadata-codelist/ResourceType/dataset"
+SERIES_TYPE = "http://inspire.ec.europa.eu/metadata-codelist/ResourceType/series"
+
+
+def catalogue_size(size: str) -> int:
+    """
+    Number of datasets of a catalogue size.
+
+    Parameters
+    ----------
+    size: str. "1k", "10k", "100k" or a number of datasets.
+
+    Returns
+    -------
+    int: Number of datasets.
+    """
+    return SIZES[size] if size in SIZES else int(size)
+
+
+def metadata_modified(index: int) -> str:
+    """
+    CKAN `metadata_modified` of a dataset, increasing with the index.
+    """
+    return (START + STEP * index).strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+
+def make_dataset(index: int, seed: int = 0) -> dict:
+    """
+    Build a synthetic CKAN GeoDCAT-AP dataset, the same for the same index and seed.
+
+    The datasets have multilingual titles and abstracts, GeoJSON spatial extents,
+    1 to 6 resources (files and OGC services), INSPIRE themes and keywords, and
+    some list fields serialized as JSON strings, as returned by ckanext-scheming.
+
+    Parameters
+    ----------
+    index: int. Position of the dataset in the catalogue.
+    seed: int. Seed of the catalogue.
+
+    Returns
+    -------
+    dict: Dataset as returned by the CKAN `package_search` API.
+    """
+    rnd = random.Random(seed * 1000003 + index)
+    name = f"dataset-{index:07d}"
+    words = rnd.sample(range(len(WORDS)), 4)
+    title_es = " ".join(WORDS[i] for i in words).capitalize() + f" {index}"
+    title_en = " ".join(ENGLISH_WORDS[i % len(ENGLISH_WORDS)] for i in words).capitalize() + f" {index}"
+    notes_es = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(30, 120))).capitalize() + "."
+    notes_en = " ".join(rnd.choice(ENGLISH_WORDS) for _ in range(rnd.randint(30, 120))).capitalize() + "."
+    language, language_code = LANGUAGES[0] if rnd.random() < 0.8 else LANGUAGES[1]
+
+    kind = rnd.random()
+    dcat_type = SERVICE_TYPE if kind < 0.1 else SERIES_TYPE if kind < 0.15 else DATASET_TYPE
+    if dcat_type == SERVICE_TYPE:
+        title_es = rnd.choice(["Servicio WMS de ", "Servicio WFS de descarga de ", "Catálogo CSW de "]) + title_es.lower()
+        title_en = rnd.choice(["WMS service of ", "WFS download service of ", "CSW catalog of "]) + title_en.lower()
+
+    minx = rnd.uniform(BBOX[0], BBOX[2] - 0.5)
+    miny = rnd.uniform(BBOX[1], BBOX[3] - 0.5)
+    maxx = min(BBOX[2], minx + rnd.uniform(0.05, 3))
+    maxy = min(BBOX[3], miny + rnd.uniform(0.05, 3))
+    spatial = {
+        "type": "Polygon",
+        "coordinates": [[[minx, miny], [maxx, miny], [maxx, maxy], [minx, maxy], [minx, miny]]]
+    }
+
+    modified = metadata_modified(index)
+    created = (START + STEP * index - timedelta(days=rnd.randint(1, 900))).strftime("%Y-%m-%dT%H:%M:%S.%f")
+    themes = [f"http://inspire.ec.europa.eu/theme/{theme}" for theme in rnd.sample(THEMES, rnd.randint(1, 3))]
+    tag_uri = [f"http://www.eionet.europa.eu/gemet/concept/{rnd.randint(100, 15000)}" for _ in range(rnd.randint(0, 4))]
+    tag_uri.append(f"http://inspire.ec.europa.eu/metadata-codelist/SpatialScope/{rnd.choice(SPATIAL_SCOPES)}")
+
+    resources = []
+    for position in range(rnd.randint(1, 6)):
+        resource_format, mimetype, service = rnd.choice(RESOURCE_FORMATS)
+        url = f"https://ide.example.org/{'ows' if service else 'files'}/{name}/{position}"
+        resources.append({
+            "id": f"{index:07d}-{position}",
+            "package_id": f"{index:08d}-0000-4000-8000-000000000000",
+            "position": position,
+            "name": f"{resource_format.rsplit('/', 1)[-1]} {title_es}",
+            "description": rnd.choice(["", " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(5, 40)))]),
+            "format": resource_format,
+            "mimetype": mimetype or None,
+            "format_version": rnd.choice(["", "1.0.0", "1.3.0", "2.0.0"]),
+            "url": url + ("?service=WMS&request=GetCapabilities" if resource_format == "WMS" else ""),
+            "size": rnd.randint(1000, 10 ** 9),
+            "created": created,
+            "last_modified": modified,
+            "state": "active",
+        })
+
+    dataset = {
+        "id": f"{index:08d}-0000-4000-8000-000000000000",
+        "name": name,
+        "type": "dataset",
+        "state": "active",
+        "private": False,
+        "title": title_es,
+        "title_translated": {"es": title_es, "en": title_en},
+        "notes": notes_es,
+        "notes_translated": {"es": notes_es, "en": notes_en},
+        "metadata_created": created,
+        "metadata_modified": modified,
+        "issued": created,
+        "modified": modified,
+        "language": language,
+        "dcat_type": dcat_type,
+        "theme": json.dumps(themes) if rnd.random() < 0.5 else themes,
+        "tag_uri": json.dumps(tag_uri) if rnd.random() < 0.5 else tag_uri,
+        "tags": [{"name": WORDS[i], "display_name": WORDS[i]} for i in words],
+        "topic": f"http://inspire.ec.europa.eu/metadata-codelist/TopicCategory/{rnd.choice(TOPICS)}",
+        "spatial": json.dumps(spatial),
+        "reference_system": f"http://www.opengis.net/def/crs/EPSG/0/{rnd.choice([4258, 4326, 25829, 25830, 25831])}",
+        "representation_type": f"http://inspire.ec.europa.eu/metadata-codelist/SpatialRepresentationType/{rnd.choice(REPRESENTATION_TYPES)}",
+        "spatial_resolution_in_meters": rnd.choice(["", 1, 5, 25, 1000]),
+        "temporal_start": created[:10],
+        "temporal_end": modified[:10],
+        "access_rights": f"http://inspire.ec.europa.eu/metadata-codelist/LimitationsOnPublicAccess/{rnd.choice(RIGHTS)}",
+        "license_id": "cc-by",
+        "license_title": "Creative Commons Attribution 4.0",
+        "license_url": "https://creativecommons.org/licenses/by/4.0/",
+        "publisher_name": "Instituto Geográfico de Ejemplo",
+        "publisher_email": "ide@example.org",
+        "publisher_url": "https://ide.example.org",
+        "contact_name": rnd.choice(["Área de Cartografía", "Servicio de Medio Ambiente", "Unidad SIG"]),
+        "contact_email": "sig@example.org",
+        "contact_url": "https://ide.example.org/contacto",
+        "provenance": {"es": "Elaborado a partir de " + " ".join(rnd.choice(WORDS) for _ in range(10)), "en": "Produced from " + " ".join(rnd.choice(ENGLISH_WORDS) for _ in range(10))},
+        "lineage_source": json.dumps([f"Fuente {n} de {title_es}" for n in range(rnd.randint(0, 3))]),
+        "lineage_process_steps": [" ".join(rnd.choice(WORDS) for _ in range(12)) for _ in range(rnd.randint(0, 2))],
+        "version": rnd.choice(["", "1.0", "2023"]),
+        "num_resources": len(resources),
+        "resources": resources,
+    }
+    if language_code == "en":
+        dataset["title"], dataset["notes"] = title_en, notes_en
+        dataset["title_translated"] = {"en": title_en, "es": title_es}
+        dataset["notes_translated"] = {"en": notes_en, "es": notes_es}
+    return dataset
+
+
+def iter_catalogue(size: int, seed: int = 0, start: int = 0):
+    """
+    Generate the datasets of a synthetic catalogue, see `make_dataset()`.
+
+    Parameters
+    ----------
+    size: int. Number of datasets of the catalogue.
+    seed: int. Seed of the catalogue.
+    start: int. Index of the first dataset.
+
+    Returns
+    -------
+    generator: A generator that yields CKAN datasets.
+    """
+    for index in range(start, size):
+        yield make_dataset(index, seed)
@@ -0,0 +1,143 @@
+"""
+Local stand-in of the CKAN `package_search` API serving a synthetic catalogue.
+
+    python benchmarks/ckan_stub.py --size 10k --port 5000
+
+Then set CKAN_URL=http://127.0.0.1:5000/ to run ckan2pycsw against it.
+"""
+# inbuilt libraries
+import argparse
+import json
+import math
+import re
+import sys
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# custom functions
+from catalogue import START, STEP, catalogue_size, make_dataset
+
+
+PACKAGE_SEARCH = "/api/3/action/package_search"
+# CKAN `ckan.search.rows_max` default
+MAX_ROWS = 1000
+MODIFIED_SINCE = re.compile(r"metadata_modified:\[(\S+) TO \*\]")
+# Keyset paging, the datasets after a metadata_modified (unique in the catalogue)
+MODIFIED_AFTER = re.compile(r"metadata_modified:\{(\S+) TO \*\]")
+# Datasets by package id, e.g. the retry of the datasets that failed
+PACKAGE_IDS = re.compile(r"\bid:\(([^)]*)\)")
+
+
+class CKANStubHandler(BaseHTTPRequestHandler):
+    """
+    `package_search` with start/rows and keyset paging, `fl` and the `fq` clauses used by ckan2pycsw: `metadata_modified` ranges and package ids.
+
+    The catalogue is generated on request, datasets are sorted by index, which is also
+    the `metadata_modified asc` and `id asc` order.
+    """
+    server_version = "CKANStub/0.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != PACKAGE_SEARCH:
+            self.send_json(404, {"success": False, "error": {"message": "Not found", "__type": "Not Found Error"}})
+            return
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        try:
+            start = int(query.get("start", 0))
+            rows = min(int(query.get("rows", 10)), self.server.rows_max)
+        except ValueError:
+            self.send_json(409, {"success": False, "error": {"message": "Invalid start or rows", "__type": "Validation Error"}})
+            return
+
+        first = first_index(query.get("fq", ""))
+        size = self.server.size
+        matches = range(first, size)
+        ids = package_indexes(query.get("fq", ""))
+        if ids is not None:
+            matches = [index for index in matches if index in ids]
+        count = len(matches)
+        indexes = matches[start:start + rows]
+        fields = [field for field in re.split(r"[\s,]+", query.get("fl", "")) if field]
+        results = []
+        for index in indexes:
+            dataset = make_dataset(index, self.server.seed)
+            results.append({field: dataset[field] for field in fields if field in dataset} if fields else dataset)
+        self.send_json(200, {"help": PACKAGE_SEARCH, "success": True, "result": {"count": count, "results": results, "sort": query.get("sort", "score desc, metadata_modified desc"), "facets": {}, "search_facets": {}}})
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json;charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def first_index(fq: str) -> int:
+    """
+    Index of the first dataset matching the `metadata_modified:[<date> TO *]` and `metadata_modified:{<date> TO *]` filters, 0 without them.
+    """
+    first = 0
+    for match in MODIFIED_SINCE.finditer(fq):
+        since = datetime.fromisoformat(match.group(1).rstrip("Z"))
+        first = max(first, math.ceil((since - START) / STEP))
+    for match in MODIFIED_AFTER.finditer(fq):
+        after = datetime.fromisoformat(match.group(1).rstrip("Z"))
+        first = max(first, math.floor((after - START) / STEP) + 1)
+    return first
+
+
+def package_indexes(fq: str):
+    """
+    Indexes of the datasets of the `id:("<id>" OR ...)` filter, None without it.
+    """
+    match = PACKAGE_IDS.search(fq)
+    if match is None:
+        return None
+    return {int(ckan_id.split("-")[0]) for ckan_id in re.findall(r'"([^"]+)"', match.group(1))}
+
+
+def create_server(size: int, port: int = 0, seed: int = 0, host: str = "127.0.0.1", rows_max: int = MAX_ROWS) -> ThreadingHTTPServer:
+    """
+    Create the CKAN stand-in server, port 0 binds a free port.
+
+    Parameters
+    ----------
+    size: int. Number of datasets of the catalogue.
+    port: int. Port of the server.
+    seed: int. Seed of the catalogue.
+    host: str. Address of the server.
+    rows_max: int. Maximum datasets per page (CKAN `ckan.search.rows_max`), more rows are silently capped.
+
+    Returns
+    -------
+    http.server.ThreadingHTTPServer: The server, see `serve_forever()`.
+    """
+    server = ThreadingHTTPServer((host, port), CKANStubHandler)
+    server.daemon_threads = True
+    server.size = size
+    server.seed = seed
+    server.rows_max = rows_max
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", default="1k", help="Datasets of the catalogue: 1k, 10k, 100k or a number (default: 1k)")
+    parser.add_argument("--port", type=int, default=5000, help="Port, 0 for a free one (default: 5000)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the catalogue (default: 0)")
+    parser.add_argument("--rows-max", type=int, default=MAX_ROWS, help=f"CKAN ckan.search.rows_max (default: {MAX_ROWS})")
+    args = parser.parse_args()
+
+    server = create_server(catalogue_size(args.size), args.port, args.seed, rows_max=args.rows_max)
+    # First line of the output, read by run.py
+    print(f"http://{server.server_address[0]}:{server.server_address[1]}/", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,155 @@
+"""
+Import time of the ckan2pycsw entry points, measured with `python -X importtime`.
+
+    python benchmarks/importtime.py
+    python benchmarks/importtime.py --baseline benchmarks/results/importtime-<commit>.json
+
+Each module is imported in a new interpreter `--repeat` times, as the harvest
+(`ckan2pycsw`, also imported by each worker process, as `__mp_main__`) and the
+converter workers (`model.converter`) do. The median of the total import time
+and the slowest modules are reported, and the modules that must only be imported
+on the code paths that need them (`LAZY_MODULES`) are checked. The results are
+written to benchmarks/results/importtime-<commit>.json.
+"""
+# inbuilt libraries
+import argparse
+import json
+import os
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+BENCHMARKS_DIR = pathlib.Path(__file__).resolve().parent
+REPO_DIR = BENCHMARKS_DIR.parent
+APP_DIR = REPO_DIR / "ckan2pycsw"
+RESULTS_DIR = BENCHMARKS_DIR / "results"
+MODULES = ["ckan2pycsw", "model.converter"]
+# Debugger, scheduler and process management: only imported by ckan2pycsw.py when used
+LAZY_MODULES = ["ptvsd", "apscheduler", "psutil"]
+
+
+def git_commit() -> str:
+    """
+    Short hash of the checked out commit, "unknown" outside a git repository.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def import_times(module: str, app_dir: str) -> dict:
+    """
+    Import a module in a new interpreter with `-X importtime`.
+
+    Parameters
+    ----------
+    module: str. Module to import, from the ckan2pycsw folder.
+    app_dir: str. APP_DIR of the imported modules.
+
+    Returns
+    -------
+    dict: Imported module name to its (self, cumulative) import time in microseconds.
+    """
+    env = dict(os.environ, APP_DIR=app_dir, PYTHONPATH=str(APP_DIR))
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Only the first import of a module is timed
+        times.setdefault(name.strip(), (int(self_us), int(cumulative_us)))
+    return times
+
+
+def run(args) -> dict:
+    """
+    Measure the import time of each module of `MODULES`.
+
+    Parameters
+    ----------
+    args: argparse.Namespace. Command line arguments.
+
+    Returns
+    -------
+    dict: Benchmark results.
+    """
+    modules = {}
+    with tempfile.TemporaryDirectory(prefix="ckan2pycsw-importtime-") as app_dir:
+        for module in MODULES:
+            runs = [import_times(module, app_dir) for _ in range(args.repeat)]
+            last = runs[-1]
+            slowest = sorted(last.items(), key=lambda item: item[1][1], reverse=True)
+            modules[module] = {
+                "ms": round(statistics.median(times[module][1] for times in runs) / 1000, 1),
+                "imported_modules": len(last),
+                "lazy_modules_imported": sorted({name.split(".")[0] for name in last} & set(LAZY_MODULES)),
+                "slowest": {name: round(cumulative / 1000, 1) for name, (_, cumulative) in slowest[1:args.top + 1]},
+            }
+
+    return {
+        "commit": git_commit(),
+        "date": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"repeat": args.repeat},
+        "modules": modules,
+    }
+
+
+def compare(results: dict, baseline: dict) -> str:
+    """
+    Report of the import time of each module relative to a baseline run.
+
+    Parameters
+    ----------
+    results: dict. Benchmark results, see `run()`.
+    baseline: dict. Benchmark results of the baseline.
+
+    Returns
+    -------
+    str: Text report, one line per module.
+    """
+    lines = [f"baseline {baseline['commit']} -> {results['commit']}"]
+    for module, figures in results["modules"].items():
+        old = baseline["modules"].get(module, {}).get("ms")
+        ratio = f"{figures['ms'] / old:.2f}x" if old else "n/a"
+        lines.append(f"  {module + ' (ms)':<24} {old if old is not None else '-':>8} -> {figures['ms']:>8}  {ratio}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Imports of each module, the median is reported (default: 5)")
+    parser.add_argument("--top", type=int, default=10, help="Slowest modules reported per module (default: 10)")
+    parser.add_argument("--output", help="Results JSON file (default: benchmarks/results/importtime-<commit>.json)")
+    parser.add_argument("--baseline", help="Results JSON file of a previous run to compare with")
+    args = parser.parse_args()
+
+    results = run(args)
+    output = pathlib.Path(args.output) if args.output else RESULTS_DIR / f"importtime-{results['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+
+    for module, figures in results["modules"].items():
+        lazy = ", ".join(figures["lazy_modules_imported"]) or "none"
+        print(f"{module}: {figures['ms']} ms, {figures['imported_modules']} modules, lazy modules imported: {lazy}")
+        for name, ms in figures["slowest"].items():
+            print(f"  {name:<40} {ms:>8.1f} ms")
+    print(f"Results: {output}")
+    if args.baseline:
+        print(compare(results, json.loads(pathlib.Path(args.baseline).read_text())))
+    if any(figures["lazy_modules_imported"] for figures in results["modules"].values()):
+        sys.exit(1)
@@ -0,0 +1,278 @@
+"""
+GetRecords query latency of pycsw on a SQLite repository, without and with the search indexes.
+
+    python benchmarks/query_latency.py --size 10k
+    python benchmarks/query_latency.py --repository /tmp/ckan2pycsw-bench-<id>/cite.db
+
+The repository is built from the synthetic catalogue (only the record columns used
+by the queries: title, abstract, anytext and wkt_geometry), or copied from an
+existing one, e.g. harvested by `run.py --keep`. Each query of `QUERIES` is sent to
+the pycsw server (`pycsw.server.Csw`, as `wsgi.application` does) `--repeat` times
+on a copy without search indexes and on a copy with them
+(`model.sqlite_search.SearchIndexes`), and the median latencies are reported. The
+responses of both copies must be the same. The results are written to
+benchmarks/results/queries-<size>-<commit>.json.
+"""
+# inbuilt libraries
+import argparse
+import io
+import json
+import os
+import pathlib
+import platform
+import re
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime, timezone
+
+BENCHMARKS_DIR = pathlib.Path(__file__).resolve().parent
+REPO_DIR = BENCHMARKS_DIR.parent
+APP_DIR = REPO_DIR / "ckan2pycsw"
+RESULTS_DIR = BENCHMARKS_DIR / "results"
+TABLE = "records"
+BBOX_FILTER = (
+    "<ogc:BBOX><ogc:PropertyName>ows:BoundingBox</ogc:PropertyName><gml:Envelope>"
+    "<gml:lowerCorner>{miny} {minx}</gml:lowerCorner><gml:upperCorner>{maxy} {maxx}</gml:upperCorner>"
+    "</gml:Envelope></ogc:BBOX>"
+)
+LIKE_FILTER = (
+    '<ogc:PropertyIsLike wildCard="%" singleChar="_" escapeChar="\\">'
+    "<ogc:PropertyName>{name}</ogc:PropertyName><ogc:Literal>{value}</ogc:Literal></ogc:PropertyIsLike>"
+)
+# ogc:Filter of each GetRecords query
+QUERIES = {
+    "bbox_city": BBOX_FILTER.format(minx=-3.8, miny=40.3, maxx=-3.6, maxy=40.5),
+    "bbox_region": BBOX_FILTER.format(minx=-7.0, miny=38.0, maxx=-4.0, maxy=41.0),
+    "anytext_word": LIKE_FILTER.format(name="csw:AnyText", value="embalses"),
+    "anytext_phrase": LIKE_FILTER.format(name="csw:AnyText", value="%air quality%"),
+    "anytext_short": LIKE_FILTER.format(name="csw:AnyText", value="ab"),
+    "title": LIKE_FILTER.format(name="dc:title", value="%network 12%"),
+    "bbox_and_anytext": "<ogc:And>{}{}</ogc:And>".format(
+        BBOX_FILTER.format(minx=-7.0, miny=38.0, maxx=-4.0, maxy=41.0),
+        LIKE_FILTER.format(name="csw:AnyText", value="embalses"),
+    ),
+}
+GETRECORDS = (
+    '<csw:GetRecords xmlns:csw="http://www.opengis.net/cat/csw/2.0.2" xmlns:ogc="http://www.opengis.net/ogc" '
+    'xmlns:gml="http://www.opengis.net/gml" service="CSW" version="2.0.2" resultType="results" maxRecords="{max_records}">'
+    '<csw:Query typeNames="csw:Record"><csw:ElementSetName>brief</csw:ElementSetName>'
+    '<csw:Constraint version="1.1.0"><ogc:Filter>{filter}</ogc:Filter></csw:Constraint></csw:Query></csw:GetRecords>'
+)
+PYCSW_CONF = """[server]
+home={home}
+url=http://localhost/
+mimetype=application/xml; charset=UTF-8
+encoding=UTF-8
+language=en-US
+maxrecords=100
+
+[manager]
+transactions=false
+
+[metadata:main]
+identification_title=ckan2pycsw query benchmark
+
+[repository]
+database=sqlite:///{database}
+table={table}
+"""
+
+
+def git_commit() -> str:
+    """
+    Short hash of the checked out commit, "unknown" outside a git repository.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def build_repository(database: pathlib.Path, size: int, seed: int):
+    """
+    Create a SQLite pycsw repository with a record per dataset of the synthetic catalogue.
+
+    Parameters
+    ----------
+    database: pathlib.Path. SQLite database file.
+    size: int. Number of records.
+    seed: int. Seed of the catalogue.
+    """
+    from catalogue import iter_catalogue
+    from pycsw.core import admin, util
+    from shapely.geometry import shape
+
+    admin.setup_db(f"sqlite:///{database}", TABLE, "")
+    rows = []
+    for dataset in iter_catalogue(size, seed):
+        keywords = [tag["name"] for tag in dataset["tags"]]
+        minx, miny, maxx, maxy = shape(json.loads(dataset["spatial"])).bounds
+        rows.append((
+            dataset["id"],
+            "gmd:MD_Metadata",
+            "http://www.isotc211.org/2005/gmd",
+            "local",
+            dataset["metadata_modified"],
+            "<gmd:MD_Metadata xmlns:gmd=\"http://www.isotc211.org/2005/gmd\"/>",
+            " ".join([dataset["title"], dataset["notes"], *keywords]),
+            "dataset",
+            dataset["title"],
+            dataset["notes"],
+            ",".join(keywords),
+            util.bbox2wktpolygon(f"{minx:.2f},{miny:.2f},{maxx:.2f},{maxy:.2f}"),
+        ))
+    with sqlite3.connect(database) as conn:
+        conn.executemany(
+            f"INSERT INTO {TABLE} (identifier, typename, schema, mdsource, insert_date, xml, anytext, type, title, abstract, keywords, wkt_geometry) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+
+def get_records(config: str, query: str, max_records: int) -> tuple:
+    """
+    Send a GetRecords request to the pycsw server.
+
+    Parameters
+    ----------
+    config: str. pycsw configuration file.
+    query: str. ogc:Filter of the request.
+    max_records: int. Records per response.
+
+    Returns
+    -------
+    tuple: Seconds, number of records matched and response, without its timestamp.
+    """
+    from pycsw import server
+
+    body = GETRECORDS.format(max_records=max_records, filter=query).encode()
+    env = {
+        "REQUEST_METHOD": "POST",
+        "wsgi.input": io.BytesIO(body),
+        "CONTENT_LENGTH": str(len(body)),
+        "QUERY_STRING": "",
+        "PATH_INFO": "/",
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "80",
+        "wsgi.url_scheme": "http",
+    }
+    start = time.perf_counter()
+    _, contents = server.Csw(config, env).dispatch_wsgi()
+    seconds = time.perf_counter() - start
+    matched = re.search(rb'numberOfRecordsMatched="(\d+)"', contents)
+    if matched is None:
+        raise RuntimeError(f"GetRecords failed: {contents[:500]}")
+    return seconds, int(matched.group(1)), re.sub(rb'timestamp="[^"]*"', b"", contents)
+
+
+def run(args) -> dict:
+    """
+    Measure the latency of each query of `QUERIES` without and with the search indexes.
+
+    Parameters
+    ----------
+    args: argparse.Namespace. Command line arguments.
+
+    Returns
+    -------
+    dict: Benchmark results.
+    """
+    from catalogue import catalogue_size
+
+    work_dir = pathlib.Path(tempfile.mkdtemp(prefix="ckan2pycsw-queries-"))
+    os.environ.setdefault("APP_DIR", str(work_dir))
+    sys.path.insert(0, str(APP_DIR))
+    warnings.filterwarnings("ignore", category=FutureWarning, module="owslib")
+
+    from model.sqlite_search import SearchIndexes, enable_query_rewrite
+
+    databases = {"scan": work_dir / "scan.db", "indexed": work_dir / "indexed.db"}
+    try:
+        if args.repository:
+            shutil.copyfile(args.repository, databases["scan"])
+            with sqlite3.connect(databases["scan"]) as conn:
+                size = conn.execute(f"SELECT count(*) FROM {TABLE}").fetchone()[0]
+        else:
+            size = catalogue_size(args.size)
+            build_repository(databases["scan"], size, args.seed)
+        search_indexes = SearchIndexes(f"sqlite:///{databases['scan']}", TABLE)
+        search_indexes.drop()
+        search_indexes.engine.dispose()
+        shutil.copyfile(databases["scan"], databases["indexed"])
+
+        search_indexes = SearchIndexes(f"sqlite:///{databases['indexed']}", TABLE)
+        start = time.perf_counter()
+        search_indexes.build()
+        build_seconds = time.perf_counter() - start
+        search_indexes.engine.dispose()
+        enable_query_rewrite()
+
+        configs = {}
+        for name, database in databases.items():
+            configs[name] = work_dir / f"{name}.conf"
+            configs[name].write_text(PYCSW_CONF.format(home=work_dir, database=database, table=TABLE))
+
+        queries = {}
+        for name, query in QUERIES.items():
+            figures, responses = {}, {}
+            for database, config in configs.items():
+                # The first request creates the engine and loads the pycsw model
+                get_records(str(config), query, args.max_records)
+                runs = [get_records(str(config), query, args.max_records) for _ in range(args.repeat)]
+                figures[f"{database}_ms"] = round(1000 * statistics.median(seconds for seconds, _, _ in runs), 2)
+                figures["matched"] = runs[-1][1]
+                responses[database] = runs[-1][2]
+            figures["speedup"] = round(figures["scan_ms"] / figures["indexed_ms"], 2) if figures["indexed_ms"] else None
+            figures["same_response"] = responses["scan"] == responses["indexed"]
+            queries[name] = figures
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "commit": git_commit(),
+        "date": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "settings": {
+            "size": size,
+            "seed": args.seed,
+            "repository": args.repository,
+            "repeat": args.repeat,
+            "max_records": args.max_records,
+        },
+        "records": size,
+        "index_build_seconds": round(build_seconds, 3),
+        "queries": queries,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", default="10k", help="Records of the synthetic repository: 1k, 10k, 100k or a number (default: 10k)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the catalogue (default: 0)")
+    parser.add_argument("--repository", help="SQLite pycsw repository to copy instead of the synthetic one, e.g. cite.db of run.py --keep")
+    parser.add_argument("--repeat", type=int, default=5, help="Requests of each query per repository, the median is reported (default: 5)")
+    parser.add_argument("--max-records", type=int, default=10, help="GetRecords maxRecords (default: 10)")
+    parser.add_argument("--output", help="Results JSON file (default: benchmarks/results/queries-<size>-<commit>.json)")
+    args = parser.parse_args()
+
+    results = run(args)
+    output = pathlib.Path(args.output) if args.output else RESULTS_DIR / f"queries-{args.size if not args.repository else results['records']}-{results['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+
+    print(f"{results['records']} records, search indexes built in {results['index_build_seconds']} s")
+    print(f"  {'query':<18} {'matched':>8} {'scan (ms)':>10} {'indexed (ms)':>13} {'speedup':>8}")
+    for name, figures in results["queries"].items():
+        same = "" if figures["same_response"] else "  DIFFERENT RESPONSES"
+        print(f"  {name:<18} {figures['matched']:>8} {figures['scan_ms']:>10} {figures['indexed_ms']:>13} {figures['speedup']:>7}x{same}")
+    print(f"Results: {output}")
+    if not all(figures["same_response"] for figures in results["queries"].values()):
+        sys.exit(1)
@@ -0,0 +1,119 @@
+"""
+Differential check of the pycsw records built from the MCF against parse_record().
+
+    python benchmarks/record_diff.py --size 10k
+
+Each dataset of the synthetic catalogue is rendered to MCF and ISO XML once, then
+its record values are built by the output schema mapper (PYCSW_RECORD_BUILDER=mcf)
+and by pycsw.core.metadata.parse_record(). Any column with a different value is
+reported, and the exit status is 1. Both builders are timed.
+"""
+# inbuilt libraries
+import argparse
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+from collections import Counter
+
+BENCHMARKS_DIR = pathlib.Path(__file__).resolve().parent
+REPO_DIR = BENCHMARKS_DIR.parent
+APP_DIR = REPO_DIR / "ckan2pycsw"
+# Relative to the repository, as in the container
+MAPPINGS_FOLDER = "ckan2pycsw/mappings"
+URL = "http://127.0.0.1:5000/"
+
+
+def diff(args) -> int:
+    """
+    Compare the record values of both builders over the synthetic catalogue.
+
+    Parameters
+    ----------
+    args: argparse.Namespace. Command line arguments.
+
+    Returns
+    -------
+    int: Number of datasets whose records differ.
+    """
+    from catalogue import catalogue_size, iter_catalogue
+
+    size = catalogue_size(args.size)
+    work_dir = pathlib.Path(tempfile.mkdtemp(prefix="ckan2pycsw-diff-"))
+    os.environ.setdefault("APP_DIR", str(work_dir))
+    os.chdir(REPO_DIR)
+    sys.path.insert(0, str(APP_DIR))
+    warnings.filterwarnings("ignore", category=FutureWarning, module="owslib")
+
+    import pycsw.core.config
+    from pycsw.core import admin, metadata, repository
+
+    from model.converter import RECORD_MAPPERS, normalize_mcf, record_differences, record_values
+    from model.dataset import Dataset
+    from schemas.pygeometa.iso19139_inspire import ISO19139_inspireOutputSchema
+    from schemas.pygeometa.iso19139_inspire.record import UnsupportedRecord
+
+    database = f"sqlite:///{work_dir / 'cite.db'}"
+    admin.setup_db(database, "records", "")
+    context = pycsw.core.config.StaticContext()
+    repo = repository.Repository(database, context, table="records")
+    iso_os = ISO19139_inspireOutputSchema()
+    mapper = RECORD_MAPPERS["iso19139_inspire"]
+
+    seconds = Counter()
+    columns = Counter()
+    unsupported = Counter()
+    failed = Counter()
+    different = 0
+    for dataset in iter_catalogue(size, args.seed):
+        try:
+            mcf = normalize_mcf(Dataset(dataset_raw=dataset, base_url=URL, mappings_folder=MAPPINGS_FOLDER, csw_schema=args.ckan_schema).render_template)
+            xml = iso_os.write(mcf=mcf, stringify=False, mappings_folder=MAPPINGS_FOLDER)
+        except Exception as e:
+            failed[type(e).__name__] += 1
+            continue
+
+        start = time.perf_counter()
+        parsed = record_values(metadata.parse_record(context, xml, repo)[0])
+        seconds["parse_record"] += time.perf_counter() - start
+        start = time.perf_counter()
+        try:
+            values = mapper(context, mcf, xml)
+        except UnsupportedRecord as e:
+            unsupported[str(e)[:60]] += 1
+            continue
+        seconds["mcf"] += time.perf_counter() - start
+
+        differences = record_differences(values, parsed)
+        if differences:
+            different += 1
+            for column, value, reference in differences:
+                if not columns[column] and args.verbose:
+                    print(f"{dataset['name']} {column}: {value!r} != {reference!r}")
+                columns[column] += 1
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+    compared = size - sum(failed.values()) - sum(unsupported.values())
+    print(f"{size} datasets: {compared} compared, {different} different, {sum(unsupported.values())} unsupported (parse_record), {sum(failed.values())} not rendered")
+    for column, count in columns.most_common():
+        print(f"  {column:<24} {count:>8} different")
+    for reason, count in unsupported.most_common():
+        print(f"  unsupported: {reason} ({count})")
+    for name, count in failed.most_common():
+        print(f"  not rendered: {name} ({count})")
+    for name in ("parse_record", "mcf"):
+        print(f"  {name:<14} {seconds[name]:>10.3f} s  {1000 * seconds[name] / max(compared, 1):>8.3f} ms/dataset")
+    return different
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", default="1k", help="Datasets of the catalogue: 1k, 10k, 100k or a number (default: 1k)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the catalogue (default: 0)")
+    parser.add_argument("--ckan-schema", default="iso19139_geodcatap", help="CKAN schema (default: iso19139_geodcatap)")
+    parser.add_argument("--verbose", action="store_true", help="Print the first difference of each column")
+    args = parser.parse_args()
+    sys.exit(1 if diff(args) else 0)
@@ -0,0 +1,321 @@
+"""
+Harvest benchmark of ckan2pycsw over a synthetic catalogue served by a local CKAN stand-in.
+
+    python benchmarks/run.py --size 10k
+    python benchmarks/run.py --size 10k --baseline benchmarks/results/10k-<commit>.json
+
+Each stage is timed per dataset: fetch (get_datasets), render (Dataset, CKAN
+template to MCF), read_mcf (normalize_mcf), write (ISO19139_inspireOutputSchema.write),
+parse_record (record values, built from the MCF or by parse_record, see
+--record-builder), insert and export (export_records). The results are written
+to benchmarks/results/<size>-<commit>.json.
+"""
+# inbuilt libraries
+import argparse
+import json
+import os
+import pathlib
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BENCHMARKS_DIR = pathlib.Path(__file__).resolve().parent
+REPO_DIR = BENCHMARKS_DIR.parent
+APP_DIR = REPO_DIR / "ckan2pycsw"
+RESULTS_DIR = BENCHMARKS_DIR / "results"
+# Relative to the repository, as in the container
+MAPPINGS_FOLDER = "ckan2pycsw/mappings"
+STAGES = ["fetch", "render", "read_mcf", "write", "parse_record", "insert", "export"]
+
+
+class StageTimer:
+    def __init__(self):
+        """
+        Constructor of the StageTimer class.
+
+        Accumulates the wall time and the number of calls of each stage.
+
+        Attributes
+        ----------
+        seconds: collections.defaultdict. Seconds per stage.
+        calls: collections.Counter. Calls per stage.
+        """
+        self.seconds = defaultdict(float)
+        self.calls = Counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time a block of code as part of a stage.
+
+        Parameters
+        ----------
+        name: str. Name of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+            self.calls[name] += 1
+
+    def summary(self, datasets: int) -> dict:
+        """
+        Seconds, calls, milliseconds per dataset and share of the total of each stage.
+
+        Parameters
+        ----------
+        datasets: int. Number of harvested datasets.
+
+        Returns
+        -------
+        dict: Stage name to its figures, in pipeline order.
+        """
+        total = sum(self.seconds.values()) or 1
+        return {
+            name: {
+                "seconds": round(self.seconds[name], 4),
+                "calls": self.calls[name],
+                "ms_per_dataset": round(1000 * self.seconds[name] / max(datasets, 1), 4),
+                "share": round(self.seconds[name] / total, 4),
+            }
+            for name in STAGES + sorted(set(self.seconds) - set(STAGES)) if name in self.seconds
+        }
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of the process in MiB, None if not available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KiB on Linux
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_commit() -> str:
+    """
+    Short hash of the checked out commit, "unknown" outside a git repository.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+@contextmanager
+def ckan_stub(size: int, seed: int):
+    """
+    Run the CKAN stand-in in another process, so serving pages does not take time from the harvest.
+
+    Returns
+    -------
+    str: Base URL of the CKAN stand-in.
+    """
+    process = subprocess.Popen(
+        [sys.executable, str(BENCHMARKS_DIR / "ckan_stub.py"), "--size", str(size), "--port", "0", "--seed", str(seed)],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        yield process.stdout.readline().strip()
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def run(args) -> dict:
+    """
+    Harvest the synthetic catalogue into a new SQLite repository, timing each stage.
+
+    Parameters
+    ----------
+    args: argparse.Namespace. Command line arguments.
+
+    Returns
+    -------
+    dict: Benchmark results.
+    """
+    from catalogue import catalogue_size
+
+    size = catalogue_size(args.size)
+    work_dir = pathlib.Path(tempfile.mkdtemp(prefix="ckan2pycsw-bench-"))
+    os.environ.setdefault("APP_DIR", str(work_dir))
+    os.chdir(REPO_DIR)
+    sys.path.insert(0, str(APP_DIR))
+    warnings.filterwarnings("ignore", category=FutureWarning, module="owslib")
+
+    import pycsw.core.config
+    from pycsw.core import admin, metadata, repository
+
+    from ckan2pycsw import get_datasets, get_field_list
+    from model.bulk_writer import BulkWriter
+    from model.ckan_fetcher import CKANFetcher
+    from model.converter import RECORD_MAPPERS, normalize_mcf, record_values
+    from model.dataset import Dataset
+    from model.template import get_record_preprocessor
+    from schemas.pygeometa.iso19139_inspire import ISO19139_inspireOutputSchema
+    from schemas.pygeometa.iso19139_inspire.record import UnsupportedRecord
+
+    database = f"sqlite:///{work_dir / 'cite.db'}"
+    table = "records"
+    admin.setup_db(database, table, "")
+    context = pycsw.core.config.StaticContext()
+    repo = repository.Repository(database, context, table=table)
+    writer = BulkWriter(repo, context, batch_size=args.batch_size, fresh_build=True)
+    iso_os = ISO19139_inspireOutputSchema()
+    mapper = RECORD_MAPPERS["iso19139_inspire"] if args.record_builder == "mcf" else None
+    # Parsed once per process by DatasetConverter, not per dataset
+    get_record_preprocessor(args.ckan_schema, MAPPINGS_FOLDER)
+    timer = StageTimer()
+    errors = Counter()
+    harvested = 0
+
+    with ckan_stub(size, args.seed) as url:
+        fetcher = CKANFetcher(url, rows=args.rows, workers=args.fetch_workers, stream=args.stream)
+        fields = get_field_list(fetcher, args.fl, args.ckan_schema)
+        datasets = get_datasets(url, fetcher=fetcher, fields=fields)
+        start = time.perf_counter()
+        while True:
+            with timer.stage("fetch"):
+                dataset = next(datasets, None)
+            if dataset is None:
+                break
+            try:
+                with timer.stage("render"):
+                    mcf = Dataset(dataset_raw=dataset, base_url=url, mappings_folder=MAPPINGS_FOLDER, csw_schema=args.ckan_schema).render_template
+                with timer.stage("read_mcf"):
+                    mcf_dict = normalize_mcf(mcf)
+                with timer.stage("write"):
+                    xml = iso_os.write(mcf=mcf_dict, stringify=False, mappings_folder=MAPPINGS_FOLDER)
+                with timer.stage("parse_record"):
+                    values = None
+                    if mapper is not None:
+                        try:
+                            values = mapper(context, mcf_dict, xml)
+                        except UnsupportedRecord:
+                            pass
+                    if values is None:
+                        values = record_values(metadata.parse_record(context, xml, repo)[0])
+            except Exception as e:
+                errors[type(e).__name__] += 1
+                continue
+            with timer.stage("insert"):
+                writer.add({
+                    "id": dataset["id"],
+                    "name": dataset["name"],
+                    "dcat_type": dataset["dcat_type"].rsplit("/", 1)[-1],
+                    "values": values,
+                })
+            harvested += 1
+        with timer.stage("insert"):
+            writer.close()
+        with timer.stage("export"):
+            admin.export_records(context, database, table=table, xml_dirpath=str(work_dir / "metadata") + "/")
+        elapsed = time.perf_counter() - start
+
+    if args.keep:
+        print(f"Repository and exported records: {work_dir}")
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "commit": git_commit(),
+        "date": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "size": size,
+            "seed": args.seed,
+            "rows": args.rows,
+            "fetch_workers": args.fetch_workers,
+            "stream": args.stream,
+            "fl": args.fl,
+            "batch_size": args.batch_size,
+            "ckan_schema": args.ckan_schema,
+            "record_builder": args.record_builder,
+        },
+        "datasets": size,
+        "harvested": harvested,
+        "failed": sum(errors.values()),
+        "errors": dict(errors),
+        "failed_pages": fetcher.failed_pages,
+        "fetched_bytes": fetcher.bytes_fetched,
+        "seconds": round(elapsed, 3),
+        "datasets_per_second": round(harvested / elapsed, 2) if elapsed else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": timer.summary(size),
+    }
+
+
+def compare(results: dict, baseline: dict) -> str:
+    """
+    Report of the throughput and per-stage time of a run relative to a baseline run.
+
+    Parameters
+    ----------
+    results: dict. Benchmark results, see `run()`.
+    baseline: dict. Benchmark results of the baseline.
+
+    Returns
+    -------
+    str: Text report, one line per figure.
+    """
+    def ratio(new, old):
+        return f"{new / old:.2f}x" if new and old else "n/a"
+
+    lines = [
+        f"baseline {baseline['commit']} -> {results['commit']} ({results['datasets']} datasets)",
+        f"  datasets/s         {baseline['datasets_per_second']:>10} -> {results['datasets_per_second']:>10}  {ratio(results['datasets_per_second'], baseline['datasets_per_second'])}",
+        f"  peak RSS (MiB)     {baseline['peak_rss_mb']:>10} -> {results['peak_rss_mb']:>10}  {ratio(results['peak_rss_mb'], baseline['peak_rss_mb'])}",
+    ]
+    for name in results["stages"]:
+        old = baseline["stages"].get(name, {}).get("ms_per_dataset")
+        new = results["stages"][name]["ms_per_dataset"]
+        lines.append(f"  {name + ' (ms)':<18} {old if old is not None else '-':>10} -> {new:>10}  {ratio(new, old)}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", default="1k", help="Datasets of the catalogue: 1k, 10k, 100k or a number (default: 1k)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the catalogue (default: 0)")
+    parser.add_argument("--rows", type=int, default=100, help="CKAN package_search rows per page (default: 100)")
+    parser.add_argument("--fetch-workers", type=int, default=4, help="CKAN page requests in flight (default: 4)")
+    parser.add_argument("--stream", action="store_true", help="Decode the CKAN pages from the response stream")
+    parser.add_argument("--fl", default="auto", help="package_search field list: auto (fields of the CKAN schema templates), all or a comma-separated list (default: auto)")
+    parser.add_argument("--batch-size", type=int, default=500, help="Records inserted per transaction (default: 500)")
+    parser.add_argument("--ckan-schema", default="iso19139_geodcatap", help="CKAN schema (default: iso19139_geodcatap)")
+    parser.add_argument("--record-builder", choices=["mcf", "parse_record"], default="mcf", help="Build the record values from the MCF or with parse_record (default: mcf)")
+    parser.add_argument("--output", help="Results JSON file (default: benchmarks/results/<size>-<commit>.json)")
+    parser.add_argument("--keep", action="store_true", help="Keep the SQLite repository and the exported records")
+    parser.add_argument("--baseline", help="Results JSON file of a previous run to compare with")
+    args = parser.parse_args()
+    # run() changes the working directory to the repository
+    output = pathlib.Path(args.output).resolve() if args.output else None
+    baseline = pathlib.Path(args.baseline).resolve() if args.baseline else None
+
+    results = run(args)
+    output = output or RESULTS_DIR / f"{args.size}-{results['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+
+    print(json.dumps({key: results[key] for key in ("datasets", "harvested", "failed", "seconds", "datasets_per_second", "peak_rss_mb")}))
+    for name, stage in results["stages"].items():
+        print(f"  {name:<14} {stage['seconds']:>10.3f} s  {stage['ms_per_dataset']:>8.3f} ms/dataset  {100 * stage['share']:>5.1f} %")
+    print(f"Results: {output}")
+    if baseline:
+        print(compare(results, json.loads(baseline.read_text())))
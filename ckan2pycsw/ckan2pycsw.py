@@ -1,31 +1,34 @@
 # inbuilt libraries
+import hashlib
 import logging
 import pathlib
 from configparser import ConfigParser
-from urllib.parse import urljoin
 import os
-from datetime import datetime, time
+from datetime import datetime
 import subprocess
-import time
+import sys
+from contextlib import closing
 
 # third-party libraries
-import psutil
 import requests
 import pycsw.core.config
-from pycsw.core import admin, metadata, repository, util
-from pygeometa.core import read_mcf
-from pygeometa.schemas.iso19139 import ISO19139OutputSchema
-from apscheduler.schedulers.blocking import BlockingScheduler
+from pycsw.core import repository
 
 # custom functions
 from config.log import log_file
 
 # custom classes
-from model.dataset import Dataset
-from schemas.pygeometa.iso19139_inspire import ISO19139_inspireOutputSchema
-
-# debug
-import ptvsd
+from model.bulk_writer import BulkWriter
+from model.ckan_fetcher import KEYSET_SORT, CKANFetcher, solr_datetime
+from model.converter import convert_datasets
+from model.metrics import METRICS, start_metrics_server, write_run_summary
+from model.pipeline import pipe
+from model.postgresql import STAGING_SUFFIX, StagingTables
+from model.record_payloads import PayloadBuilder, RecordPayloads
+from model.response_cache import GENERATION_FILE, bump_generation
+from model.sqlite_search import SearchIndexes, register_functions
+from model.sync_state import SyncState, content_hash, files_version
+from model.template import get_ckan_template_fields
 
 # Ennvars
 TZ = os.environ.get("TZ", "TZ")
@@ -37,6 +40,42 @@ try:
     PYCSW_CRON_HOUR_START = int(os.environ["PYCSW_CRON_HOUR_START"])
 except (KeyError, ValueError):
     PYCSW_CRON_HOUR_START = 4
+try:
+    PYCSW_CKAN_ROWS = int(os.environ["PYCSW_CKAN_ROWS"])
+except (KeyError, ValueError):
+    PYCSW_CKAN_ROWS = 100
+try:
+    PYCSW_CKAN_WORKERS = int(os.environ["PYCSW_CKAN_WORKERS"])
+except (KeyError, ValueError):
+    PYCSW_CKAN_WORKERS = 4
+try:
+    PYCSW_CKAN_RETRIES = int(os.environ["PYCSW_CKAN_RETRIES"])
+except (KeyError, ValueError):
+    PYCSW_CKAN_RETRIES = 3
+try:
+    PYCSW_INSERT_BATCH_SIZE = int(os.environ["PYCSW_INSERT_BATCH_SIZE"])
+except (KeyError, ValueError):
+    PYCSW_INSERT_BATCH_SIZE = 500
+try:
+    PYCSW_CONVERT_WORKERS = int(os.environ["PYCSW_CONVERT_WORKERS"])
+except (KeyError, ValueError):
+    PYCSW_CONVERT_WORKERS = os.cpu_count() or 1
+try:
+    PYCSW_FETCH_QUEUE_SIZE = int(os.environ["PYCSW_FETCH_QUEUE_SIZE"])
+except (KeyError, ValueError):
+    PYCSW_FETCH_QUEUE_SIZE = PYCSW_CKAN_ROWS * 2
+try:
+    PYCSW_CONVERT_QUEUE_SIZE = int(os.environ["PYCSW_CONVERT_QUEUE_SIZE"])
+except (KeyError, ValueError):
+    PYCSW_CONVERT_QUEUE_SIZE = PYCSW_CONVERT_WORKERS * 2
+try:
+    PYCSW_WRITE_QUEUE_SIZE = int(os.environ["PYCSW_WRITE_QUEUE_SIZE"])
+except (KeyError, ValueError):
+    PYCSW_WRITE_QUEUE_SIZE = PYCSW_INSERT_BATCH_SIZE
+try:
+    PYCSW_METRICS_PORT = int(os.environ["PYCSW_METRICS_PORT"])
+except (KeyError, ValueError):
+    PYCSW_METRICS_PORT = None
 method = "nightly"
 URL = os.environ.get("CKAN_URL", 'http://localhost:5000/')
 PYCSW_PORT = os.environ.get("PYCSW_PORT", 8000)
@@ -47,143 +86,733 @@ CKAN_API = "api/3/action/package_search"
 PYCSW_CKAN_SCHEMA = os.environ.get("PYCSW_CKAN_SCHEMA", "iso19139_geodcatap")
 PYCSW_OUPUT_SCHEMA = os.environ.get("PYCSW_OUPUT_SCHEMA", "iso19139_inspire")
 DEV_MODE = os.environ.get("DEV_MODE", False)
+PYCSW_FULL_REBUILD = os.environ.get("PYCSW_FULL_REBUILD", False)
+PYCSW_CKAN_STREAM = os.environ.get("PYCSW_CKAN_STREAM", False)
+PYCSW_CKAN_KEYSET = os.environ.get("PYCSW_CKAN_KEYSET", True)
+PYCSW_METRICS_TEXTFILE = os.environ.get("PYCSW_METRICS_TEXTFILE")
+PYCSW_CKAN_FL = os.environ.get("PYCSW_CKAN_FL", "auto")
+PYCSW_CKAN_FQ_DCAT_TYPE = os.environ.get("PYCSW_CKAN_FQ_DCAT_TYPE", True)
+PYCSW_SQLITE_SEARCH_INDEXES = os.environ.get("PYCSW_SQLITE_SEARCH_INDEXES", True)
+PYCSW_RECORD_PAYLOADS = os.environ.get("PYCSW_RECORD_PAYLOADS", True)
 PYCSW_CONF = f"{APP_DIR}/pycsw.conf.template" if DEV_MODE == "True" else "pycsw.conf"
 MAPPINGS_FOLDER = "ckan2pycsw/mappings"
+SCHEMAS_FOLDER = pathlib.Path(__file__).resolve().parent / "schemas"
 log_module = "[ckan2pycsw]"
-OUPUT_SCHEMA = {
-    "iso19139_inspire": ISO19139_inspireOutputSchema,
-    "iso19139": ISO19139OutputSchema
-}
+SHADOW_SUFFIX = ".shadow"
+# CKAN package ids per package_search query of the retry pass
+ID_QUERY_SIZE = 50
+# DCAT types of the harvested datasets (last part of the dcat_type URI)
+DCAT_TYPES = ["dataset", "series", "service"]
+# CKAN dataset fields used by ckan2pycsw itself, see get_field_list()
+CKAN_FIELDS = ["id", "name", "type", "dcat_type", "metadata_modified"]
 
 
-def get_datasets(base_url):
+def get_datasets(base_url, modified_since=None, fetcher=None, fq=None, fields=None):
     """
     Retrieve a generator of CKAN datasets from the specified CKAN instance.
 
+    Pages are retrieved through a pooled HTTP session and yielded in a stable order (`metadata_modified asc, id asc`). If `PYCSW_CKAN_KEYSET` is set, each page is filtered to the datasets after the last one of the previous page, so datasets modified or deleted while paging do not make it skip others, see `CKANFetcher.iter_keyset_pages()`; otherwise pages are retrieved by offset, `PYCSW_CKAN_WORKERS` at a time. Each page is retried with backoff, a page that still fails is logged and recorded in `fetcher.failed_pages`.
+
+    Only datasets of type 'dataset' and of a DCAT type of `DCAT_TYPES` are retrieved, the filters are sent to CKAN, see `search_params()`.
+
     Parameters
     ----------
     base_url: str. The base URL of the CKAN instance.
+    modified_since: str, optional. ISO 8601 timestamp, only datasets with a `metadata_modified` equal or later are retrieved.
+    fetcher: CKANFetcher, optional. Fetcher to use, default: a new one configured from envvars.
+    fq: str, optional. Extra Solr filter query, e.g. 'id:("<id>")'.
+    fields: list, optional. Dataset fields to retrieve (`fl`), default: all, see `get_field_list()`.
 
     Returns
     -------
     generator: A generator that yields CKAN datasets.
-
-    Raises
-    ------
-    requests.exceptions.RequestException: If an error occurs while communicating with the CKAN instance.
     """
+    if fetcher is None:
+        fetcher = CKANFetcher(base_url, rows=PYCSW_CKAN_ROWS, workers=PYCSW_CKAN_WORKERS, retries=PYCSW_CKAN_RETRIES, stream=str(PYCSW_CKAN_STREAM).lower() == "true")
+    params = search_params(modified_since, fq)
+    if fields:
+        params["fl"] = ",".join(fields)
     try:
-        if not base_url.endswith("/"):
-            base_url += "/"
-        package_search = urljoin(base_url, "api/3/action/package_search")
-        res = requests.get(package_search, params={"rows": 0})
-        res.raise_for_status()  # Raises a HTTPError if the response is not 200
-        end = res.json().get("result", {}).get("count", 0)
-        rows = 10
-        for start in range(0, end, rows):
-            res = requests.get(package_search, params={"start": start, "rows": rows})
-            res.raise_for_status()  # Check response status
-            try:
-                datasets = res.json()["result"]["results"]
-            except ValueError as e:  # Catch JSON decode error
-                logging.error(f"Error decoding JSON from response: {e}")
-                continue  # Skip to the next iteration
-
-            for dataset in datasets:
-                if "dcat_type" not in dataset:
-                    dataset["dcat_type"] = "http://inspire.ec.europa.eu/metadata-codelist/ResourceType/dataset"
-                
-                if dataset.get("type") == "dataset":
-                    yield dataset
-    except requests.exceptions.RequestException as e:
+        for dataset in fetcher.get_datasets(params, keyset=str(PYCSW_CKAN_KEYSET).lower() == "true"):
+            if "dcat_type" not in dataset:
+                dataset["dcat_type"] = "http://inspire.ec.europa.eu/metadata-codelist/ResourceType/dataset"
+
+            if dataset.get("type") == "dataset" and dataset["dcat_type"].rsplit("/", 1)[-1] in DCAT_TYPES:
+                yield dataset
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        # Only the initial count request of the offset paging can get here, pages are retried and skipped by the fetcher
         logging.error(f"Request error while communicating with CKAN instance {base_url}: {e}")
-    except Exception as e:
-        logging.error(f"Unexpected error: {e}")
+        fetcher.failed_pages.append(0)
+
+def search_params(modified_since=None, fq=None):
+    """
+    Parameters of the `package_search` requests of the harvest.
+
+    The dataset type and, if `PYCSW_CKAN_FQ_DCAT_TYPE` is set, the DCAT type filters are sent
+    to CKAN, so the packages that are not harvested are not downloaded. Datasets are still
+    checked after download.
 
-def main():
+    Parameters
+    ----------
+    modified_since: str, optional. ISO 8601 timestamp, only datasets with a `metadata_modified` equal or later are retrieved.
+    fq: str, optional. Extra Solr filter query.
+
+    Returns
+    -------
+    dict: `sort` and `fq` parameters.
+    """
+    filters = ["dataset_type:dataset"]
+    if str(PYCSW_CKAN_FQ_DCAT_TYPE).lower() == "true":
+        filters.append(dcat_type_filter(DCAT_TYPES))
+    if modified_since:
+        filters.append(f"metadata_modified:[{solr_datetime(modified_since)} TO *]")
+    if fq:
+        filters.append(fq)
+    return {"sort": KEYSET_SORT, "fq": " AND ".join(filters)}
+
+def dcat_type_filter(dcat_types):
     """
-    Convert metadata from CKAN to ISO19139 and store the records in a pycsw endpoint.
+    Solr filter of the datasets with a `dcat_type` URI ending in one of `dcat_types`.
+
+    Datasets without `dcat_type` are harvested as 'dataset', so they are included if 'dataset' is.
 
-    The function first sets up logging and reads the pycsw configuration from the specified file. It then checks if the pycsw database file exists and deletes it if it does.
-    
-    The database is then initialized using `pycsw.core.admin.setup_db()`. pycsw records are created and inserted into the database for each CKAN dataset that has a DCAT type of 'dataset', 'series', or 'service'.
-    
-    The records are created by rendering the CKAN metadata using a Jinja2 template and then transforming the resulting MCF dictionary into an XML string using a pycsw output schema.
-    
-    The function logs any errors that occur during this process and continues processing any remaining datasets.
-    
-    After all records have been inserted, the function exports them to the specified XML directory using
-    `pycsw.core.admin.export_records()`.
+    Parameters
+    ----------
+    dcat_types: list. DCAT types, e.g. ["dataset", "series"].
+
+    Returns
+    -------
+    str: Solr filter query.
+    """
+    types = " OR ".join(f"*\\/{dcat_type}" for dcat_type in dcat_types)
+    if "dataset" in dcat_types:
+        return f"(dcat_type:({types}) OR (*:* -dcat_type:[* TO *]))"
+    return f"dcat_type:({types})"
+
+def get_field_list(fetcher, field_list=PYCSW_CKAN_FL, ckan_schema=PYCSW_CKAN_SCHEMA):
+    """
+    Dataset fields to retrieve from CKAN (`package_search` `fl`), so the fields not used are not downloaded.
+
+    Parameters
+    ----------
+    fetcher: CKANFetcher. Fetcher of the harvest, used to check that CKAN returns the fields as in the full datasets.
+    field_list: str. 'auto': the fields read by the templates of `ckan_schema`, see `model.template.get_ckan_template_fields()`,
+        a comma-separated list of fields, or 'all' (no field list). `CKAN_FIELDS` are always retrieved.
+    ckan_schema: str. CKAN schema of the harvest.
+
+    Returns
+    -------
+    list or None: Sorted field names, None to retrieve all the fields.
+    """
+    field_list = str(field_list).strip()
+    if field_list.lower() in ("", "*", "all", "false"):
+        return None
+    if field_list.lower() == "auto":
+        fields = get_ckan_template_fields(ckan_schema)
+        if fields is None:
+            return None
+    else:
+        fields = [field.strip() for field in field_list.split(",") if field.strip()]
+    fields = sorted(set(fields) | set(CKAN_FIELDS))
+    try:
+        supported = fetcher.supports_field_list(search_params(), fields)
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        logging.error(f"{log_module}:ckan2pycsw | Fail when checking the field list with CKAN: {URL} Error: {e}")
+        supported = False
+    if not supported:
+        logging.warning(f"{log_module}:ckan2pycsw | Retrieving all the dataset fields from CKAN")
+        return None
+    logging.info(f"{log_module}:ckan2pycsw | Dataset fields retrieved from CKAN: {','.join(fields)}")
+    return fields
+
+def get_datasets_by_id(base_url, ckan_ids, fetcher=None, fields=None):
+    """
+    Retrieve CKAN datasets by package id, `ID_QUERY_SIZE` ids per query.
+
+    Parameters
+    ----------
+    base_url: str. The base URL of the CKAN instance.
+    ckan_ids: iterable. CKAN package ids, datasets deleted or made private are not retrieved.
+    fetcher: CKANFetcher, optional. Fetcher to use, see `get_datasets()`.
+    fields: list, optional. Dataset fields to retrieve, see `get_datasets()`.
+
+    Returns
+    -------
+    generator: A generator that yields CKAN datasets.
+    """
+    ckan_ids = list(ckan_ids)
+    for i in range(0, len(ckan_ids), ID_QUERY_SIZE):
+        ids = " OR ".join(f'"{ckan_id}"' for ckan_id in ckan_ids[i:i + ID_QUERY_SIZE])
+        yield from get_datasets(base_url, fetcher=fetcher, fq=f"id:({ids})", fields=fields)
+
+def delete_records(repo, context, identifiers, payloads=None):
+    """
+    Delete pycsw records from the repository.
+
+    Parameters
+    ----------
+    repo: pycsw.core.repository.Repository. The pycsw repository.
+    context: pycsw.core.config.StaticContext. The pycsw context.
+    identifiers: iterable. Identifiers of the records to delete.
+    payloads: model.record_payloads.RecordPayloads, optional. GetRecordById payloads of the records, also deleted.
+
+    Returns
+    -------
+    None
+    """
+    identifier_column = context.md_core_model["mappings"]["pycsw:Identifier"]
+    identifiers = list(identifiers)
+    for identifier in identifiers:
+        logging.info(f"{log_module}:ckan2pycsw | Delete record: {identifier}")
+        repo.delete({"where": f"{identifier_column} = :pvalue0", "values": [identifier]})
+    if payloads is not None and identifiers:
+        with payloads.engine.begin() as conn:
+            payloads.delete(conn, identifiers)
+
+def sqlite_path(database):
+    """
+    Get the file path of a SQLite database URL.
+
+    Parameters
+    ----------
+    database: str. SQLAlchemy URL of the pycsw repository.
+
+    Returns
+    -------
+    str or None: Absolute path of the database file, None if the database is not SQLite.
+    """
+    if not database.startswith("sqlite:"):
+        return None
+    return "/" + database.split("//")[-1].lstrip("/")
+
+def swap_database(shadow_path, database_path):
+    """
+    Atomically replace the live SQLite database with the shadow database.
+
+    Readers that already opened the previous file finish their query on it, new connections open the new file. The pycsw engines of both files in this process (memoized by URL, `Repository._engines`) are disposed, so no pooled connection keeps reading the previous file; the pycsw servers reopen theirs, see `model.sqlite_search.reopen_replaced_databases()`.
+
+    Parameters
+    ----------
+    shadow_path: str. Path of the harvested shadow database.
+    database_path: str. Path of the live database.
+
+    Returns
+    -------
+    None
+    """
+    for suffix in ("-wal", "-shm"):
+        # A write-ahead log of the live database must not be applied to the new file
+        if pathlib.Path(database_path + suffix).exists():
+            os.remove(database_path + suffix)
+    os.replace(shadow_path, database_path)
+    for url, engine in list(repository.Repository._engines.items()):
+        if sqlite_path(url) in (shadow_path, database_path):
+            del repository.Repository._engines[url]
+            engine.dispose()
+    logging.info(f"{log_module}:ckan2pycsw | Database swapped in: {shadow_path} -> {database_path}")
+
+def main(retry_only=False):
+    """
+    Harvest the CKAN datasets into the pycsw endpoint, see `harvest()`, and report the run.
+
+    `python ckan2pycsw.py retry` runs only the retry pass of the datasets that failed in previous runs.
+
+    The time of each stage (fetch, render, read_mcf, write, parse_record, payload, insert, index and export) and the dataset, page and byte counters are recorded in `model.metrics.METRICS`. When the run ends, its summary is logged and appended to `APP_DIR/log/ckan2pycsw-runs.jsonl`, and the metrics are written to `PYCSW_METRICS_TEXTFILE` for the node_exporter textfile collector, if set. They are also served at `/metrics` on `PYCSW_METRICS_PORT`, if set.
+
+    When the run ends, the harvest generation (`PYCSW_CACHE_GENERATION_FILE`) is increased, which invalidates the responses cached by the pycsw servers, see `model.response_cache.ResponseCache`.
+
+    Parameters
+    ----------
+    retry_only: bool. Only retry the datasets that failed in previous runs.
 
     Returns
     -------
     None
     """
     log_file(APP_DIR + "/log")
+    METRICS.start_run()
+    result = "error"
+    try:
+        result = "success" if harvest(retry_only) else "incomplete"
+    finally:
+        # The records may have changed even if the run failed
+        try:
+            generation = bump_generation(GENERATION_FILE)
+            logging.info(f"{log_module}:ckan2pycsw | Harvest generation: {generation}")
+        except OSError as e:
+            logging.error(f"{log_module}:ckan2pycsw | Fail when updating the harvest generation: {GENERATION_FILE} Error: {e}")
+        report_run(result)
+
+def report_run(result):
+    """
+    Log and store the summary of a harvest run, and update the run metrics.
+
+    Parameters
+    ----------
+    result: str. Result of the run: success, incomplete (pages not retrieved from CKAN) or error.
+
+    Returns
+    -------
+    None
+    """
+    METRICS.inc("harvest_runs_total", result=result)
+    summary = METRICS.run_summary()
+    summary["result"] = result
+    end = datetime.now().timestamp()
+    METRICS.set("harvest_last_run_seconds", summary["seconds"])
+    METRICS.set("harvest_last_run_timestamp_seconds", end)
+    if result == "success":
+        METRICS.set("harvest_last_success_timestamp_seconds", end)
+
+    # Conversion stages are summed over the worker processes
+    stages = ", ".join(f"{stage} {figures['seconds']}s ({figures['mean_ms']} ms x {figures['count']})" for stage, figures in summary["stages"].items())
+    logging.info(f"{log_module}:ckan2pycsw | Run {result} in {summary['seconds']}s. Stages: {stages}")
+    try:
+        write_run_summary(APP_DIR + "/log/ckan2pycsw-runs.jsonl", summary)
+        if PYCSW_METRICS_TEXTFILE:
+            METRICS.write_textfile(PYCSW_METRICS_TEXTFILE)
+    except OSError as e:
+        logging.error(f"{log_module}:ckan2pycsw | Fail when writing the run summary and metrics. Error: {e}")
+
+def harvest(retry_only=False):
+    """
+    Convert the CKAN datasets to ISO19139 records and store them in the pycsw repository.
+
+    By default the harvest is incremental: only the datasets modified since the `metadata_modified` watermark of the last run are retrieved, see `select_datasets()`. If `PYCSW_FULL_REBUILD` is set, or the records table does not exist yet, every dataset is harvested into a shadow database or staging tables, swapped in when finished, see `HarvestRun`. The datasets are fetched, converted and written as a pipeline, checkpointed after each batch of records, see `write_datasets()`; the datasets that failed in previous runs are retried at the end, see `retried_datasets()`. Finally the records of the datasets deleted in CKAN are removed and the records are exported, see `finish_harvest()`.
+
+    Parameters
+    ----------
+    retry_only: bool. Only retry the datasets that failed in previous runs, on the live database.
+
+    Returns
+    -------
+    bool: False if some CKAN pages could not be retrieved.
+    """
     logging.info(f"{log_module}:ckan2pycsw | Version: 0.1")
     pycsw_config = ConfigParser()
     pycsw_config.read_file(open(PYCSW_CONF))
     database_raw = pycsw_config.get("repository", "database")
     database = database_raw.replace("${PWD}", os.getcwd()) if DEV_MODE == "True" else database_raw
     table_name = pycsw_config.get("repository", "table", fallback="records")
-    context = pycsw.core.config.StaticContext()
-
-    # check if cite.db exists in folder, and delete it if it does
-    database_path =  "/" + database.split("//")[-1]
-    
-    if pathlib.Path(database_path).exists():
-        os.remove(database_path)
-    pycsw.core.admin.setup_db(
-        database,
-        table_name,
-        "",
-    )
-
-    repo = repository.Repository(database, context, table=table_name)
-
-    dcat_type = [
-         "dataset", 
-         "series", 
-         "service"
-         ]
-    
-    # Only iterate over dataset if dataset["dcat_type"] in dcat_type
-    for dataset in (d for d in get_datasets(URL) if d["dcat_type"].rsplit("/", 1)[-1] in dcat_type):
+    if retry_only and not SyncState(database).has_table(table_name):
+        logging.info(f"{log_module}:ckan2pycsw | No records table, nothing to retry")
+        return True
+
+    run = HarvestRun(database, table_name, retry_only)
+    if not retry_only:
+        logging.info(f"{log_module}:ckan2pycsw | Harvest mode: {('resumed full rebuild since ' if run.resume_watermark else 'incremental since ') + run.watermark if run.watermark else 'full'}")
+        write_datasets(run, select_datasets(run))
+    # Pages of the retry pass do not hold back the watermark
+    run.failed_pages = list(run.fetcher.failed_pages)
+
+    retry_ids = [ckan_id for ckan_id in run.previously_failed if ckan_id not in run.seen]
+    if retry_ids:
+        logging.info(f"{log_module}:ckan2pycsw | Retrying {len(retry_ids)} datasets that failed in previous runs")
+        write_datasets(run, retried_datasets(run, retry_ids), main_pass=False)
+
+    run.writer.close()
+    # Conversion failures after the last batch
+    run.checkpoint([])
+    summary = run.summary
+    summary["rendered"] = len(run.writer.identifiers)
+    summary["failed"] += len(run.writer.failed)
+    logging.info(f"{log_module}:ckan2pycsw | Summary: {summary['rendered']} rendered, {summary['skipped']} skipped (unchanged), {summary['failed']} failed")
+    METRICS.inc("datasets_total", summary["rendered"], status="ok")
+    METRICS.inc("datasets_total", summary["skipped"], status="skipped")
+    METRICS.inc("datasets_total", summary["failed"], status="failed")
+
+    if (not run.staged or run.resume_watermark) and not retry_only:
+        remove_deleted_records(run)
+    return finish_harvest(run)
+
+class HarvestRun:
+    def __init__(self, database, table_name, retry_only=False):
+        """
+        Constructor of the HarvestRun class.
+
+        State of a harvest run, shared by its stages: where the records are written, the sync state, writer and fetcher, and the datasets seen, hashed and failed so far.
+
+        A full rebuild of a SQLite repository is written into a shadow database file, initialized using `pycsw.core.admin.setup_db()`, which replaces the live one when the harvest finishes, see `swap_database()`. A full rebuild of a PostgreSQL (PostGIS) repository is loaded with `COPY FROM STDIN` into staging tables swapped in one transaction, see `model.postgresql.StagingTables`. The previous catalogue is served meanwhile. An interrupted full rebuild is resumed from its checkpoint if the templates, mappings and pycsw configuration did not change, see `get_resume_watermark()`.
+
+        Attributes
+        ----------
+        database: str. SQLAlchemy URL of the pycsw repository.
+        table_name: str. Table of the pycsw records.
+        retry_only: bool. Only retry the datasets that failed in previous runs.
+        templates_version: str. Version of the templates, mappings and GetRecordById payload format, records of another version are harvested again.
+        harvest_database: str. SQLAlchemy URL of the database the records are written to, the shadow database of a SQLite full rebuild.
+        harvest_table: str. Table the records are written to, the staging table of a PostgreSQL full rebuild.
+        staged: bool. The records are written to a new database or tables, swapped in by `finish_harvest()`.
+        resume_watermark: str. Checkpoint of the interrupted full rebuild resumed, None if none is.
+        watermark: str. `metadata_modified` from which datasets are retrieved, None for all of them.
+        writer: BulkWriter. Writer of the records, `checkpoint()` is called after each batch.
+        summary: dict. Datasets skipped (unchanged), rendered and failed.
+        """
+        # Only needed by the harvest, not by the worker processes that import this module
+        from pycsw.core import admin
+
+        self.database = database
+        self.table_name = table_name
+        self.retry_only = retry_only
+        self.context = pycsw.core.config.StaticContext()
+        full_rebuild = str(PYCSW_FULL_REBUILD).lower() == "true" and not retry_only
+
+        # Records rendered with other templates or mappings are harvested again
+        self.templates_version = files_version(
+            SCHEMAS_FOLDER / "ckan" / PYCSW_CKAN_SCHEMA,
+            SCHEMAS_FOLDER / "pygeometa" / PYCSW_OUPUT_SCHEMA,
+            MAPPINGS_FOLDER
+            )
+        self.payload_format = get_payload_format()
+        if self.payload_format:
+            # And records with payloads of another pycsw configuration
+            self.templates_version = hashlib.sha256(f"{self.templates_version}\n{self.payload_format}".encode("utf-8")).hexdigest()
+        else:
+            # Payloads not updated by this harvest must not be served
+            drop_record_payloads(database)
+
+        self.database_path = sqlite_path(database)
+        if self.database_path:
+            # SQL function of the triggers of the search indexes
+            register_functions()
+        if not SyncState(database).has_table(table_name):
+            full_rebuild = True
+        self.harvest_database = database
+        self.harvest_table = table_name
+        self.shadow_path = None
+        self.staging = None
+        self.resume_watermark = None
+        sync_suffix = ""
+        if full_rebuild and self.database_path:
+            self.shadow_path = self.database_path + SHADOW_SUFFIX
+            self.harvest_database = f"sqlite:///{self.shadow_path}"
+            if pathlib.Path(self.shadow_path).exists():
+                # Shadow database of an interrupted full rebuild
+                self.resume_watermark = get_resume_watermark(self.harvest_database, table_name, self.templates_version)
+                if self.resume_watermark is None:
+                    os.remove(self.shadow_path)
+        elif full_rebuild and database.startswith("postgresql") and "." not in table_name:
+            if not SyncState(database).has_table(table_name):
+                admin.setup_db(database, table_name, "")
+            # The records table, the sync-state tables and the payloads table
+            tables = [table_name] + list(SyncState(database).metadata.tables)
+            if self.payload_format:
+                tables.append(RecordPayloads(database).table.name)
+            self.staging = StagingTables(database, tables)
+            self.harvest_table = StagingTables.staging_name(table_name)
+            sync_suffix = STAGING_SUFFIX
+            if self.staging.exists():
+                # Staging tables of an interrupted full rebuild
+                self.resume_watermark = get_resume_watermark(database, self.harvest_table, self.templates_version, sync_suffix)
+            if self.resume_watermark is None:
+                self.staging.create()
+        # Nobody reads the new database or tables until they are swapped in
+        self.staged = self.harvest_database != database or self.staging is not None
+
+        self.sync_state = SyncState(self.harvest_database, table_suffix=sync_suffix)
+        if not self.sync_state.has_table(self.harvest_table):
+            admin.setup_db(self.harvest_database, self.harvest_table, "")
+        self.repo = repository.Repository(self.harvest_database, self.context, table=self.harvest_table)
+        self.payloads = RecordPayloads(self.harvest_database, table_suffix=sync_suffix) if self.payload_format else None
+        self.fetcher = CKANFetcher(URL, rows=PYCSW_CKAN_ROWS, workers=PYCSW_CKAN_WORKERS, retries=PYCSW_CKAN_RETRIES, stream=str(PYCSW_CKAN_STREAM).lower() == "true")
+
+        if self.resume_watermark:
+            logging.info(f"{log_module}:ckan2pycsw | Resuming the interrupted full rebuild from its checkpoint: {self.harvest_database} {self.harvest_table}")
+            self.watermark = self.resume_watermark
+        else:
+            self.watermark = None if full_rebuild else self.sync_state.get_watermark()
+        if self.watermark and self.sync_state.get_templates_version() != self.templates_version:
+            logging.info(f"{log_module}:ckan2pycsw | Templates or mappings changed, harvesting all datasets")
+            self.watermark = None
+        self.stored_hashes = self.sync_state.get_hashes()
+        self.previously_failed = self.sync_state.get_failed()
+        self.hashes = {}
+        # Datasets that failed since the last checkpoint: CKAN package id to (name, error)
+        self.failed = {}
+        # Datasets of CKAN seen by this run, they are not retried
+        self.seen = set()
+        self.summary = {"skipped": 0, "rendered": 0, "failed": 0}
+        # Newest metadata_modified seen, the watermark of the next run
+        self.last_modified = self.watermark
+        # metadata_modified of the last converted dataset of the main pass, datasets are converted in order
+        self.checkpoint_modified = None
+        self.failed_pages = []
+
+        self.writer = BulkWriter(self.repo, self.context, batch_size=PYCSW_INSERT_BATCH_SIZE, fresh_build=self.staged, on_flush=self.checkpoint, payloads=self.payloads)
+        # Only the fields used by the templates are retrieved, the content hashes only cover them
+        self.fields = get_field_list(self.fetcher)
+
+    def checkpoint(self, batch):
+        """
+        Commit the records of a batch, the failed datasets and the watermark to resume from, see `SyncState.save_checkpoint()`.
+
+        The checkpoint does not move past a CKAN page that could not be retrieved, its datasets would be skipped when resuming.
+
+        Parameters
+        ----------
+        batch: list. Results written by the writer, see `model.converter.DatasetConverter.convert_result()`.
+        """
+        written = {result["id"]: self.writer.identifiers[result["id"]] for result in batch if result["id"] in self.writer.identifiers}
+        self.failed.update({result["id"]: self.writer.failed[result["id"]] for result in batch if result["id"] in self.writer.failed})
+        resume_from = self.checkpoint_modified if not self.fetcher.failed_pages else None
+        self.sync_state.save_checkpoint(written, self.hashes, self.failed, resume_from, self.templates_version if resume_from else None)
+        self.failed.clear()
+
+def select_datasets(run):
+    """
+    Retrieve the CKAN datasets modified since the watermark of the run and keep those with a new content hash.
+
+    Only the datasets whose content hash (of the dataset and the templates version, see `content_hash()`) differs from the stored one are converted, the others are counted as skipped.
+
+    Parameters
+    ----------
+    run: HarvestRun. State of the harvest run.
+
+    Returns
+    -------
+    generator: A generator that yields CKAN datasets.
+    """
+    for dataset in METRICS.timed(get_datasets(URL, modified_since=run.watermark, fetcher=run.fetcher, fields=run.fields), "fetch"):
+        run.seen.add(dataset["id"])
+        if dataset.get("metadata_modified") and (run.last_modified is None or dataset["metadata_modified"] > run.last_modified):
+            run.last_modified = dataset["metadata_modified"]
+        dataset_hash = content_hash(dataset, run.templates_version)
+        if run.stored_hashes.get(dataset["id"]) == dataset_hash:
+            run.summary["skipped"] += 1
+            continue
+        run.hashes[dataset["id"]] = dataset_hash
+        yield dataset
+
+def retried_datasets(run, ckan_ids):
+    """
+    Retrieve the datasets that failed in previous runs, converted again whatever their content hash.
+
+    Parameters
+    ----------
+    run: HarvestRun. State of the harvest run.
+    ckan_ids: list. CKAN package ids of the datasets to retry.
+
+    Returns
+    -------
+    generator: A generator that yields CKAN datasets.
+    """
+    for dataset in METRICS.timed(get_datasets_by_id(URL, ckan_ids, fetcher=run.fetcher, fields=run.fields), "fetch"):
+        run.hashes[dataset["id"]] = content_hash(dataset, run.templates_version)
+        yield dataset
+
+def write_datasets(run, datasets, main_pass=True):
+    """
+    Convert the datasets into pycsw records and write them, as a pipeline of stages joined by bounded queues.
+
+    The datasets are fetched by a thread into a queue of `PYCSW_FETCH_QUEUE_SIZE` datasets, converted by a pool of `PYCSW_CONVERT_WORKERS` processes with up to `PYCSW_CONVERT_QUEUE_SIZE` datasets in flight into a queue of `PYCSW_WRITE_QUEUE_SIZE` records, see `model.pipeline.pipe()`, and written in order by this thread in transactions of `PYCSW_INSERT_BATCH_SIZE` records, each one followed by a checkpoint, see `HarvestRun.checkpoint()`. With `PYCSW_RECORD_PAYLOADS`, the GetRecordById payload of each record is built by the workers and stored with it, see `model.record_payloads.RecordPayloads`.
+
+    Parameters
+    ----------
+    run: HarvestRun. State of the harvest run.
+    datasets: iterable. CKAN datasets, see `select_datasets()` and `retried_datasets()`.
+    main_pass: bool. Datasets in `metadata_modified` order, which move the checkpoint forward.
+    """
+    # Closed on error, so the stage threads and the worker processes stop
+    with closing(pipe(datasets, PYCSW_FETCH_QUEUE_SIZE, "fetch", "convert")) as datasets:
+        results = convert_datasets(
+            datasets,
+            workers=PYCSW_CONVERT_WORKERS,
+            in_flight=PYCSW_CONVERT_QUEUE_SIZE,
+            database=run.harvest_database,
+            table=run.table_name,
+            base_url=URL,
+            mappings_folder=MAPPINGS_FOLDER,
+            ckan_schema=PYCSW_CKAN_SCHEMA,
+            output_schema=PYCSW_OUPUT_SCHEMA,
+            pycsw_config=PYCSW_CONF if run.payload_format else None
+            )
+        with closing(pipe(results, PYCSW_WRITE_QUEUE_SIZE, "convert", "write")) as results:
+            for result in results:
+                if main_pass and result["metadata_modified"]:
+                    run.checkpoint_modified = result["metadata_modified"]
                 # Add a counter of errors and valids datasets
-                print(d)
-                d_dcat_type = dataset["dcat_type"].rsplit("/", 1)[-1]
-                logging.info(f"{log_module}:ckan2pycsw | Metadata: {dataset['name']} [DCAT Type: {d_dcat_type.capitalize()}]")
-                try:
-                    dataset_metadata =  Dataset(dataset_raw=dataset, base_url=URL, mappings_folder=MAPPINGS_FOLDER,  csw_schema=PYCSW_CKAN_SCHEMA)
-                    mcf_dict = read_mcf(dataset_metadata.render_template)
-                    
-                    # Select an output schema based on OUPUT_SCHEMA if not exists use ISO19139
-                    if PYCSW_OUPUT_SCHEMA in OUPUT_SCHEMA:
-                        iso_os = OUPUT_SCHEMA[PYCSW_OUPUT_SCHEMA]()
-                        xml_string = iso_os.write(mcf=mcf_dict, mappings_folder=MAPPINGS_FOLDER)
-                    else:
-                        iso_os = ISO19139OutputSchema()
-                        xml_string = iso_os.write(mcf=mcf_dict)
-
-
-                    #TODO: DELETE Dumps to log
-                    #print(xml_string,  file=open(APP_DIR + "/log/demo.xml", "w", encoding="utf-8"))
-
-                    # parse xml
-                    record = metadata.parse_record(context, xml_string, repo)[0]
-                    repo.insert(record, "local", util.get_today_and_now())
-                except Exception as e:
-                    logging.error(f"{log_module}:ckan2pycsw | Fail when transform record from CKAN for: {dataset['name']} [DCAT Type: {d_dcat_type.capitalize()}] Error: {e}")
+                d_dcat_type = result["dcat_type"]
+                logging.info(f"{log_module}:ckan2pycsw | Metadata: {result['name']} [DCAT Type: {d_dcat_type.capitalize()}]")
+                if result["error"]:
+                    logging.error(f"{log_module}:ckan2pycsw | Fail when transform record from CKAN for: {result['name']} [DCAT Type: {d_dcat_type.capitalize()}] Error: {result['error']}")
+                    logging.debug(result["traceback"])
+                    run.failed[result["id"]] = (result["name"], result["error"])
+                    run.summary["failed"] += 1
                     continue
+                for stage, seconds in result["timings"].items():
+                    METRICS.observe(stage, seconds)
+                run.writer.add(result)
+    run.writer.flush()
+
+def remove_deleted_records(run):
+    """
+    Remove the records of the datasets deleted or made private in CKAN, or no longer harvested.
+
+    Nothing is removed if not every dataset id of CKAN could be retrieved, see `CKANFetcher.get_dataset_ids()`.
+
+    Parameters
+    ----------
+    run: HarvestRun. State of the harvest run.
+    """
+    try:
+        # Same filters as the harvest, records of datasets of other types are removed too
+        ckan_ids = run.fetcher.get_dataset_ids(search_params()["fq"])
+        removed = {ckan_id: identifier for ckan_id, identifier in run.sync_state.get_identifiers().items() if ckan_id not in ckan_ids}
+        delete_records(run.repo, run.context, removed.values(), run.payloads)
+        run.sync_state.remove_identifiers(list(removed) + [ckan_id for ckan_id in run.sync_state.get_failed() if ckan_id not in ckan_ids])
+    except Exception as e:
+        logging.error(f"{log_module}:ckan2pycsw | Fail when removing deleted datasets from CKAN: {URL} Error: {e}")
+
+def finish_harvest(run):
+    """
+    Store the watermark of the next run, swap in a full rebuild, update the search indexes and export the records.
+
+    The watermark is the newest `metadata_modified` seen, unless some CKAN pages could not be retrieved: then it stays at the last checkpoint, and the shadow database or staging tables of a full rebuild are not swapped in, so the previous catalogue is served until the next run resumes it. With SQLite, the R*Tree and FTS5 search indexes are built if they do not exist yet, see `update_search_indexes()`. The records are exported to `APP_DIR/metadata/` using `pycsw.core.admin.export_records()`.
+
+    Parameters
+    ----------
+    run: HarvestRun. State of the harvest run.
+
+    Returns
+    -------
+    bool: False if some CKAN pages could not be retrieved.
+    """
+    from pycsw.core import admin
+
+    fetcher = run.fetcher
+    METRICS.inc("fetched_bytes_total", fetcher.bytes_fetched)
+    METRICS.inc("fetched_pages_total", fetcher.pages_fetched, status="ok")
+    METRICS.inc("fetched_pages_total", len(fetcher.failed_pages), status="failed")
+
+    if run.failed_pages:
+        logging.error(f"{log_module}:ckan2pycsw | Pages not retrieved from CKAN (start): {run.failed_pages}. Watermark kept at the last checkpoint: {run.sync_state.get_watermark()}")
+    elif run.last_modified and not run.retry_only:
+        run.sync_state.set_watermark(run.last_modified)
+        run.sync_state.set_templates_version(run.templates_version)
+
+    if run.payloads is not None:
+        run.payloads.engine.dispose()
+    if run.staged:
+        run.repo.session.close()
+        run.sync_state.engine.dispose()
+        if run.failed_pages:
+            # Keep serving the previous catalogue instead of an incomplete one, the next run resumes the shadow database or tables
+            logging.error(f"{log_module}:ckan2pycsw | Incomplete harvest, the {'staging tables are' if run.staging else 'shadow database is'} not swapped in: {run.harvest_database} {run.harvest_table}")
+            return False
+        if run.staging is not None:
+            try:
+                run.staging.build_indexes()
+                run.staging.swap()
+            finally:
+                run.staging.engine.dispose()
+        else:
+            update_search_indexes(run.harvest_database, run.harvest_table)
+            swap_database(run.shadow_path, run.database_path)
+    elif run.database_path:
+        update_search_indexes(run.database, run.table_name)
 
     logging.info(f"{log_module}:ckan2pycsw | Create a CSW Endpoint at: {PYCSW_URL}")
 
     # Export records to Folder
-    pycsw.core.admin.export_records(
-         context, 
-         database, 
-         table=table_name, 
-         xml_dirpath=APP_DIR + "/metadata/")
+    with METRICS.timer("export"):
+        admin.export_records(
+             run.context,
+             run.database,
+             table=run.table_name,
+             xml_dirpath=APP_DIR + "/metadata/")
+    return not fetcher.failed_pages
+
+def update_search_indexes(database, table_name):
+    """
+    Build the search indexes of a SQLite repository if they do not exist yet, or drop them if `PYCSW_SQLITE_SEARCH_INDEXES` is disabled.
+
+    Once built, the indexes are kept up to date by triggers, see `model.sqlite_search.SearchIndexes`, so they are only built at the end of a full rebuild, or of the first harvest of an existing repository.
+
+    Parameters
+    ----------
+    database: str. SQLAlchemy URL of the SQLite repository.
+    table_name: str. Table of the pycsw records.
+    """
+    search_indexes = SearchIndexes(database, table_name)
+    try:
+        if str(PYCSW_SQLITE_SEARCH_INDEXES).lower() != "true":
+            if search_indexes.exists():
+                search_indexes.drop()
+        elif not search_indexes.exists():
+            with METRICS.timer("index"):
+                search_indexes.build()
+    except Exception as e:
+        # pycsw keeps scanning the records table without them, e.g. if SQLite has no FTS5 trigram tokenizer (< 3.34)
+        logging.error(f"{log_module}:ckan2pycsw | Fail when building the search indexes of {table_name}: {e}")
+    finally:
+        search_indexes.engine.dispose()
+
+def get_payload_format(pycsw_config=PYCSW_CONF):
+    """
+    Format of the GetRecordById payloads of the harvest, see `model.record_payloads.PayloadBuilder`.
+
+    Parameters
+    ----------
+    pycsw_config: str. pycsw configuration file.
+
+    Returns
+    -------
+    str or None: Format digest, None if `PYCSW_RECORD_PAYLOADS` is disabled, the pycsw apiso profile is not enabled or there is a repository filter.
+    """
+    if str(PYCSW_RECORD_PAYLOADS).lower() != "true":
+        return None
+    try:
+        builder = PayloadBuilder(pycsw_config)
+    except Exception as e:
+        logging.error(f"{log_module}:ckan2pycsw | Fail when loading the pycsw configuration of the GetRecordById payloads: {pycsw_config} Error: {e}")
+        return None
+    if builder.repository_filter:
+        # pycsw hides the records outside of the filter, the payloads are not filtered
+        logging.info(f"{log_module}:ckan2pycsw | pycsw repository filter set, no GetRecordById payloads: {builder.repository_filter}")
+        return None
+    if not builder.available:
+        logging.info(f"{log_module}:ckan2pycsw | The pycsw apiso profile is not enabled, no GetRecordById payloads")
+        return None
+    return builder.format
+
+def drop_record_payloads(database):
+    """
+    Drop the GetRecordById payloads of the repository, if any: they would not be updated with the records.
+
+    Parameters
+    ----------
+    database: str. SQLAlchemy URL of the pycsw repository.
+    """
+    payloads = RecordPayloads(database, create=False)
+    try:
+        payloads.drop()
+    except Exception as e:
+        logging.error(f"{log_module}:ckan2pycsw | Fail when dropping the GetRecordById payloads: {payloads.table.name} Error: {e}")
+    finally:
+        payloads.engine.dispose()
+
+def get_resume_watermark(database, table_name, templates_version, table_suffix=""):
+    """
+    Get the checkpoint of an interrupted full rebuild, see `HarvestRun`.
+
+    Parameters
+    ----------
+    database: str. SQLAlchemy URL of the shadow database, or of the PostgreSQL database with the staging tables.
+    table_name: str. Table of the pycsw records.
+    templates_version: str. Version of the current templates and mappings, see `files_version()`.
+    table_suffix: str. Suffix of the sync-state tables, see `model.postgresql.STAGING_SUFFIX`.
+
+    Returns
+    -------
+    str or None: Watermark to resume from, None if the database cannot be resumed.
+    """
+    sync_state = SyncState(database, table_suffix=table_suffix)
+    try:
+        if sync_state.has_table(table_name) and sync_state.get_templates_version() == templates_version:
+            return sync_state.get_watermark()
+        return None
+    finally:
+        sync_state.engine.dispose()
 
 
 def run_scheduler():
@@ -191,13 +820,15 @@ def run_scheduler():
     Schedule a recurring task to run at a specific time interval.
 
     The task will run every `PYCSW_CRON_DAYS_INTERVAL` days, starting at 4:00 a.m.
-    The task consists of checking if a gunicorn process is running, killing it if necessary,
-    running the `main()` function, and restarting gunicorn afterwards.
+    The task consists of running the `main()` function while gunicorn keeps serving the catalogue,
+    see `run_tasks()`.
 
     Returns
     -------
     None
     """
+    from apscheduler.schedulers.blocking import BlockingScheduler
+
     scheduler = BlockingScheduler(timezone=TZ)
     scheduler_start_date = datetime.now().replace(hour=PYCSW_CRON_HOUR_START, minute=0).strftime('%Y-%m-%d %H:%M:%S')
     scheduler.add_job(run_tasks, "interval", days=PYCSW_CRON_DAYS_INTERVAL, start_date=scheduler_start_date)
@@ -205,30 +836,50 @@ def run_scheduler():
 
 def run_tasks():
     """
-    Check if gunicorn is running. Kill any gunicorn process with "gunicorn" or "pycsw.wsgi:application" in its name or command line.
-    Execute the main function. Restart gunicorn after the main function finishes.
+    Execute the main function and start gunicorn if it is not running yet.
+
+    gunicorn is not stopped during the harvest: incremental harvests update the records in place and full rebuilds swap the database in atomically.
 
     Returns
     -------
     None
     """
-    for proc in psutil.process_iter(["pid", "name", "cmdline"]):
-        if "gunicorn" in proc.info["name"] or "pycsw.wsgi:application" in ' '.join(proc.info["cmdline"]):
-            print(f"Stopping gunicorn process with PID {proc.info['pid']}...")
-            proc.kill()
-            time.sleep(5)  # Wait for the gunicorn process to fully stop
-
     # Execute the main function
     main()
 
-    # Restart gunicorn after the main function finishes
+    # Start gunicorn after the first harvest
+    if gunicorn_running():
+        return
     try:
-        subprocess.Popen(["pdm", "run", "python3", "-m", "gunicorn", "pycsw.wsgi:application", "-b", f"0.0.0.0:{PYCSW_PORT}"])
+        subprocess.Popen(["pdm", "run", "python3", "-m", "gunicorn", "--pythonpath", str(pathlib.Path(__file__).resolve().parent), "wsgi:application", "-b", f"0.0.0.0:{PYCSW_PORT}"])
     except Exception as e:
         logging.error(f"{log_module}:ckan2pycsw | Error starting gunicorn: {e}")
 
+def gunicorn_running():
+    """
+    Check if gunicorn is running: any process with "gunicorn" or "wsgi:application" in its name or command line.
+
+    Returns
+    -------
+    bool: True if gunicorn is running.
+    """
+    import psutil
+
+    for proc in psutil.process_iter(["pid", "name", "cmdline"]):
+        if "gunicorn" in (proc.info["name"] or "") or "wsgi:application" in " ".join(proc.info["cmdline"] or []):
+            return True
+    return False
+
 if __name__ == "__main__":
-    if str(DEV_MODE).lower() == "true":
+    if PYCSW_METRICS_PORT:
+        start_metrics_server(PYCSW_METRICS_PORT)
+    if sys.argv[1:] == ["retry"]:
+        # Retry pass only, e.g. `docker exec <container> pdm run python3 ckan2pycsw/ckan2pycsw.py retry`
+        main(retry_only=True)
+    elif str(DEV_MODE).lower() == "true":
+        # debug
+        import ptvsd
+
         # Allow other computers to attach to ptvsd at this IP address and port.
         ptvsd.enable_attach(address=("0.0.0.0", PYCSW_DEV_PORT), redirect_output=True)
 
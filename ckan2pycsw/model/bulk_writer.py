@@ -0,0 +1,223 @@
+# inbuilt libraries
+import logging
+
+# third-party libraries
+from pycsw.core import util
+from sqlalchemy import event
+
+# custom classes
+from model.metrics import METRICS
+from model.postgresql import copy_rows
+
+
+LOGGER = logging.getLogger(__name__)
+log_module = "[bulk_writer]"
+
+
+class BulkWriter:
+    def __init__(self, repo, context, batch_size: int = 500, fresh_build: bool = False, on_flush=None, payloads=None):
+        """
+        Constructor of the BulkWriter class.
+
+        Collects pycsw record values and writes them in batches, each batch in one
+        transaction. Records already in the repository are replaced. If a batch
+        fails, its records are written one by one so only the invalid ones are lost.
+
+        Attributes
+        ----------
+        repo: pycsw.core.repository.Repository. The pycsw repository.
+        context: pycsw.core.config.StaticContext. The pycsw context.
+        batch_size: int. Records per transaction.
+        fresh_build: bool. The repository is a new database or table nobody reads yet: on SQLite,
+            the build runs with journal_mode=WAL and synchronous=OFF, on PostgreSQL the batches
+            are loaded with COPY FROM STDIN.
+        on_flush: callable, optional. Called with the results of each batch once it is
+            written, e.g. to checkpoint the harvest.
+        payloads: model.record_payloads.RecordPayloads, optional. GetRecordById payloads of the
+            records (the `payload` of the results), replaced in the transaction of their records.
+        identifiers: dict. CKAN dataset id to record identifier of the written records.
+        failed: dict. CKAN dataset id to (name, error) of the datasets whose record could not be written.
+        """
+        self.repo = repo
+        self.context = context
+        self.batch_size = max(1, batch_size)
+        self.identifier_column = context.md_core_model["mappings"]["pycsw:Identifier"]
+        self.insert_date_column = context.md_core_model["mappings"]["pycsw:InsertDate"]
+        self.xml_column = context.md_core_model["mappings"]["pycsw:XML"]
+        self.batch = []
+        self.identifiers = {}
+        self.failed = {}
+        self.on_flush = on_flush
+        self.payloads = payloads
+        self.sqlite_build = fresh_build and repo.engine.dialect.name == "sqlite"
+        self.postgresql_copy = fresh_build and repo.engine.dialect.name == "postgresql"
+        if self.sqlite_build:
+            self.start_sqlite_build()
+
+    def add(self, result: dict):
+        """
+        Add the record of a converted dataset, the batch is written when full.
+
+        Parameters
+        ----------
+        result: dict. Converted dataset, see model.converter.DatasetConverter.convert_result().
+        """
+        self.batch.append(result)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the current batch in one transaction, or record by record if it fails,
+        then pass it to `on_flush`.
+
+        The time of each batch is observed as the `insert` stage of `model.metrics.METRICS`.
+        """
+        if not self.batch:
+            return
+        batch = self.batch
+        with METRICS.timer("insert"):
+            self.write_batch()
+        if self.on_flush is not None:
+            self.on_flush(batch)
+
+    def write_batch(self):
+        """
+        Write the current batch, see `flush()`.
+        """
+        batch, self.batch = self.batch, []
+        now = util.get_today_and_now()
+        rows = [self.record_row(result, now) for result in batch]
+        identifier = getattr(self.repo.dataset, self.identifier_column)
+
+        try:
+            self.repo.session.begin()
+            self.repo.session.query(self.repo.dataset).filter(
+                identifier.in_([row[self.identifier_column] for row in rows])
+            ).delete(synchronize_session=False)
+            if self.postgresql_copy:
+                copy_rows(self.repo.session.connection(), self.repo.dataset.__table__, rows)
+            else:
+                self.repo.session.bulk_insert_mappings(self.repo.dataset, rows)
+            if self.payloads is not None:
+                self.write_payloads(self.repo.session.connection(), rows, batch)
+            self.repo.session.commit()
+        except Exception as e:
+            self.repo.session.rollback()
+            LOGGER.warning(f"{log_module}:BulkWriter | Batch of {len(rows)} records failed, writing them one by one. Error: {e}")
+            for result in batch:
+                self.write_one(result)
+            return
+
+        for result, row in zip(batch, rows):
+            self.identifiers[result["id"]] = row[self.identifier_column]
+
+    def record_row(self, result: dict, now: str) -> dict:
+        """
+        Column values of the record of a converted dataset, inserted at `now` if it has no insert date.
+        """
+        row = dict(result["values"])
+        if not row.get(self.insert_date_column):
+            row[self.insert_date_column] = now
+        if isinstance(row.get(self.xml_column), bytes):
+            row[self.xml_column] = row[self.xml_column].decode("utf-8")
+        return row
+
+    def write_one(self, result: dict):
+        """
+        Insert or update the record of a converted dataset in its own transaction.
+
+        Parameters
+        ----------
+        result: dict. Converted dataset, see model.converter.DatasetConverter.convert_result().
+        """
+        try:
+            row = self.record_row(result, util.get_today_and_now())
+            self.identifiers[result["id"]] = upsert_record(self.repo, self.context, self.repo.dataset(**row))
+            if self.payloads is not None:
+                with self.repo.engine.begin() as conn:
+                    self.write_payloads(conn, [row], [result])
+        except Exception as e:
+            LOGGER.error(f"{log_module}:BulkWriter | Fail when insert record from CKAN for: {result['name']} [DCAT Type: {result['dcat_type'].capitalize()}] Error: {e}")
+            self.failed[result["id"]] = (result["name"], str(e))
+
+    def write_payloads(self, conn, rows: list, batch: list):
+        """
+        Replace the payloads of the records of a batch, in the transaction of `conn`.
+
+        The payloads of the records without one (e.g. it could not be built) are deleted,
+        so the pycsw server answers their requests.
+
+        Parameters
+        ----------
+        conn: sqlalchemy.engine.Connection. Connection of the transaction.
+        rows: list. Column values of the records.
+        batch: list. Converted datasets of the records, see model.converter.DatasetConverter.convert_result().
+        """
+        payloads = [result["payload"] for result in batch if result.get("payload")]
+        self.payloads.delete(conn, [row[self.identifier_column] for row in rows])
+        if not payloads:
+            return
+        if self.postgresql_copy:
+            copy_rows(conn, self.payloads.table, payloads)
+        else:
+            conn.execute(self.payloads.table.insert(), payloads)
+
+    def close(self):
+        """
+        Write the pending records and, on a fresh SQLite build, restore the default
+        journal so the database file is self-contained.
+        """
+        self.flush()
+        if self.sqlite_build:
+            self.finish_sqlite_build()
+
+    def start_sqlite_build(self):
+        """
+        Switch the SQLite database to WAL and turn off fsync for the connections of the build.
+        """
+        LOGGER.info(f"{log_module}:BulkWriter | SQLite build pragmas: journal_mode=WAL, synchronous=OFF")
+        event.listen(self.repo.engine, "connect", sqlite_build_connect)
+        with self.repo.engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+
+    def finish_sqlite_build(self):
+        """
+        Checkpoint the WAL into the database file and switch back to the default journal.
+        """
+        event.remove(self.repo.engine, "connect", sqlite_build_connect)
+        with self.repo.engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA synchronous=FULL")
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.exec_driver_sql("PRAGMA journal_mode=DELETE")
+
+
+def sqlite_build_connect(dbapi_connection, connection_record):
+    """
+    SQLAlchemy `connect` event: synchronous is a per-connection SQLite setting.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA synchronous=OFF")
+    cursor.close()
+
+
+def upsert_record(repo, context, record):
+    """
+    Insert a pycsw record or update it if the identifier already exists in the repository.
+
+    Parameters
+    ----------
+    repo: pycsw.core.repository.Repository. The pycsw repository.
+    context: pycsw.core.config.StaticContext. The pycsw context.
+    record: pycsw record object.
+
+    Returns
+    -------
+    str: Identifier of the record.
+    """
+    identifier = getattr(record, context.md_core_model["mappings"]["pycsw:Identifier"])
+    if repo.query_ids([identifier]):
+        repo.update(record)
+    else:
+        repo.insert(record, "local", util.get_today_and_now())
+    return identifier
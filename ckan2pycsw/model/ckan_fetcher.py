@@ -0,0 +1,491 @@
+# inbuilt libraries
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from urllib.parse import urljoin
+
+# third-party libraries
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# custom classes
+from model.json_stream import iter_json_items
+
+
+LOGGER = logging.getLogger(__name__)
+log_module = "[ckan_fetcher]"
+CKAN_API = "api/3/action/package_search"
+# CKAN `ckan.search.rows_max` default
+MAX_ROWS = 1000
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# Bytes read from the response per chunk in stream mode
+STREAM_CHUNK_SIZE = 64 * 1024
+# Order of the keyset paging, see `CKANFetcher.iter_keyset_pages()`
+KEYSET_FIELDS = ("metadata_modified", "id")
+KEYSET_SORT = "metadata_modified asc, id asc"
+
+
+class CKANFetcher:
+    def __init__(
+        self,
+        base_url: str,
+        rows: int = 100,
+        workers: int = 4,
+        retries: int = 3,
+        backoff_factor: float = 0.5,
+        timeout: int = 60,
+        stream: bool = False):
+        """
+        Constructor of the CKANFetcher class.
+
+        Pages through the CKAN `package_search` API with a pooled HTTP session,
+        keeping up to `workers` page requests in flight.
+
+        Attributes
+        ----------
+        base_url: str. The base URL of the CKAN instance.
+        rows: int. Datasets per page, up to the CKAN limit of 1000.
+        workers: int. Number of page requests in flight.
+        retries: int. Number of retries per page on connection errors and 429/5xx responses.
+        backoff_factor: float. Backoff factor between retries (0.5 -> 0.5s, 1s, 2s...).
+        timeout: int. Timeout in seconds of each request.
+        stream: bool. Decode the datasets of each page one by one from the response
+            stream instead of loading the whole page, so memory does not grow with
+            the page size.
+        failed_pages: list. Start of the pages that could not be retrieved.
+        pages_fetched: int. Pages retrieved, including the count requests.
+        bytes_fetched: int. Bytes of the responses retrieved.
+        """
+        if not base_url.endswith("/"):
+            base_url += "/"
+        self.base_url = base_url
+        self.package_search = urljoin(base_url, CKAN_API)
+        self.rows = max(1, min(rows, MAX_ROWS))
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.stream = stream
+        self.failed_pages = []
+        self.pages_fetched = 0
+        self.bytes_fetched = 0
+        self.lock = threading.Lock()
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS,
+            allowed_methods=["GET"],
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get_page(self, params: dict, start: int, rows: int = None) -> dict:
+        """
+        Retrieve one page of the CKAN `package_search` API.
+
+        Parameters
+        ----------
+        params: dict. Extra `package_search` parameters (fq, sort, fl...).
+        start: int. Offset of the first dataset of the page.
+        rows: int, optional. Datasets per page, default: `self.rows`.
+
+        Returns
+        -------
+        dict: The `result` object of the response.
+
+        Raises
+        ------
+        requests.exceptions.RequestException: If the page cannot be retrieved after all the retries.
+        ValueError: If the response is not valid JSON.
+        """
+        res = self.session.get(
+            self.package_search,
+            params={**params, "start": start, "rows": self.rows if rows is None else rows},
+            timeout=self.timeout,
+        )
+        res.raise_for_status()
+        self.add_fetched(len(res.content))
+        return res.json()["result"]
+
+    def open_page(self, params: dict, start: int):
+        """
+        Send the request of one page of the CKAN `package_search` API without reading the body.
+
+        Parameters
+        ----------
+        params: dict. Extra `package_search` parameters (fq, sort, fl...).
+        start: int. Offset of the first dataset of the page.
+
+        Returns
+        -------
+        requests.Response: The streamed response, see `stream_results()`.
+
+        Raises
+        ------
+        requests.exceptions.RequestException: If the page cannot be retrieved after all the retries.
+        """
+        res = self.session.get(
+            self.package_search,
+            params={**params, "start": start, "rows": self.rows},
+            timeout=self.timeout,
+            stream=True,
+        )
+        try:
+            res.raise_for_status()
+        except requests.exceptions.RequestException:
+            res.close()
+            raise
+        return res
+
+    def stream_results(self, res):
+        """
+        Decode the `result.results` datasets of a streamed `package_search` response one by one.
+
+        Parameters
+        ----------
+        res: requests.Response. Response returned by `open_page()`.
+
+        Returns
+        -------
+        generator: A generator that yields CKAN datasets.
+
+        Raises
+        ------
+        requests.exceptions.RequestException: If the connection fails while reading the response.
+        ValueError: If the response is not valid JSON.
+        """
+        with res:
+            yield from iter_json_items(self.count_bytes(res.iter_content(STREAM_CHUNK_SIZE)), ("result", "results"))
+        self.add_fetched(0)
+
+    def count_bytes(self, chunks):
+        """
+        Yield the chunks of a streamed response, adding their size to `bytes_fetched`.
+        """
+        for chunk in chunks:
+            with self.lock:
+                self.bytes_fetched += len(chunk)
+            yield chunk
+
+    def add_fetched(self, size: int):
+        """
+        Count a retrieved page of `size` bytes, pages are retrieved from several threads.
+        """
+        with self.lock:
+            self.pages_fetched += 1
+            self.bytes_fetched += size
+
+    def count(self, params: dict) -> int:
+        """
+        Number of datasets matching the `package_search` parameters.
+
+        Raises
+        ------
+        requests.exceptions.RequestException: If an error occurs while communicating with the CKAN instance.
+        """
+        return self.get_page(params, 0, rows=0).get("count", 0)
+
+    def supports_field_list(self, params: dict, fields: list) -> bool:
+        """
+        Check that a `package_search` field list returns the same values as the full datasets.
+
+        CKAN answers `fl` from the fields stored in its Solr index, which may not have
+        every field of the dataset dicts (e.g. `resources` as a list of dicts), so the
+        first dataset is retrieved with and without the field list and compared.
+
+        Parameters
+        ----------
+        params: dict. Extra `package_search` parameters (fq, sort...), without `fl`.
+        fields: list. Dataset fields of the field list.
+
+        Returns
+        -------
+        bool: True if every field has the same value, or there are no datasets to compare.
+
+        Raises
+        ------
+        requests.exceptions.RequestException: If an error occurs while communicating with the CKAN instance.
+        """
+        full = self.get_page(params, 0, rows=1)["results"]
+        partial = self.get_page({**params, "fl": ",".join(fields)}, 0, rows=1)["results"]
+        if not full:
+            return True
+        if not partial:
+            return False
+        differences = [field for field in fields if full[0].get(field) != partial[0].get(field)]
+        if differences:
+            LOGGER.warning(f"{log_module}:CKANFetcher | Field list not supported by {self.package_search}, fields with other values: {differences}")
+        return not differences
+
+    def iter_pages(self, params: dict):
+        """
+        Retrieve the pages of a `package_search` query concurrently, in order.
+
+        A page that still fails after all the retries is logged, added to
+        `failed_pages` and skipped. In stream mode, the datasets of a page are
+        a generator decoding the response, see `stream_results()`.
+
+        CKAN silently returns fewer rows than requested if `rows` is over its
+        `ckan.search.rows_max`: when a page is shorter than requested, the pages in
+        flight are dropped and the next ones are retrieved sequentially, each one
+        starting after the datasets actually returned, see `iter_sequential_pages()`.
+
+        Parameters
+        ----------
+        params: dict. Extra `package_search` parameters (fq, sort, fl...).
+
+        Returns
+        -------
+        generator: A generator that yields (start, datasets) tuples ordered by start.
+        """
+        end = self.count(params)
+        starts = iter(range(0, end, self.rows))
+        get_page = self.open_page if self.stream else self.get_page
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ckan_fetcher") as executor:
+            pending = deque((start, executor.submit(get_page, params, start)) for start in islice(starts, self.workers))
+            try:
+                while pending:
+                    start, future = pending.popleft()
+                    next_start = next(starts, None)
+                    if next_start is not None:
+                        pending.append((next_start, executor.submit(get_page, params, next_start)))
+                    try:
+                        page = future.result()
+                        results = self.stream_results(page) if self.stream else page["results"]
+                    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                        self.page_failed(start, e)
+                        continue
+                    sizes = {}
+                    yield start, self.count_results(results, sizes, start) if self.stream else results
+                    size = sizes.get(start) if self.stream else len(results)
+                    requested = min(self.rows, end - start)
+                    if size is not None and size < requested:
+                        LOGGER.warning(f"{log_module}:CKANFetcher | Page start={start} returned {size} datasets of {requested} requested from: {self.package_search} (ckan.search.rows_max?), retrieving the next pages sequentially")
+                        break
+                else:
+                    return
+            finally:
+                # Release the connections of the streamed pages not read
+                for _, future in pending:
+                    if self.stream and not future.cancel() and future.exception() is None:
+                        future.result().close()
+        yield from self.iter_sequential_pages(params, start + size, end, size or self.rows)
+
+    def iter_sequential_pages(self, params: dict, start: int, end: int, page_size: int):
+        """
+        Retrieve the pages of a `package_search` query one by one, each one starting after the datasets returned by the previous one.
+
+        A page that fails is logged, added to `failed_pages` and skipped: the next
+        one starts `page_size` datasets later.
+
+        Parameters
+        ----------
+        params: dict. Extra `package_search` parameters (fq, sort, fl...).
+        start: int. Offset of the first page.
+        end: int. Number of datasets of the query.
+        page_size: int. Datasets per page returned by CKAN, to skip a failed page.
+
+        Returns
+        -------
+        generator: A generator that yields (start, datasets) tuples ordered by start.
+        """
+        get_page = self.open_page if self.stream else self.get_page
+        while start < end:
+            try:
+                page = get_page(params, start)
+                results = self.stream_results(page) if self.stream else page["results"]
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                self.page_failed(start, e)
+                start += page_size
+                continue
+            sizes = {}
+            yield start, self.count_results(results, sizes, start) if self.stream else results
+            size = sizes.get(start) if self.stream else len(results)
+            if size is None:
+                # A streamed page that failed while read, see get_datasets()
+                start += page_size
+            elif size == 0:
+                # Fewer datasets than counted, e.g. deleted while paging
+                return
+            else:
+                start += size
+
+    @staticmethod
+    def count_results(results, sizes: dict, start: int):
+        """
+        Yield the datasets of a streamed page, storing their number in `sizes[start]` once all are read.
+        """
+        size = 0
+        for dataset in results:
+            size += 1
+            yield dataset
+        sizes[start] = size
+
+    def page_failed(self, start: int, error: Exception):
+        """
+        Log a page that could not be retrieved and add it to `failed_pages`.
+        """
+        LOGGER.error(f"{log_module}:CKANFetcher | Fail when retrieving page start={start} rows={self.rows} from: {self.package_search} Error: {error}")
+        self.failed_pages.append(start)
+
+    def iter_keyset_pages(self, params: dict):
+        """
+        Retrieve the pages of a `package_search` query one by one, each one filtered to the datasets after the last one of the previous page (keyset paging).
+
+        Datasets are sorted by `metadata_modified` and `id` (`KEYSET_SORT`) and each
+        page asks for the datasets after the (metadata_modified, id) of the last one
+        retrieved, instead of a `start` offset: a dataset modified or deleted while
+        paging does not shift the next pages, so no dataset is skipped. A dataset
+        modified while paging is retrieved again at the end.
+
+        Each page depends on the previous one, so pages are not retrieved concurrently.
+        A page that fails is logged and added to `failed_pages`, and the iteration
+        stops, as the following pages are not known.
+
+        Parameters
+        ----------
+        params: dict. Extra `package_search` parameters (fq, fl...), `sort` is replaced.
+
+        Returns
+        -------
+        generator: A generator that yields (start, datasets) tuples, start being the number of datasets retrieved before the page.
+        """
+        params = {**params, "sort": KEYSET_SORT}
+        if params.get("fl"):
+            params["fl"] = ",".join(dict.fromkeys(params["fl"].split(",") + list(KEYSET_FIELDS)))
+        get_page = self.open_page if self.stream else self.get_page
+        start = 0
+        last = None
+        while True:
+            try:
+                page = get_page({**params, "fq": keyset_filter(params.get("fq"), last)}, 0)
+                results = self.stream_results(page) if self.stream else page["results"]
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                self.page_failed(start, e)
+                return
+            keys = {}
+            yield start, self.keyset_results(results, keys)
+            if "size" not in keys:
+                # A streamed page that failed while read, see get_datasets()
+                return
+            if keys["size"] == 0 or (not self.stream and keys["size"] >= page.get("count", keys["size"] + 1)):
+                return
+            if None in keys["last"] or keys["last"] == last:
+                self.page_failed(start + keys["size"], ValueError(f"Datasets without {' or '.join(KEYSET_FIELDS)} or not sorted by them: {keys['last']}"))
+                return
+            start += keys["size"]
+            last = keys["last"]
+
+    @staticmethod
+    def keyset_results(results, keys: dict):
+        """
+        Yield the datasets of a page, storing their number in `keys["size"]` and the key of the last one in `keys["last"]` once all are read.
+        """
+        size = 0
+        dataset = {}
+        for dataset in results:
+            size += 1
+            yield dataset
+        keys["last"] = tuple(dataset.get(field) for field in KEYSET_FIELDS)
+        keys["size"] = size
+
+    def get_datasets(self, params: dict = None, keyset: bool = False):
+        """
+        Retrieve a generator of CKAN datasets.
+
+        Parameters
+        ----------
+        params: dict, optional. Extra `package_search` parameters (fq, sort, fl...).
+        keyset: bool. Retrieve the pages by keyset, in `KEYSET_SORT` order, see `iter_keyset_pages()`,
+            instead of by offset, concurrently, see `iter_pages()`.
+
+        Returns
+        -------
+        generator: A generator that yields CKAN datasets.
+        """
+        pages = self.iter_keyset_pages(params or {}) if keyset else self.iter_pages(params or {})
+        for start, datasets in pages:
+            try:
+                yield from datasets
+            except (requests.exceptions.RequestException, ValueError) as e:
+                # A streamed page can fail after some of its datasets were yielded
+                self.page_failed(start, e)
+
+    def get_dataset_ids(self, fq: str = None) -> set:
+        """
+        Retrieve the ids of all the public and active datasets.
+
+        Pages are retrieved sequentially and errors are not silenced, as an
+        incomplete list would remove valid records from the pycsw repository.
+        CKAN may return fewer rows than requested (`ckan.search.rows_max`), so each
+        page starts after the datasets actually returned, up to the reported count.
+
+        Parameters
+        ----------
+        fq: str, optional. Solr filter query of the harvested datasets, so the records of
+            the datasets no longer harvested are removed too.
+
+        Returns
+        -------
+        set: CKAN dataset ids.
+
+        Raises
+        ------
+        requests.exceptions.RequestException: If an error occurs while communicating with the CKAN instance.
+        ValueError: If the ids retrieved are not as many as the datasets reported by CKAN.
+        """
+        ids = set()
+        start = 0
+        count = None
+        while count is None or start < count:
+            page = self.get_page({"fl": "id", "sort": "id asc", **({"fq": fq} if fq else {})}, start, rows=MAX_ROWS)
+            if count is None:
+                count = page.get("count", 0)
+            results = page["results"]
+            if not results:
+                break
+            ids.update(dataset["id"] for dataset in results)
+            start += len(results)
+        if len(ids) != count:
+            # e.g. datasets created or deleted while paging
+            raise ValueError(f"{len(ids)} dataset ids retrieved of {count} reported by {self.package_search}")
+        return ids
+
+
+def solr_datetime(timestamp: str) -> str:
+    """
+    Convert a CKAN `metadata_modified` timestamp to a Solr date.
+
+    Parameters
+    ----------
+    timestamp: str. ISO 8601 timestamp, e.g. '2023-05-10T08:15:42.123456'.
+
+    Returns
+    -------
+    str: Solr UTC date, e.g. '2023-05-10T08:15:42.123456Z'.
+    """
+    return timestamp if timestamp.endswith("Z") else f"{timestamp}Z"
+
+
+def keyset_filter(fq: str, last: tuple) -> str:
+    """
+    Solr filter query of the datasets after `last` in `KEYSET_SORT` order, see `CKANFetcher.iter_keyset_pages()`.
+
+    Parameters
+    ----------
+    fq: str. Solr filter query of the search, or None.
+    last: tuple. (metadata_modified, id) of the last dataset retrieved, None for the first page.
+
+    Returns
+    -------
+    str: Solr filter query, None if there is none.
+    """
+    if last is None:
+        return fq
+    modified, dataset_id = solr_datetime(last[0]), last[1]
+    after = f'metadata_modified:[{modified} TO *] AND (metadata_modified:{{{modified} TO *] OR id:{{"{dataset_id}" TO *])'
+    return f"{fq} AND {after}" if fq else after
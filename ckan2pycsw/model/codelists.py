@@ -0,0 +1,187 @@
+# inbuilt libraries
+import logging
+import os
+from collections import Counter
+
+# third-party libraries
+import yaml
+
+
+LOGGER = logging.getLogger(__name__)
+log_module = "[codelists]"
+# Sentinel of values not yet looked up in an index
+_MISSING = object()
+
+
+class CodelistRegistry:
+    def __init__(self):
+        """
+        Constructor of the CodelistRegistry class.
+
+        Loads each codelist YAML file of the mappings folder once and builds hash
+        indexes per (codelist, input_field), so lookups do not parse YAML or scan
+        the codelist on every call.
+
+        Attributes
+        ----------
+        codelists: dict. Loaded codelists by file path.
+        indexes: dict. Positions of the codelist items by (file path, input_field) and value.
+        hits: collections.Counter. Lookups that found a mapping, by codelist.
+        misses: collections.Counter. Lookups that did not find a mapping, by codelist.
+        """
+        self.codelists = {}
+        self.indexes = {}
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def load(self, codelist: str, mappings_folder: str = 'ckan2pycsw/mappings'):
+        """
+        Get a codelist, loading the YAML file only the first time.
+
+        Parameters
+        ----------
+        codelist: str. The name of the YAML file (without the extension) in which the codelist is defined.
+        mappings_folder: str. The folder path containing the YAML files for the mappings.
+
+        Returns
+        -------
+        dict or list: Content of the codelist YAML file.
+
+        Raises
+        ------
+        ValueError: If the YAML file cannot be parsed.
+        """
+        path = os.path.join(mappings_folder, codelist + ".yaml")
+        if path not in self.codelists:
+            LOGGER.debug(f"{log_module}:CodelistRegistry | Loading codelist: {path}")
+            with open(path, encoding="utf-8") as f:
+                self.codelists[path] = yaml.safe_load(f)
+        return self.codelists[path]
+
+    def get(self, value, codelist: str, mappings_folder: str = 'ckan2pycsw/mappings'):
+        """
+        Returns the value of a dict codelist for a given key, else the key itself.
+
+        Parameters
+        ----------
+        value: str. The source value that needs to be mapped to a codelist value.
+        codelist: str. The name of the YAML file (without the extension) in which the codelist is defined.
+        mappings_folder: str. The folder path containing the YAML files for the mappings.
+
+        Returns
+        -------
+        The value of the codelist if found, else the value itself.
+        """
+        map_yaml = self.load(codelist, mappings_folder)
+        if value in map_yaml:
+            self.hits[codelist] += 1
+            return map_yaml[value]
+        self.misses[codelist] += 1
+        return value
+
+    def find(self, value, input_field: str, codelist: str, mappings_folder: str = 'ckan2pycsw/mappings'):
+        """
+        Returns the first item of a list codelist whose `input_field` contains the value.
+
+        Same result as a linear `value in item[input_field]` scan: list fields are
+        matched by element and string fields by substring, in codelist order.
+
+        Parameters
+        ----------
+        value: str. The value to search.
+        input_field: str. The field name of the codelist items to search for the value.
+        codelist: str. The name of the YAML file (without the extension) in which the codelist is defined.
+        mappings_folder: str. The folder path containing the YAML files for the mappings.
+
+        Returns
+        -------
+        dict or None: The codelist item, None if not found.
+        """
+        items = self.load(codelist, mappings_folder)
+        key = (os.path.join(mappings_folder, codelist + ".yaml"), input_field)
+        index = self.indexes.get(key)
+        if index is None:
+            index = self.indexes[key] = build_index(items, input_field)
+
+        try:
+            position = index.get(value, _MISSING)
+        except TypeError:  # unhashable value
+            position = scan(items, value, input_field)
+        else:
+            if position is _MISSING:
+                position = index[value] = scan(items, value, input_field)
+
+        if position is None:
+            self.misses[codelist] += 1
+            return None
+        self.hits[codelist] += 1
+        return items[position]
+
+    def stats(self) -> dict:
+        """
+        Lookups per codelist.
+
+        Returns
+        -------
+        dict: {codelist: {"hits": int, "misses": int}}.
+        """
+        return {
+            codelist: {"hits": self.hits[codelist], "misses": self.misses[codelist]}
+            for codelist in sorted(set(self.hits) | set(self.misses))
+        }
+
+    def clear(self):
+        """
+        Invalidate the loaded codelists and indexes, e.g. when the mapping files change.
+        """
+        self.codelists.clear()
+        self.indexes.clear()
+
+
+def build_index(items: list, input_field: str) -> dict:
+    """
+    Build the index of a list codelist: value to position of the first matching item.
+
+    Parameters
+    ----------
+    items: list. Codelist items.
+    input_field: str. The field name of the codelist items to index.
+
+    Returns
+    -------
+    dict: Value to item position.
+    """
+    index = {}
+    for position, item in enumerate(items):
+        field = item.get(input_field)
+        for key in (field if isinstance(field, list) else [field]):
+            if isinstance(key, str) and key not in index:
+                index[key] = position
+
+    # String fields match by substring, an earlier item containing the key wins
+    for key, position in index.items():
+        for earlier in range(position):
+            field = items[earlier].get(input_field)
+            if isinstance(field, str) and key in field:
+                index[key] = earlier
+                break
+
+    return index
+
+
+def scan(items: list, value, input_field: str):
+    """
+    Linear search of the first item whose `input_field` contains the value.
+
+    Returns
+    -------
+    int or None: Position of the item, None if not found.
+    """
+    for position, item in enumerate(items):
+        if value in item[input_field]:
+            return position
+    return None
+
+
+# Registry shared by all the templates of the process
+CODELISTS = CodelistRegistry()
@@ -0,0 +1,425 @@
+# inbuilt libraries
+import logging
+import multiprocessing
+import os
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from itertools import islice
+
+# third-party libraries
+import pycsw.core.config
+from pycsw.core import metadata, repository
+from pygeometa.core import MCFReadError, read_mcf
+from pygeometa.schemas.iso19139 import ISO19139OutputSchema
+
+# custom classes
+from model.codelists import CODELISTS
+from model.dataset import Dataset
+from model.record_payloads import PayloadBuilder
+from model.template import get_j2_template, get_record_preprocessor
+from schemas.pygeometa.iso19139_inspire import ISO19139_inspireOutputSchema
+from schemas.pygeometa.iso19139_inspire.record import UnsupportedRecord
+from schemas.pygeometa.iso19139_inspire.record import record_values as iso19139_inspire_record_values
+
+
+LOGGER = logging.getLogger(__name__)
+log_module = "[converter]"
+OUPUT_SCHEMA = {
+    "iso19139_inspire": ISO19139_inspireOutputSchema,
+    "iso19139": ISO19139OutputSchema
+}
+# pycsw record values of the MCF of each output schema, without parsing the ISO XML
+RECORD_MAPPERS = {
+    "iso19139_inspire": iso19139_inspire_record_values
+}
+# pycsw record values: 'mcf' (RECORD_MAPPERS, parse_record() if not available, checked against
+# parse_record() by tests/test_record_builder.py), 'parse_record' or 'check' (mcf, logging the differences with parse_record)
+RECORD_BUILDER = os.environ.get("PYCSW_RECORD_BUILDER", "mcf").lower()
+# Datasets in a row that break the pool of worker processes (e.g. the worker is killed) before the harvest is stopped
+POOL_RESTARTS = 3
+# MCF versions supported by pygeometa.core.read_mcf()
+MCF_VERSIONS = ["1.0"]
+
+# Converter of each worker process, see init_worker()
+_converter = None
+
+
+class DatasetConverter:
+    def __init__(
+        self,
+        database: str,
+        table: str,
+        base_url: str,
+        mappings_folder: str = "ckan2pycsw/mappings",
+        ckan_schema: str = "iso19139_geodcatap",
+        output_schema: str = "iso19139_inspire",
+        pycsw_config: str = None):
+        """
+        Constructor of the DatasetConverter class.
+
+        Converts raw CKAN datasets into pycsw record values:
+        Dataset -> MCF -> ISO XML -> pycsw record.
+
+        The converter lives for the whole run (one per worker process): the output
+        schema instance is created once and its template is loaded when the converter
+        is created, the CKAN templates and codelists are cached on first use.
+
+        Attributes
+        ----------
+        database: str. SQLAlchemy URL of the pycsw repository.
+        table: str. Table of the pycsw records.
+        base_url: str. URL of the CKAN endpoint retrieved from envvars.
+        mappings_folder: str. Folder of the mappings.
+        ckan_schema: str. Dataset dict schema to transform CKAN Schema to CSW.
+        output_schema: str. pycsw output schema, ISO19139 if not available.
+        pycsw_config: str, optional. pycsw configuration file, to build the GetRecordById payload
+            of each record, see model.record_payloads.PayloadBuilder. No payloads if None.
+        """
+        self.base_url = base_url
+        self.mappings_folder = mappings_folder
+        self.ckan_schema = ckan_schema
+        self.output_schema = output_schema
+        self.context = pycsw.core.config.StaticContext()
+        # Only used by parse_record() to build the record objects
+        self.repo = repository.Repository(database, self.context, table=table)
+        # The CKAN templates are parsed once per process, not on the first dataset
+        get_record_preprocessor(ckan_schema, mappings_folder)
+        # Select an output schema based on OUPUT_SCHEMA if not exists use ISO19139
+        if output_schema in OUPUT_SCHEMA:
+            self.iso_os = OUPUT_SCHEMA[output_schema]()
+            get_j2_template("pygeometa", self.iso_os.template_dir, mappings_folder)
+        else:
+            LOGGER.warning(f"{log_module}:DatasetConverter | Output schema {output_schema} not available, using iso19139")
+            self.iso_os = ISO19139OutputSchema()
+        self.payload_builder = PayloadBuilder(pycsw_config) if pycsw_config else None
+        if self.payload_builder is not None and not self.payload_builder.available:
+            LOGGER.warning(f"{log_module}:DatasetConverter | The pycsw apiso profile is not enabled or there is a repository filter, no GetRecordById payloads")
+            self.payload_builder = None
+
+    def convert(self, dataset: dict, timings: dict = None) -> dict:
+        """
+        Convert a CKAN dataset into the column values of a pycsw record.
+
+        Parameters
+        ----------
+        dataset: dict. Dataset data from CKAN API.
+        timings: dict, optional. Filled with the seconds of each stage: render, read_mcf, write and parse_record.
+
+        Returns
+        -------
+        dict: Column values of the pycsw record.
+        """
+        timings = {} if timings is None else timings
+        start = time.perf_counter()
+        dataset_metadata = Dataset(dataset_raw=dataset, base_url=self.base_url, mappings_folder=self.mappings_folder, csw_schema=self.ckan_schema)
+        mcf = dataset_metadata.render_template
+        timings["render"], start = lap(start)
+        mcf_dict = normalize_mcf(mcf)
+        timings["read_mcf"], start = lap(start)
+
+        if self.output_schema in OUPUT_SCHEMA:
+            # lxml tree, parse_record() does not parse the XML again
+            xml = self.iso_os.write(mcf=mcf_dict, stringify=False, mappings_folder=self.mappings_folder)
+        else:
+            xml = self.iso_os.write(mcf=mcf_dict)
+        timings["write"], start = lap(start)
+
+        values = self.record_values(mcf_dict, xml)
+        timings["parse_record"] = lap(start)[0]
+        return values
+
+    def record_values(self, mcf_dict: dict, xml) -> dict:
+        """
+        Column values of the pycsw record of an MCF and its ISO XML.
+
+        With the default `PYCSW_RECORD_BUILDER=mcf`, the values are built from the MCF by
+        the mapper of the output schema, see `RECORD_MAPPERS`, and the XML is only used for
+        the `xml` and `anytext` columns. Otherwise, or if the output schema has no mapper or
+        the MCF is not supported by it, the XML is parsed by `pycsw.core.metadata.parse_record()`.
+
+        Parameters
+        ----------
+        mcf_dict: dict. MCF of the record.
+        xml: lxml.etree._Element or str. ISO XML of the record.
+
+        Returns
+        -------
+        dict: Column values of the pycsw record.
+        """
+        mapper = RECORD_MAPPERS.get(self.output_schema) if RECORD_BUILDER != "parse_record" else None
+        values = None
+        if mapper is not None and not isinstance(xml, str):
+            try:
+                values = mapper(self.context, mcf_dict, xml)
+            except UnsupportedRecord as e:
+                LOGGER.debug(f"{log_module}:DatasetConverter | Record built with parse_record: {e}")
+        if values is None or RECORD_BUILDER == "check":
+            # parse xml
+            record = metadata.parse_record(self.context, xml, self.repo)[0]
+            parsed_values = record_values(record)
+            if values is not None:
+                differences = record_differences(values, parsed_values)
+                if differences:
+                    LOGGER.warning(f"{log_module}:DatasetConverter | Record of {values.get('identifier')} differs from parse_record: {differences}")
+            values = parsed_values
+        return values
+
+    def convert_result(self, dataset: dict) -> dict:
+        """
+        Convert a CKAN dataset, catching any error so it can be reported per dataset.
+
+        Parameters
+        ----------
+        dataset: dict. Dataset data from CKAN API.
+
+        Returns
+        -------
+        dict: Result with the dataset `id`, `name`, `dcat_type`, `metadata_modified`,
+        the record `values`, its GetRecordById `payload` (None without `pycsw_config` or if it
+        could not be built), the `timings` of its stages and the `error` and `traceback`
+        if the conversion failed.
+        """
+        result = {
+            "id": dataset.get("id"),
+            "name": dataset.get("name"),
+            "dcat_type": dataset["dcat_type"].rsplit("/", 1)[-1],
+            "metadata_modified": dataset.get("metadata_modified"),
+            "values": None,
+            "payload": None,
+            "error": None,
+            "traceback": None,
+            "timings": {},
+        }
+        try:
+            result["values"] = self.convert(dataset, result["timings"])
+        except Exception as e:
+            result["error"] = str(e)
+            result["traceback"] = traceback.format_exc()
+            return result
+        if self.payload_builder is not None:
+            start = time.perf_counter()
+            mappings = self.context.md_core_model["mappings"]
+            values = result["values"]
+            try:
+                # pycsw sends the stored XML of the full ISO records only
+                if values.get(mappings["pycsw:Typename"]) == "gmd:MD_Metadata":
+                    result["payload"] = self.payload_builder.payload(values[mappings["pycsw:Identifier"]], values[mappings["pycsw:XML"]], result["metadata_modified"])
+            except Exception as e:
+                # The record is still written, pycsw answers its GetRecordById requests
+                LOGGER.warning(f"{log_module}:DatasetConverter | Fail when building the GetRecordById payload of {result['name']}: {e}")
+            result["timings"]["payload"] = lap(start)[0]
+        return result
+
+
+def normalize_mcf(mcf) -> dict:
+    """
+    MCF dictionary of a rendered CKAN dataset.
+
+    The MCF built from a CKAN dataset is already a dict with no `base_mcf` includes,
+    so it is only checked for its version and used as is. Any other MCF (YAML string,
+    file path or dict with includes) is read by `pygeometa.core.read_mcf()`, which
+    walks and copies the whole dict and formats it into a debug message.
+
+    Parameters
+    ----------
+    mcf: dict or str. MCF data.
+
+    Returns
+    -------
+    dict: MCF data.
+
+    Raises
+    ------
+    pygeometa.core.MCFReadError: If the MCF has no version or it is not supported.
+    """
+    if not isinstance(mcf, dict) or has_base_mcf(mcf):
+        return read_mcf(mcf)
+    try:
+        mcf_version = str(mcf["mcf"]["version"])
+    except (KeyError, TypeError):
+        raise MCFReadError("no MCF version specified")
+    if not any(version.startswith(mcf_version) for version in MCF_VERSIONS):
+        raise MCFReadError(f"invalid / unsupported version {mcf_version}")
+    return mcf
+
+
+def has_base_mcf(mcf: dict) -> bool:
+    """
+    Whether an MCF dict, or any dict nested in it, includes a `base_mcf`.
+    """
+    return "base_mcf" in mcf or any(isinstance(value, dict) and has_base_mcf(value) for value in mcf.values())
+
+
+def record_values(record) -> dict:
+    """
+    Get the column values of a pycsw record, so it can be sent between processes.
+
+    Parameters
+    ----------
+    record: pycsw record object.
+
+    Returns
+    -------
+    dict: Column values of the record.
+    """
+    return {key: value for key, value in vars(record).items() if not key.startswith("_sa_")}
+
+
+def record_differences(values: dict, reference: dict, ignore: tuple = ("insert_date",)) -> list:
+    """
+    Columns with a different value in two pycsw records.
+
+    Parameters
+    ----------
+    values: dict. Column values of a record.
+    reference: dict. Column values of the reference record, e.g. built by parse_record().
+    ignore: tuple. Columns not compared.
+
+    Returns
+    -------
+    list: (column, value, reference value) tuples, a missing column is `KeyError`.
+    """
+    return [
+        (column, values.get(column, KeyError), reference.get(column, KeyError))
+        for column in sorted(set(values) | set(reference))
+        if column not in ignore and values.get(column, KeyError) != reference.get(column, KeyError)
+    ]
+
+
+def lap(start: float) -> tuple:
+    """
+    Seconds since `start` and the current time, to time consecutive stages.
+    """
+    now = time.perf_counter()
+    return now - start, now
+
+
+def init_worker(**converter_args):
+    """
+    Initialize the DatasetConverter of a worker process.
+
+    Parameters
+    ----------
+    converter_args: DatasetConverter arguments.
+    """
+    global _converter
+    _converter = DatasetConverter(**converter_args)
+
+
+def convert_worker(dataset: dict) -> dict:
+    """
+    Convert a CKAN dataset with the DatasetConverter of the worker process.
+
+    Parameters
+    ----------
+    dataset: dict. Dataset data from CKAN API.
+
+    Returns
+    -------
+    dict: See DatasetConverter.convert_result().
+    """
+    return _converter.convert_result(dataset)
+
+
+def failed_result(dataset: dict, error: BaseException) -> dict:
+    """
+    Result of a dataset whose conversion did not return a result, e.g. its worker process died.
+
+    Parameters
+    ----------
+    dataset: dict. Dataset data from CKAN API.
+    error: BaseException. Error raised instead of the result.
+
+    Returns
+    -------
+    dict: See DatasetConverter.convert_result().
+    """
+    return {
+        "id": dataset.get("id"),
+        "name": dataset.get("name"),
+        "dcat_type": dataset["dcat_type"].rsplit("/", 1)[-1],
+        "metadata_modified": dataset.get("metadata_modified"),
+        "values": None,
+        "payload": None,
+        "error": str(error) or type(error).__name__,
+        "traceback": "".join(traceback.format_exception(type(error), error, error.__traceback__)),
+        "timings": {},
+    }
+
+
+def convert_datasets(datasets, workers: int = 1, in_flight: int = None, **converter_args):
+    """
+    Convert CKAN datasets into pycsw record values using a pool of worker processes.
+
+    Up to `in_flight` datasets are submitted to the pool, and results are
+    yielded in the same order as the input datasets. With `workers` <= 1 the
+    datasets are converted in the current process.
+
+    A dataset that cannot be sent to or converted by the pool gets a failed result,
+    see `failed_result()`, and is retried by the next harvest. If a worker process
+    dies, the pool is broken: a new one is created, the first dataset in flight is
+    converted again on its own, so only the dataset that broke the pool fails, and
+    the others are submitted again. After `POOL_RESTARTS` datasets in a row broke
+    the pool, `BrokenProcessPool` is raised.
+
+    Parameters
+    ----------
+    datasets: iterable. Datasets data from CKAN API.
+    workers: int. Number of worker processes.
+    in_flight: int, optional. Datasets submitted to the pool and not yet yielded, default: twice the number of workers.
+    converter_args: DatasetConverter arguments.
+
+    Returns
+    -------
+    generator: A generator that yields DatasetConverter.convert_result() dicts.
+    """
+    if workers <= 1:
+        converter = DatasetConverter(**converter_args)
+        for dataset in datasets:
+            yield converter.convert_result(dataset)
+        LOGGER.info(f"{log_module}:convert_datasets | Codelist lookups: {CODELISTS.stats()}")
+        return
+
+    in_flight = max(in_flight or workers * 2, workers)
+    LOGGER.info(f"{log_module}:convert_datasets | Workers: {workers}, datasets in flight: {in_flight}")
+    datasets = iter(datasets)
+    # spawn: the CKAN fetcher threads of this process must not be forked
+    create_pool = partial(ProcessPoolExecutor, max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=partial(init_worker, **converter_args))
+    executor = create_pool()
+    broken = 0
+    try:
+        pending = deque((dataset, executor.submit(convert_worker, dataset)) for dataset in islice(datasets, in_flight))
+        while pending:
+            dataset, future = pending.popleft()
+            try:
+                result = future.result()
+            except BrokenProcessPool as e:
+                LOGGER.error(f"{log_module}:convert_datasets | Worker process pool broken, converting {dataset.get('name')} again on its own: {e}")
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = create_pool()
+                try:
+                    result = executor.submit(convert_worker, dataset).result()
+                    broken = 0
+                except BrokenProcessPool as e:
+                    broken += 1
+                    if broken >= POOL_RESTARTS:
+                        raise
+                    result = failed_result(dataset, e)
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    executor = create_pool()
+                except Exception as e:
+                    result = failed_result(dataset, e)
+                pending = deque((item, executor.submit(convert_worker, item)) for item, _ in pending)
+            except Exception as e:
+                # e.g. the dataset or its result cannot be pickled
+                result = failed_result(dataset, e)
+            dataset = next(datasets, None)
+            if dataset is not None:
+                pending.append((dataset, executor.submit(convert_worker, dataset)))
+            yield result
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
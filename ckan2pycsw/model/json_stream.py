@@ -0,0 +1,175 @@
+# inbuilt libraries
+import codecs
+import json
+
+
+DECODER = json.JSONDecoder()
+WHITESPACE = " \t\n\r"
+
+
+class JSONStream:
+    def __init__(self, chunks):
+        """
+        Constructor of the JSONStream class.
+
+        Incremental reader of a UTF-8 JSON document received in chunks, e.g.
+        `requests.Response.iter_content()`. Only the current value and the last
+        chunk are kept in memory: each value is decoded by the C JSON decoder
+        (`json.JSONDecoder.raw_decode`) as soon as it is complete.
+
+        Attributes
+        ----------
+        chunks: iterable. Bytes of the document.
+        """
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def read(self) -> bool:
+        """
+        Append the next chunk to the buffer, dropping the already decoded text.
+
+        Returns
+        -------
+        bool: False at the end of the document.
+        """
+        if self.eof:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.eof = True
+            text = self.decoder.decode(b"", final=True)
+        else:
+            text = self.decoder.decode(chunk)
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        Skip whitespace and return the next character, an empty string at the end of the document.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        """
+        Consume the next character, which must be one of `chars`.
+
+        Raises
+        ------
+        ValueError: If the next character is not one of `chars`.
+        """
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Invalid JSON: expected one of {chars!r} at {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """
+        Decode the next JSON value, reading chunks until it is complete.
+
+        The buffer is at least doubled between decoding attempts, so a value spread
+        over many chunks is not decoded again for each chunk.
+
+        Raises
+        ------
+        ValueError: If the value is not valid JSON.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def fill(self) -> bool:
+        """
+        Read chunks until the pending text is twice as long.
+
+        Returns
+        -------
+        bool: False if the document has no more chunks.
+        """
+        target = 2 * max(1, len(self.buffer) - self.pos)
+        read = False
+        while len(self.buffer) - self.pos < target and self.read():
+            read = True
+        return read
+
+    def find_key(self, key: str):
+        """
+        Move to the value of a key of the next JSON object, skipping the values of the previous keys.
+
+        Raises
+        ------
+        ValueError: If the next value is not an object or the key is not found.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            raise ValueError(f"Invalid JSON: key {key!r} not found")
+        while True:
+            name = self.value()
+            self.expect(":")
+            if name == key:
+                return
+            self.value()
+            if self.expect(",}") == "}":
+                raise ValueError(f"Invalid JSON: key {key!r} not found")
+
+    def iter_items(self, path: tuple = ()):
+        """
+        Decode the items of a JSON array one by one.
+
+        Parameters
+        ----------
+        path: tuple. Keys of the nested objects containing the array, e.g. ("result", "results").
+
+        Returns
+        -------
+        generator: A generator that yields the items of the array.
+
+        Raises
+        ------
+        ValueError: If the document is not valid JSON or has no array at `path`.
+        """
+        for key in path:
+            self.find_key(key)
+        self.expect("[")
+        if self.peek() == "]":
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+
+def iter_json_items(chunks, path: tuple = ()):
+    """
+    Decode the items of an array of a JSON document received in chunks, see `JSONStream`.
+
+    Parameters
+    ----------
+    chunks: iterable. Bytes of the document.
+    path: tuple. Keys of the nested objects containing the array, e.g. ("result", "results").
+
+    Returns
+    -------
+    generator: A generator that yields the items of the array.
+    """
+    return JSONStream(chunks).iter_items(path)
@@ -0,0 +1,319 @@
+# inbuilt libraries
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+LOGGER = logging.getLogger(__name__)
+log_module = "[metrics]"
+NAMESPACE = "ckan2pycsw"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Harvest stages, in pipeline order
+STAGES = ["fetch", "render", "read_mcf", "write", "parse_record", "payload", "insert", "index", "export"]
+# Upper bounds in seconds: from per-dataset stages (ms) to a whole export (minutes)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+COUNTERS = {
+    "datasets_total": "CKAN datasets by harvest status (ok, failed, skipped).",
+    "fetched_bytes_total": "Bytes of the CKAN package_search responses.",
+    "fetched_pages_total": "CKAN package_search pages by status (ok, failed).",
+    "harvest_runs_total": "Harvest runs by result (success, incomplete, error).",
+    "stage_idle_seconds_total": "Seconds the harvest stages (fetch, convert, write) waited on the queues between them, for input (queue empty) or output (queue full).",
+    "response_cache_requests_total": "pycsw requests by CSW operation and response cache result (memory, disk: hits of each tier, miss, bypass: not cached).",
+    "record_payload_requests_total": "GetRecordById requests of the stored payloads by result (hit, not_modified: 304, miss: answered by pycsw).",
+}
+GAUGES = {
+    "harvest_last_run_seconds": "Duration of the last harvest run.",
+    "harvest_last_run_timestamp_seconds": "End time of the last harvest run.",
+    "harvest_last_success_timestamp_seconds": "End time of the last successful harvest run.",
+    "queue_depth": "Items in the queues between the harvest stages, by producing stage (fetch: datasets to convert, convert: records to write).",
+    "response_cache_entries": "Responses in the memory tier of the pycsw response cache of the process.",
+    "response_cache_bytes": "Bytes of the responses in the memory tier of the pycsw response cache of the process.",
+}
+HISTOGRAMS = {
+    "stage_duration_seconds": "Duration of the harvest stages: per dataset (fetch, render, read_mcf, write, parse_record, payload), per batch (insert) and per run (index, export).",
+    "response_duration_seconds": "Duration of the pycsw responses by response cache result (hit, miss, bypass) or stored payload (payload).",
+}
+
+
+class HarvestMetrics:
+    def __init__(self, buckets: tuple = BUCKETS):
+        """
+        Constructor of the HarvestMetrics class.
+
+        Counters, gauges and stage duration histograms of the harvest, in the
+        Prometheus text format. Values are cumulative over the life of the process,
+        the figures of the current run are also kept for its summary, see `run_summary()`.
+
+        Attributes
+        ----------
+        buckets: tuple. Upper bounds in seconds of the histogram buckets.
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.gauges = {}
+        # (name, labels) -> [bucket counts..., count, sum]
+        self.histograms = {}
+        self.start_run()
+
+    def start_run(self):
+        """
+        Reset the figures of the current run.
+        """
+        with self.lock:
+            self.run_started = time.time()
+            self.run_counters = defaultdict(float)
+            self.run_stages = defaultdict(lambda: [0, 0.0])
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """
+        Increase a counter, see `COUNTERS`.
+
+        Parameters
+        ----------
+        name: str. Name of the counter, without the namespace.
+        value: float. Increment.
+        labels: Labels of the series, e.g. status="ok".
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += value
+            self.run_counters[key] += value
+
+    def set(self, name: str, value: float, **labels):
+        """
+        Set a gauge, see `GAUGES`.
+        """
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, stage: str, seconds: float):
+        """
+        Add a duration to the histogram of a stage.
+
+        Parameters
+        ----------
+        stage: str. Name of the stage, see `STAGES`.
+        seconds: float. Duration of the stage.
+        """
+        self.observe_histogram("stage_duration_seconds", seconds, stage=stage)
+        with self.lock:
+            run_stage = self.run_stages[stage]
+            run_stage[0] += 1
+            run_stage[1] += seconds
+
+    def observe_histogram(self, name: str, seconds: float, **labels):
+        """
+        Add a duration to a histogram, see `HISTOGRAMS`.
+
+        Parameters
+        ----------
+        name: str. Name of the histogram, without the namespace.
+        seconds: float. Duration.
+        labels: Labels of the series, e.g. cache="hit".
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            series = self.histograms.get(key)
+            if series is None:
+                series = self.histograms[key] = [0] * (len(self.buckets) + 2) + [0.0]
+            series[bisect_left(self.buckets, seconds)] += 1
+            series[-2] += 1
+            series[-1] += seconds
+
+    @contextmanager
+    def timer(self, stage: str):
+        """
+        Time a block of code as one observation of a stage.
+
+        Parameters
+        ----------
+        stage: str. Name of the stage, see `STAGES`.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def timed(self, iterable, stage: str):
+        """
+        Iterate over `iterable`, timing the wait for each item as one observation of a stage.
+
+        Parameters
+        ----------
+        iterable: iterable. E.g. a generator of CKAN datasets.
+        stage: str. Name of the stage, see `STAGES`.
+
+        Returns
+        -------
+        generator: A generator that yields the items of `iterable`.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(stage, time.perf_counter() - start)
+            yield item
+
+    def run_summary(self) -> dict:
+        """
+        Figures of the current run.
+
+        Returns
+        -------
+        dict: Start time, seconds, counters (`name` or `name{label=value}` keys) and
+        count, seconds and mean milliseconds of each stage.
+        """
+        with self.lock:
+            counters = {format_series(name, labels): int(value) if value.is_integer() else value for (name, labels), value in sorted(self.run_counters.items())}
+            stages = {
+                stage: {"count": count, "seconds": round(seconds, 4), "mean_ms": round(1000 * seconds / count, 4) if count else None}
+                for stage, (count, seconds) in sorted(self.run_stages.items(), key=lambda item: stage_order(item[0]))
+            }
+            return {
+                "start": datetime.fromtimestamp(self.run_started, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "seconds": round(time.time() - self.run_started, 3),
+                "counters": counters,
+                "stages": stages,
+            }
+
+    def exposition(self) -> str:
+        """
+        All the metrics in the Prometheus text exposition format.
+
+        Returns
+        -------
+        str: Metrics text, e.g. for a node_exporter textfile or a /metrics endpoint.
+        """
+        lines = []
+        with self.lock:
+            for kind, metrics, values in (("counter", COUNTERS, self.counters), ("gauge", GAUGES, self.gauges)):
+                for name, help_text in metrics.items():
+                    series = sorted((labels, value) for (metric, labels), value in values.items() if metric == name)
+                    if not series:
+                        continue
+                    lines.append(f"# HELP {NAMESPACE}_{name} {help_text}")
+                    lines.append(f"# TYPE {NAMESPACE}_{name} {kind}")
+                    lines.extend(f"{NAMESPACE}_{format_series(name, labels)} {format_value(value)}" for labels, value in series)
+            for name, help_text in HISTOGRAMS.items():
+                series = sorted(((labels, values) for (metric, labels), values in self.histograms.items() if metric == name), key=lambda item: (stage_order(dict(item[0]).get("stage", "")), item[0]))
+                if not series:
+                    continue
+                lines.append(f"# HELP {NAMESPACE}_{name} {help_text}")
+                lines.append(f"# TYPE {NAMESPACE}_{name} histogram")
+                for labels, values in series:
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + (float("inf"),), values):
+                        cumulative += count
+                        lines.append(f"{NAMESPACE}_{format_series(name + '_bucket', labels + (('le', format_value(bound)),))} {cumulative}")
+                    lines.append(f"{NAMESPACE}_{format_series(name + '_count', labels)} {values[-2]}")
+                    lines.append(f"{NAMESPACE}_{format_series(name + '_sum', labels)} {format_value(values[-1])}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        """
+        Write the metrics to a file for the node_exporter textfile collector.
+
+        The file is written next to `path` and renamed, so the collector never reads a partial file.
+
+        Parameters
+        ----------
+        path: str. Path of the .prom file.
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.exposition())
+        os.replace(tmp_path, path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Serves `HarvestMetrics.exposition()` at /metrics.
+    """
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.metrics.exposition().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port: int, metrics: HarvestMetrics = None, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Serve the metrics at http://<host>:<port>/metrics from a daemon thread.
+
+    Parameters
+    ----------
+    port: int. Port of the metrics endpoint.
+    metrics: HarvestMetrics, optional. Metrics to serve, default: `METRICS`.
+    host: str. Address of the metrics endpoint.
+
+    Returns
+    -------
+    http.server.ThreadingHTTPServer: The running server.
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.metrics = metrics or METRICS
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    LOGGER.info(f"{log_module}:start_metrics_server | Metrics endpoint: http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def write_run_summary(path: str, summary: dict):
+    """
+    Append the summary of a run to a JSON Lines file.
+
+    Parameters
+    ----------
+    path: str. Path of the .jsonl file.
+    summary: dict. Run summary, see `HarvestMetrics.run_summary()`.
+    """
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(summary) + "\n")
+
+
+def format_series(name: str, labels: tuple) -> str:
+    """
+    Name of a series with its labels, e.g. 'datasets_total{status="ok"}'.
+    """
+    if not labels:
+        return name
+    label_text = ",".join(f'{key}="{escape_label(str(value))}"' for key, value in labels)
+    return f"{name}{{{label_text}}}"
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def stage_order(stage: str) -> tuple:
+    return (STAGES.index(stage), stage) if stage in STAGES else (len(STAGES), stage)
+
+
+# Metrics of the harvests of this process
+METRICS = HarvestMetrics()
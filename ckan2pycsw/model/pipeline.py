@@ -0,0 +1,126 @@
+# inbuilt libraries
+import logging
+import queue
+import threading
+import time
+
+# custom classes
+from model.metrics import METRICS
+
+
+LOGGER = logging.getLogger(__name__)
+log_module = "[pipeline]"
+# Seconds between checks of the stop flag by a producer waiting on a full queue
+POLL_INTERVAL = 0.1
+# Seconds the consumer waits for the producer thread to stop, e.g. blocked reading a CKAN page
+JOIN_TIMEOUT = 10
+_DONE = object()
+
+
+class StageFailure:
+    def __init__(self, error: BaseException):
+        """
+        Constructor of the StageFailure class.
+
+        Error raised by the producer of a queue, re-raised in the consumer.
+
+        Attributes
+        ----------
+        error: BaseException. Exception raised by the producer.
+        """
+        self.error = error
+
+
+def pipe(iterable, maxsize: int, producer: str, consumer: str, metrics=None):
+    """
+    Run a stage of the harvest in its own thread, joined to the next stage by a bounded queue.
+
+    The items of `iterable` are produced by a daemon thread and yielded in the same
+    order. When the queue is full the producer waits (backpressure), when it is empty
+    the consumer waits, so the memory of the queue stays bounded while both stages run
+    concurrently. An exception of the producer is raised in the consumer, and if the
+    consumer stops early the producer is stopped and `iterable` closed in its thread.
+    The producer stops at its next item: if it is still blocked in `iterable` after
+    `JOIN_TIMEOUT` seconds, it is left behind (daemon thread) and the consumer goes on.
+
+    The queue depth is exposed in the `queue_depth{queue=<producer>}` gauge and the
+    seconds each stage waited in `stage_idle_seconds_total{stage, waiting_for}`
+    ("output": the queue was full, "input": the queue was empty) of `model.metrics.METRICS`.
+
+    Parameters
+    ----------
+    iterable: iterable. Items produced by the stage, e.g. a generator of CKAN datasets.
+    maxsize: int. Maximum items in the queue.
+    producer: str. Name of the producing stage, also the name of the queue.
+    consumer: str. Name of the consuming stage.
+    metrics: model.metrics.HarvestMetrics, optional. Metrics of the queue, default: `METRICS`.
+
+    Returns
+    -------
+    generator: A generator that yields the items of `iterable`.
+    """
+    metrics = metrics or METRICS
+    maxsize = max(1, maxsize)
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    stats = {"peak": 0, "output": 0.0, "input": 0.0}
+
+    def put(item) -> bool:
+        try:
+            items.put_nowait(item)
+        except queue.Full:
+            start = time.perf_counter()
+            while True:
+                if stop.is_set():
+                    return False
+                try:
+                    items.put(item, timeout=POLL_INTERVAL)
+                    break
+                except queue.Full:
+                    continue
+            waited = time.perf_counter() - start
+            stats["output"] += waited
+            metrics.inc("stage_idle_seconds_total", waited, stage=producer, waiting_for="output")
+        depth = items.qsize()
+        stats["peak"] = max(stats["peak"], depth)
+        metrics.set("queue_depth", depth, queue=producer)
+        return True
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(StageFailure(e))
+        else:
+            put(_DONE)
+        finally:
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, name=f"{producer}_stage", daemon=True)
+    thread.start()
+    try:
+        while True:
+            try:
+                item = items.get_nowait()
+            except queue.Empty:
+                start = time.perf_counter()
+                item = items.get()
+                waited = time.perf_counter() - start
+                stats["input"] += waited
+                metrics.inc("stage_idle_seconds_total", waited, stage=consumer, waiting_for="input")
+            if item is _DONE:
+                return
+            if isinstance(item, StageFailure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        thread.join(JOIN_TIMEOUT)
+        if thread.is_alive():
+            LOGGER.warning(f"{log_module}:pipe | Stage {producer} did not stop in {JOIN_TIMEOUT}s, leaving its thread behind")
+        metrics.set("queue_depth", 0, queue=producer)
+        LOGGER.info(f"{log_module}:pipe | Queue {producer} -> {consumer}: peak {stats['peak']}/{maxsize} items, {producer} waited {stats['output']:.3f}s for {consumer}, {consumer} waited {stats['input']:.3f}s for {producer}")
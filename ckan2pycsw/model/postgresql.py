@@ -0,0 +1,195 @@
+# inbuilt libraries
+import io
+import logging
+import os
+import re
+
+# third-party libraries
+from sqlalchemy import LargeBinary, create_engine, inspect
+
+
+LOGGER = logging.getLogger(__name__)
+log_module = "[postgresql]"
+STAGING_SUFFIX = "_staging"
+# Maximum wait for the lock of the live tables in swap(): the queries waiting behind it are blocked meanwhile
+SWAP_LOCK_TIMEOUT = os.environ.get("PYCSW_SWAP_LOCK_TIMEOUT", "30s")
+# Index and trigger definitions of pg_get_indexdef() / pg_get_triggerdef(): "... ON [ONLY] [<schema>.]<table> ..."
+ON_TABLE = r"( ON (?:ONLY )?)(?:\S+\.)?{table}( )"
+INDEX_NAME = re.compile(r"^(CREATE (?:UNIQUE )?INDEX )(\S+)( ON )")
+
+
+class StagingTables:
+    def __init__(self, database: str, tables: list):
+        """
+        Constructor of the StagingTables class.
+
+        Full rebuild of PostgreSQL tables into staging copies that are swapped in when
+        finished, so the live tables keep serving the catalogue meanwhile: several pycsw
+        workers and pods can read the same database during the harvest.
+
+        Each staging table is created like its live table with only its primary key and
+        triggers (e.g. the PostGIS geometry and full text search `tsvector` triggers of
+        `pycsw.core.admin.setup_db()`), the other indexes (GiST, GIN, btree) are built
+        once the records are loaded, see `build_indexes()`, and the tables and their
+        indexes take the live names in one transaction, see `swap()`.
+
+        Attributes
+        ----------
+        database: str. SQLAlchemy URL of the PostgreSQL database.
+        tables: list. Names of the live tables, the staging tables are named with `STAGING_SUFFIX`.
+        """
+        self.engine = create_engine(database)
+        self.tables = list(tables)
+
+    @staticmethod
+    def staging_name(table: str) -> str:
+        """
+        Name of the staging table of a live table.
+        """
+        return f"{table}{STAGING_SUFFIX}"
+
+    def exists(self) -> bool:
+        """
+        Check if the staging tables of an interrupted rebuild exist.
+        """
+        names = inspect(self.engine).get_table_names()
+        return all(self.staging_name(table) in names for table in self.tables)
+
+    def create(self):
+        """
+        Create empty staging tables like the live ones, dropping any previous staging table.
+        """
+        with self.engine.begin() as conn:
+            for table in self.tables:
+                staging = self.staging_name(table)
+                LOGGER.info(f"{log_module}:StagingTables | Creating staging table: {staging}")
+                conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{staging}"')
+                conn.exec_driver_sql(f'CREATE TABLE "{staging}" (LIKE "{table}" INCLUDING DEFAULTS)')
+                primary_key = inspect(conn).get_pk_constraint(table)["constrained_columns"]
+                if primary_key:
+                    columns = ", ".join(f'"{column}"' for column in primary_key)
+                    conn.exec_driver_sql(f'ALTER TABLE "{staging}" ADD PRIMARY KEY ({columns})')
+                for trigger in self.definitions(conn, table, "triggers"):
+                    conn.exec_driver_sql(rename_table(trigger, table, staging))
+
+    def drop(self):
+        """
+        Drop the staging tables.
+        """
+        with self.engine.begin() as conn:
+            for table in self.tables:
+                conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{self.staging_name(table)}"')
+
+    def build_indexes(self):
+        """
+        Create the indexes of the live tables on the staging tables, other than the primary key, and analyze them.
+        """
+        with self.engine.begin() as conn:
+            for table in self.tables:
+                staging = self.staging_name(table)
+                for name, definition in self.definitions(conn, table, "indexes"):
+                    LOGGER.info(f"{log_module}:StagingTables | Creating index {name} on {staging}")
+                    definition = INDEX_NAME.sub(lambda match: f'{match.group(1)}"{self.staging_name(name)}"{match.group(3)}', rename_table(definition, table, staging))
+                    conn.exec_driver_sql(definition)
+                conn.exec_driver_sql(f'ANALYZE "{staging}"')
+
+    def swap(self):
+        """
+        Replace the live tables with the staging tables in one transaction.
+
+        Queries running on the live tables finish before they are dropped, the next
+        ones read the new tables. Indexes and the primary key take the live names,
+        e.g. `fts_gin_idx`, which pycsw looks up to enable full text search. If the
+        live tables cannot be locked within `SWAP_LOCK_TIMEOUT` the transaction fails
+        and the staging tables are kept, to be resumed by the next harvest.
+        """
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'")
+            for table in self.tables:
+                staging = self.staging_name(table)
+                indexes = [name for name, _ in self.definitions(conn, table, "indexes")]
+                primary_key = inspect(conn).get_pk_constraint(table).get("name")
+                staging_primary_key = inspect(conn).get_pk_constraint(staging).get("name")
+                conn.exec_driver_sql(f'DROP TABLE "{table}"')
+                conn.exec_driver_sql(f'ALTER TABLE "{staging}" RENAME TO "{table}"')
+                for name in indexes:
+                    conn.exec_driver_sql(f'ALTER INDEX IF EXISTS "{self.staging_name(name)}" RENAME TO "{name}"')
+                if primary_key and staging_primary_key:
+                    conn.exec_driver_sql(f'ALTER TABLE "{table}" RENAME CONSTRAINT "{staging_primary_key}" TO "{primary_key}"')
+        LOGGER.info(f"{log_module}:StagingTables | Staging tables swapped in: {', '.join(self.tables)}")
+
+    def definitions(self, conn, table: str, kind: str) -> list:
+        """
+        Definitions of the indexes (other than the primary key) or triggers of a table.
+
+        Parameters
+        ----------
+        conn: sqlalchemy.engine.Connection. Connection to the database.
+        table: str. Name of the table.
+        kind: str. "indexes": (name, CREATE INDEX statement) pairs, "triggers": CREATE TRIGGER statements.
+
+        Returns
+        -------
+        list: Definitions, in creation order.
+        """
+        if kind == "indexes":
+            rows = conn.exec_driver_sql(
+                "SELECT c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i "
+                "JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE i.indrelid = to_regclass(%(table)s) AND NOT i.indisprimary ORDER BY c.oid",
+                {"table": f'"{table}"'},
+            )
+            return [(name, definition) for name, definition in rows]
+        rows = conn.exec_driver_sql(
+            "SELECT pg_get_triggerdef(oid) FROM pg_trigger "
+            "WHERE tgrelid = to_regclass(%(table)s) AND NOT tgisinternal ORDER BY oid",
+            {"table": f'"{table}"'},
+        )
+        return [definition for definition, in rows]
+
+
+def rename_table(definition: str, table: str, new_table: str) -> str:
+    """
+    Point an index or trigger definition of `table` to `new_table`.
+    """
+    pattern = ON_TABLE.format(table=f'(?:"{re.escape(table)}"|{re.escape(table)})')
+    return re.sub(pattern, lambda match: f'{match.group(1)}"{new_table}"{match.group(2)}', definition, count=1)
+
+
+def copy_rows(connection, table, rows: list):
+    """
+    Load rows into a table with `COPY ... FROM STDIN`, in the transaction of `connection`.
+
+    Parameters
+    ----------
+    connection: sqlalchemy.engine.Connection. Connection of a PostgreSQL (psycopg2) database.
+    table: sqlalchemy.Table. Table of the rows.
+    rows: list. Column name to value dicts, missing columns are NULL.
+    """
+    columns = [column for column in table.columns if any(column.name in row for row in rows)]
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(copy_text(row.get(column.name), isinstance(column.type, LargeBinary)) for column in columns))
+        buffer.write("\n")
+    buffer.seek(0)
+    preparer = connection.dialect.identifier_preparer
+    statement = f"COPY {preparer.format_table(table)} ({', '.join(preparer.quote(column.name) for column in columns)}) FROM STDIN"
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(statement, buffer)
+    finally:
+        cursor.close()
+
+
+def copy_text(value, binary: bool = False) -> str:
+    """
+    Value of a column in the text format of COPY: NULL is `\\N`, backslashes, tabs and line breaks are escaped,
+    the bytes of a `binary` (bytea) column are in hex.
+    """
+    if value is None:
+        return "\\N"
+    if binary:
+        return "\\\\x" + bytes(value).hex()
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
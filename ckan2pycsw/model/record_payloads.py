@@ -0,0 +1,346 @@
+# inbuilt libraries
+import gzip
+import hashlib
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from urllib.parse import parse_qsl
+
+# third-party libraries
+from lxml import etree
+from sqlalchemy import Column, LargeBinary, MetaData, String, Table, and_, create_engine, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import NullPool
+
+# custom classes
+from model.metrics import METRICS
+
+
+LOGGER = logging.getLogger(__name__)
+log_module = "[record_payloads]"
+# Output schema of the stored payloads: the ISO XML of the records, as harvested
+OUTPUT_SCHEMA = "http://www.isotc211.org/2005/gmd"
+# GetRecordById KVP requests answered from the payloads: parameter (lower case) to required value, None for any
+FAST_PATH_PARAMETERS = {
+    "service": "CSW",
+    "version": "2.0.2",
+    "request": "GetRecordById",
+    "id": None,
+    "outputschema": OUTPUT_SCHEMA,
+    "elementsetname": "full",
+}
+# Keep IN (...) clauses under the SQLite host parameter limit
+CHUNK_SIZE = 500
+
+
+class RecordPayloads:
+    def __init__(self, database: str, table_prefix: str = "ckan2pycsw", table_suffix: str = "", create: bool = True):
+        """
+        Constructor of the RecordPayloads class.
+
+        Ready to send GetRecordById response bodies of the pycsw records, per record
+        identifier and output schema, built by `PayloadBuilder` when the records are
+        harvested and written in the same transaction, see `model.bulk_writer.BulkWriter`.
+        Each payload has its `format`, the digest of the pycsw settings it was built with:
+        a payload of another format is not served.
+
+        Attributes
+        ----------
+        database: str. SQLAlchemy URL of the pycsw repository.
+        table_prefix: str. Prefix of the payloads table.
+        table_suffix: str. Suffix of the payloads table, e.g. of the staging tables of a PostgreSQL full rebuild.
+        create: bool. Create the table if it does not exist, False to only read it (pycsw servers).
+        """
+        # SQLite: no pooled connections to a database file replaced by a full rebuild
+        self.engine = create_engine(database, poolclass=NullPool) if database.startswith("sqlite") else create_engine(database)
+        self.metadata = MetaData()
+        self.table = Table(
+            f"{table_prefix}_record_payloads{table_suffix}",
+            self.metadata,
+            Column("identifier", String(256), primary_key=True),
+            Column("output_schema", String(256), primary_key=True),
+            Column("format", String(64), nullable=False),
+            Column("etag", String(128), nullable=False),
+            Column("last_modified", String(64)),
+            Column("body", LargeBinary, nullable=False),
+            Column("gzip_body", LargeBinary),
+        )
+        if create:
+            self.metadata.create_all(self.engine)
+
+    def get(self, identifier: str, output_schema: str, payload_format: str, compressed: bool = False):
+        """
+        Payload of a record.
+
+        Parameters
+        ----------
+        identifier: str. Identifier of the pycsw record.
+        output_schema: str. Output schema of the response.
+        payload_format: str. Format of the payload, see `PayloadBuilder.format`.
+        compressed: bool. Return the gzip body if there is one.
+
+        Returns
+        -------
+        tuple or None: ETag, Last-Modified, body and whether the body is gzip, None if there is no payload.
+        """
+        table = self.table
+        columns = [table.c.etag, table.c.last_modified, table.c.body] + ([table.c.gzip_body] if compressed else [])
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(*columns).where(and_(
+                    table.c.identifier == identifier,
+                    table.c.output_schema == output_schema,
+                    table.c.format == payload_format,
+                ))
+            ).first()
+        if row is None:
+            return None
+        if compressed and row[3] is not None:
+            # Another representation, another ETag
+            return f'"{row[0]}-gzip"', row[1], bytes(row[3]), True
+        return f'"{row[0]}"', row[1], bytes(row[2]), False
+
+    def delete(self, conn, identifiers: list):
+        """
+        Delete the payloads of records, in the transaction of `conn`.
+
+        Parameters
+        ----------
+        conn: sqlalchemy.engine.Connection. Connection of the transaction.
+        identifiers: list. Identifiers of the pycsw records.
+        """
+        for i in range(0, len(identifiers), CHUNK_SIZE):
+            conn.execute(self.table.delete().where(self.table.c.identifier.in_(identifiers[i:i + CHUNK_SIZE])))
+
+    def drop(self):
+        """
+        Drop the payloads table, if it exists.
+        """
+        self.table.drop(self.engine, checkfirst=True)
+
+
+class PayloadBuilder:
+    def __init__(self, pycsw_config: str):
+        """
+        Constructor of the PayloadBuilder class.
+
+        Builds the response of the pycsw server to a GetRecordById request of a record
+        in `OUTPUT_SCHEMA` with the `full` element set, from the ISO XML of the record.
+        The response is built as pycsw 2.x does (`Csw2.getrecordbyid()` and
+        `Csw._write_response()`), with the namespaces of the configured profiles, the
+        OGC schemas location, encoding and pretty print of its configuration, so the
+        body is byte for byte the one of pycsw. If the configuration has a
+        `gzip_compresslevel`, the body is also compressed with gzip.
+
+        The payloads are not available if the configuration has a `[repository] filter`:
+        pycsw hides the records outside of it, the payloads are not filtered.
+
+        Attributes
+        ----------
+        pycsw_config: str. pycsw configuration file.
+        available: bool. The apiso profile, which serves `OUTPUT_SCHEMA`, is enabled and there is no repository filter.
+        format: str. Digest of the settings of the payloads, different if the configuration or pycsw change.
+        mimetype: str. Content type of the responses.
+        """
+        from pycsw import server
+        from pycsw.core import util
+        from pycsw.plugins.profiles import profile
+
+        csw = server.Csw(pycsw_config, {"QUERY_STRING": "", "REQUEST_METHOD": "GET"}, version="2.0.2")
+        self.config = csw.config
+        self.context = csw.context
+        # Profiles loaded as in Csw.dispatch(), they add their namespaces to the context
+        profiles = {}
+        if self.config.has_option("server", "profiles"):
+            plugins = profile.load_profiles(os.path.join("pycsw", "plugins", "profiles"), profile.Profile, self.config.get("server", "profiles"))
+            for plugin in plugins["plugins"].values():
+                loaded = plugin(self.context.model, self.context.namespaces, self.context)
+                profiles[loaded.outputschema] = loaded
+        self.repository_filter = self.config.get("repository", "filter", fallback="").strip()
+        self.available = OUTPUT_SCHEMA in profiles and not self.repository_filter
+        self.response_tag = util.nspath_eval("csw:GetRecordByIdResponse", self.context.namespaces)
+        self.schema_location_attribute = util.nspath_eval("xsi:schemaLocation", self.context.namespaces)
+        self.schema_location = f"{self.context.namespaces['csw']} {self.config.get('server', 'ogc_schemas_base')}/csw/2.0.2/CSW-discovery.xsd"
+        self.encoding = csw.encoding
+        self.pretty_print = csw.pretty_print
+        self.mimetype = csw.mimetype.decode() if isinstance(csw.mimetype, bytes) else csw.mimetype
+        self.gzip_level = self.config.getint("server", "gzip_compresslevel", fallback=None)
+        settings = [
+            self.context.version, etree.__version__, self.response_tag, self.schema_location, self.encoding,
+            str(self.pretty_print), self.gzip_level, sorted(self.context.namespaces.items()), self.context.keep_ns_prefixes,
+        ]
+        self.format = hashlib.sha256(repr(settings).encode("utf-8")).hexdigest()[:32]
+
+    def build(self, xml) -> bytes:
+        """
+        Body of the GetRecordById response of a record.
+
+        Parameters
+        ----------
+        xml: str or bytes. ISO XML of the record, as stored in pycsw.
+
+        Returns
+        -------
+        bytes: Response body.
+        """
+        node = etree.Element(self.response_tag, nsmap=self.context.namespaces)
+        node.attrib[self.schema_location_attribute] = self.schema_location
+        node.append(etree.fromstring(xml, self.context.parser))
+        etree.cleanup_namespaces(node, keep_ns_prefixes=self.context.keep_ns_prefixes)
+        response = etree.tostring(node, pretty_print=self.pretty_print, encoding="unicode")
+        return (
+            f'<?xml version="1.0" encoding="{self.encoding}" standalone="no"?>\n'
+            f"<!-- pycsw {self.context.version} -->\n{response}"
+        ).encode(self.encoding)
+
+    def payload(self, identifier: str, xml, metadata_modified: str = None) -> dict:
+        """
+        Row of the payloads table of a record, see `RecordPayloads`.
+
+        Parameters
+        ----------
+        identifier: str. Identifier of the pycsw record.
+        xml: str or bytes. ISO XML of the record.
+        metadata_modified: str, optional. CKAN `metadata_modified` of the dataset (UTC), the Last-Modified of the response.
+
+        Returns
+        -------
+        dict: Payload row: identifier, output_schema, format, etag, last_modified, body and gzip_body.
+        """
+        body = self.build(xml)
+        last_modified = http_date(metadata_modified) if metadata_modified else None
+        # Changes with the record and with the settings of the payload
+        etag = hashlib.sha256(self.format.encode("utf-8") + body).hexdigest()[:32]
+        return {
+            "identifier": identifier,
+            "output_schema": OUTPUT_SCHEMA,
+            "format": self.format,
+            "etag": etag,
+            "last_modified": last_modified,
+            "body": body,
+            "gzip_body": gzip.compress(body, compresslevel=self.gzip_level, mtime=0) if self.gzip_level is not None else None,
+        }
+
+
+class PayloadServer:
+    def __init__(self, app, pycsw_config: str, metrics=None):
+        """
+        Constructor of the PayloadServer class.
+
+        WSGI middleware answering the GetRecordById KVP requests of one record in
+        `OUTPUT_SCHEMA` with the `full` element set (`FAST_PATH_PARAMETERS`) with the
+        payload stored by the harvest, see `RecordPayloads`, without querying the
+        records or parsing their XML. The responses have the ETag and Last-Modified
+        (CKAN `metadata_modified`) of the payload, and conditional requests
+        (If-None-Match, If-Modified-Since) are answered with 304 Not Modified. The gzip
+        body is sent to the clients that accept it if pycsw compresses its responses.
+
+        Other requests, and records without a payload of the current format (e.g. not
+        harvested again since the configuration changed), are passed to `app`.
+
+        The requests by result (hit, not_modified, miss) and the response durations
+        (`cache="payload"`) are recorded in `metrics`.
+
+        Attributes
+        ----------
+        app: callable. WSGI application, e.g. `pycsw.wsgi.application`.
+        pycsw_config: str. pycsw configuration file of the server, e.g. `PYCSW_CONFIG`.
+        metrics: model.metrics.HarvestMetrics, optional. Metrics of the fast path, default: `METRICS`.
+        """
+        self.app = app
+        self.metrics = metrics or METRICS
+        self.builder = PayloadBuilder(pycsw_config)
+        self.payloads = RecordPayloads(self.builder.config.get("repository", "database"), create=False)
+
+    def __call__(self, environ, start_response):
+        start = time.perf_counter()
+        identifier = fast_path_identifier(environ) if self.builder.available else None
+        if identifier is None:
+            return self.app(environ, start_response)
+
+        try:
+            payload = self.payloads.get(identifier, OUTPUT_SCHEMA, self.builder.format, compressed=accepts_gzip(environ) and self.builder.gzip_level is not None)
+        except SQLAlchemyError as e:
+            # e.g. no payloads table, if they are disabled
+            LOGGER.debug(f"{log_module}:PayloadServer | Payload of {identifier} not available: {e}")
+            payload = None
+        if payload is None:
+            self.metrics.inc("record_payload_requests_total", result="miss")
+            return self.app(environ, start_response)
+
+        etag, last_modified, body, compressed = payload
+        headers = [("ETag", etag)]
+        if last_modified:
+            headers.append(("Last-Modified", last_modified))
+        if self.builder.gzip_level is not None:
+            headers.append(("Vary", "Accept-Encoding"))
+        if not_modified(environ, etag, last_modified):
+            start_response("304 Not Modified", headers)
+            self.metrics.inc("record_payload_requests_total", result="not_modified")
+            self.metrics.observe_histogram("response_duration_seconds", time.perf_counter() - start, cache="payload")
+            return [b""]
+
+        headers += [("Content-Length", str(len(body))), ("Content-Type", self.builder.mimetype)]
+        if compressed:
+            headers.append(("Content-Encoding", "gzip"))
+        start_response("200 OK", headers)
+        self.metrics.inc("record_payload_requests_total", result="hit")
+        self.metrics.observe_histogram("response_duration_seconds", time.perf_counter() - start, cache="payload")
+        return [body]
+
+
+def fast_path_identifier(environ) -> str:
+    """
+    Record identifier of a request answered by `PayloadServer`, None for the other requests.
+    """
+    if environ.get("REQUEST_METHOD", "GET") != "GET":
+        return None
+    parameters = parse_qsl(environ.get("QUERY_STRING", ""), keep_blank_values=True)
+    kvp = {name.lower(): value for name, value in parameters}
+    if len(kvp) != len(parameters) or set(kvp) != set(FAST_PATH_PARAMETERS):
+        return None
+    if any(value is not None and kvp[name] != value for name, value in FAST_PATH_PARAMETERS.items()):
+        return None
+    # pycsw reads a comma-separated list of identifiers
+    if not kvp["id"] or "," in kvp["id"]:
+        return None
+    return kvp["id"]
+
+
+def accepts_gzip(environ) -> bool:
+    """
+    The client accepts gzip responses, as checked by `pycsw.wsgi.application`.
+    """
+    return "gzip" in environ.get("HTTP_ACCEPT_ENCODING", "")
+
+
+def not_modified(environ, etag: str, last_modified: str) -> bool:
+    """
+    The conditional headers of a request match the payload: If-None-Match, or If-Modified-Since if there is no If-None-Match.
+    """
+    if_none_match = environ.get("HTTP_IF_NONE_MATCH")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = environ.get("HTTP_IF_MODIFIED_SINCE")
+    if if_modified_since is None or not last_modified:
+        return False
+    try:
+        return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+
+
+def http_date(timestamp: str) -> str:
+    """
+    HTTP date of an ISO 8601 timestamp, e.g. a CKAN `metadata_modified` (UTC if it has no time zone), None if it is not valid.
+    """
+    try:
+        value = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc).replace(microsecond=0), usegmt=True)
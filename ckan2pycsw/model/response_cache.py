@@ -0,0 +1,357 @@
+# inbuilt libraries
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode
+
+# third-party libraries
+from lxml import etree
+
+# custom classes
+from model.metrics import CONTENT_TYPE, METRICS
+
+
+LOGGER = logging.getLogger(__name__)
+log_module = "[response_cache]"
+# Harvest generation shared by the harvest, which bumps it, and the pycsw servers
+GENERATION_FILE = os.environ.get("PYCSW_CACHE_GENERATION_FILE", f"{os.environ.get('APP_DIR', '/app')}/harvest_generation")
+# CSW operations that only read the catalogue, the responses of the others are never cached
+CACHED_OPERATIONS = {
+    "getcapabilities": "GetCapabilities",
+    "describerecord": "DescribeRecord",
+    "getdomain": "GetDomain",
+    "getrecords": "GetRecords",
+    "getrecordbyid": "GetRecordById",
+}
+# Request headers that change the response of pycsw.wsgi.application
+VARY = {"gzip": lambda environ: "gzip" in environ.get("HTTP_ACCEPT_ENCODING", "")}
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        app,
+        generation_file: str = GENERATION_FILE,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        cache_dir: str = None,
+        metrics_path: str = "/metrics",
+        metrics=None):
+        """
+        Constructor of the ResponseCache class.
+
+        WSGI middleware caching the responses of the pycsw application to the CSW
+        operations that only read the catalogue (`CACHED_OPERATIONS`). The catalogue
+        only changes when a harvest ends, so the responses are cached until the harvest
+        generation changes, see `bump_generation()`: no time to live is needed. Only
+        successful responses are cached, not the exception reports of pycsw (e.g. when
+        the repository is locked by a harvest), see `is_success()`.
+
+        A request is keyed by its generation, method, path, normalized KVP parameters
+        (names in lower case, sorted), the SHA-256 of its POST body and the headers of
+        `VARY`. Responses are kept in a memory LRU tier of the process and, if
+        `cache_dir` is set, in a disk tier shared by the server processes, in a folder
+        per generation that is removed when the generation changes.
+
+        The requests by operation and result (memory, disk, miss, bypass) and the response
+        durations by cache result (hit, miss, bypass) are recorded in `metrics` and served,
+        in the Prometheus text format, at `metrics_path`. Cached responses have the
+        `X-Cache: HIT` header, the others `X-Cache: MISS`.
+
+        Attributes
+        ----------
+        app: callable. WSGI application, e.g. `pycsw.wsgi.application`.
+        generation_file: str. File of the harvest generation, written by the harvest.
+        max_entries: int. Maximum responses in the memory tier.
+        max_bytes: int. Maximum bytes of the response bodies in the memory tier.
+        cache_dir: str, optional. Folder of the disk tier, no disk tier if None.
+        metrics_path: str. Path of the metrics, None to not serve them.
+        metrics: model.metrics.HarvestMetrics, optional. Metrics of the cache, default: `METRICS`.
+        """
+        self.app = app
+        self.generation_file = generation_file
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.metrics_path = metrics_path
+        self.metrics = metrics or METRICS
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.generation = None
+        # Not a stat of the generation file, which is read on the first request
+        self.generation_stat = False
+
+    def __call__(self, environ, start_response):
+        if self.metrics_path and environ.get("PATH_INFO") == self.metrics_path:
+            body = self.metrics.exposition().encode("utf-8")
+            start_response("200 OK", [("Content-Type", CONTENT_TYPE), ("Content-Length", str(len(body)))])
+            return [body]
+
+        start = time.perf_counter()
+        operation, key = self.request_key(environ)
+        if key is None:
+            self.metrics.inc("response_cache_requests_total", operation=operation or "other", result="bypass")
+            try:
+                return self.app(environ, start_response)
+            finally:
+                self.metrics.observe_histogram("response_duration_seconds", time.perf_counter() - start, cache="bypass")
+
+        entry, tier = self.get(key)
+        if entry is None:
+            tier = "miss"
+            entry = self.call_app(environ)
+            if is_success(entry):
+                self.put(key, entry)
+        status, headers, body = entry
+        start_response(status, headers + [("X-Cache", "MISS" if tier == "miss" else "HIT")])
+        self.metrics.inc("response_cache_requests_total", operation=operation, result=tier)
+        self.metrics.observe_histogram("response_duration_seconds", time.perf_counter() - start, cache="miss" if tier == "miss" else "hit")
+        return [body]
+
+    def call_app(self, environ) -> tuple:
+        """
+        Response of the application to a request.
+
+        Returns
+        -------
+        tuple: Status, headers (list of name, value pairs) and body.
+        """
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"], response["headers"] = status, list(headers)
+            return lambda data: None
+
+        result = self.app(environ, start_response)
+        try:
+            body = b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        return response["status"], response["headers"], body
+
+    def request_key(self, environ) -> tuple:
+        """
+        CSW operation and cache key of a request.
+
+        The body of a POST request is read and put back in `wsgi.input` for the application.
+
+        Returns
+        -------
+        tuple: Operation (None if unknown) and key (None if the response is not cached).
+        """
+        method = environ.get("REQUEST_METHOD", "GET")
+        parameters = sorted((name.lower(), value) for name, value in parse_qsl(environ.get("QUERY_STRING", ""), keep_blank_values=True))
+        digest = hashlib.sha256()
+        if method == "GET":
+            operation = CACHED_OPERATIONS.get(dict(parameters).get("request", "").lower())
+        elif method == "POST":
+            try:
+                length = int(environ.get("CONTENT_LENGTH") or 0)
+            except ValueError:
+                return None, None
+            body = environ["wsgi.input"].read(length) if length > 0 else b""
+            environ["wsgi.input"] = io.BytesIO(body)
+            operation = CACHED_OPERATIONS.get((root_element(body) or "").lower())
+            digest.update(body)
+        else:
+            return None, None
+        if operation is None:
+            return None, None
+
+        vary = "&".join(f"{name}={int(test(environ))}" for name, test in VARY.items())
+        request = "\n".join([self.current_generation(), method, environ.get("PATH_INFO", ""), urlencode(parameters), digest.hexdigest(), vary])
+        return operation, hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def current_generation(self) -> str:
+        """
+        Harvest generation, read again when its file changes; the cache is cleared when it changes.
+        """
+        try:
+            stat = os.stat(self.generation_file)
+            stat = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except OSError:
+            stat = None
+        if stat != self.generation_stat:
+            generation = read_generation(self.generation_file)
+            with self.lock:
+                self.generation_stat = stat
+                if generation != self.generation:
+                    LOGGER.info(f"{log_module}:ResponseCache | Harvest generation {generation}, cache cleared")
+                    self.generation = generation
+                    self.entries.clear()
+                    self.size = 0
+                    self.update_gauges()
+                    self.remove_old_generations()
+        return self.generation
+
+    def get(self, key: str) -> tuple:
+        """
+        Cached response of a key.
+
+        Returns
+        -------
+        tuple: Response (status, headers, body), None if not cached, and tier ("memory" or "disk").
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry, "memory"
+        if self.cache_dir is None:
+            return None, None
+        try:
+            with open(self.disk_path(key), "rb") as f:
+                header = json.loads(f.readline())
+                entry = (header["status"], [tuple(item) for item in header["headers"]], f.read())
+        except (OSError, ValueError, KeyError):
+            return None, None
+        self.put_memory(key, entry)
+        return entry, "disk"
+
+    def put(self, key: str, entry: tuple):
+        """
+        Cache a response in the memory tier and, if enabled, the disk tier.
+        """
+        self.put_memory(key, entry)
+        if self.cache_dir is None:
+            return
+        path = self.disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(json.dumps({"status": entry[0], "headers": entry[1]}).encode("utf-8") + b"\n")
+                f.write(entry[2])
+            os.replace(tmp_path, path)
+        except OSError as e:
+            LOGGER.warning(f"{log_module}:ResponseCache | Fail when writing the disk cache: {path} Error: {e}")
+
+    def put_memory(self, key: str, entry: tuple):
+        """
+        Cache a response in the memory tier, evicting the least recently used ones beyond its limits.
+        """
+        size = len(entry[2])
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[2])
+            self.entries[key] = entry
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted[2])
+            self.update_gauges()
+
+    def update_gauges(self):
+        self.metrics.set("response_cache_entries", len(self.entries))
+        self.metrics.set("response_cache_bytes", self.size)
+
+    def disk_path(self, key: str) -> str:
+        """
+        File of a response in the disk tier: <cache_dir>/<generation>/<key[:2]>/<key>.
+        """
+        return os.path.join(self.cache_dir, self.generation, key[:2], key)
+
+    def remove_old_generations(self):
+        """
+        Remove the disk tier folders of the other harvest generations.
+        """
+        if self.cache_dir is None or not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name != self.generation:
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+
+
+def is_success(entry: tuple) -> bool:
+    """
+    Check if a response can be cached: pycsw answers the failed requests, e.g. when the
+    repository is locked by a harvest, with an `ows:ExceptionReport` and `200 OK` too.
+
+    Parameters
+    ----------
+    entry: tuple. Response: status, headers (list of name, value pairs) and body.
+
+    Returns
+    -------
+    bool: True if the status is 200 and the body is not an exception report.
+    """
+    status, headers, body = entry
+    if not status.startswith("200"):
+        return False
+    headers = {name.lower(): value for name, value in headers}
+    if "gzip" in headers.get("content-encoding", ""):
+        try:
+            body = gzip.decompress(body)
+        except (OSError, EOFError):
+            return False
+    if "json" in headers.get("content-type", ""):
+        # outputFormat=application/json: {"ows:ExceptionReport": {...}}
+        try:
+            document = json.loads(body)
+        except ValueError:
+            return False
+        return not (isinstance(document, dict) and any(str(name).endswith("ExceptionReport") for name in document))
+    return root_element(body) not in (None, "ExceptionReport")
+
+
+def root_element(body: bytes) -> str:
+    """
+    Local name of the root element of an XML document, parsed only up to it, None if it is not XML.
+    """
+    parser = etree.XMLPullParser(events=("start",), resolve_entities=False, no_network=True)
+    try:
+        parser.feed(body)
+        for _, element in parser.read_events():
+            return etree.QName(element).localname
+    except etree.LxmlError:
+        return None
+    return None
+
+
+def read_generation(path: str) -> str:
+    """
+    Harvest generation of a generation file, "0" if it does not exist yet.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read().strip() or "0"
+    except OSError:
+        return "0"
+
+
+def bump_generation(path: str) -> str:
+    """
+    Increase the harvest generation, so the response caches of the pycsw servers are invalidated.
+
+    The file is written next to `path` and renamed, so the servers never read a partial file.
+
+    Parameters
+    ----------
+    path: str. File of the harvest generation.
+
+    Returns
+    -------
+    str: New generation.
+    """
+    try:
+        generation = str(int(read_generation(path)) + 1)
+    except ValueError:
+        generation = "1"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(generation)
+    os.replace(tmp_path, path)
+    return generation
@@ -0,0 +1,396 @@
+# inbuilt libraries
+import logging
+import os
+import re
+from functools import lru_cache
+
+# third-party libraries
+import pycsw
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DisconnectionError
+from sqlalchemy.pool import Pool
+
+
+LOGGER = logging.getLogger(__name__)
+log_module = "[sqlite_search]"
+RTREE_SUFFIX = "_rtree"
+FTS_SUFFIX = "_fts"
+# SQL function of the bounding box coordinates of a WKT geometry, used by the R*Tree triggers
+BBOX_FUNCTION = "ckan2pycsw_bbox"
+# Text columns of the FTS5 index, queried by pycsw with LIKE (csw:AnyText, dc:title, dct:abstract)
+FTS_COLUMNS = ["anytext", "title", "abstract"]
+# Spatial predicates of pycsw query_spatial() that are only true if the bounding boxes intersect
+BBOX_PREDICATES = {"bbox", "intersects", "within", "contains", "equals", "overlaps", "touches", "crosses"}
+# pycsw filters (pycsw.ogc.fes.fes1) as compiled for SQLite, see rewrite_query()
+SPATIAL_FILTER = re.compile(r"query_spatial\((\w+),'([^']*)','(\w+)','([^']*)'\) = 'true'")
+LIKE_FILTER = re.compile(r"\b({columns}) like \?".format(columns="|".join(FTS_COLUMNS)))
+# LIKE filter with a named parameter, e.g. `anytext like :pvalue0`
+NAMED_LIKE_FILTER = re.compile(r"\b({columns}) like :(\w+)".format(columns="|".join(FTS_COLUMNS)))
+# Named parameters of the FTS5 queries added to a query with named parameters
+FTS_PARAMETER = "ckan2pycsw_fts_{}"
+FROM_TABLE = re.compile(r'\bFROM\s+"?(\w+)"?\s+WHERE\b')
+# Literal parts of a LIKE pattern, the FTS5 trigram tokenizer only matches those of 3 characters or more
+LIKE_LITERAL = re.compile(r"[^%_]{3,}")
+# pycsw versions whose SQL is rewritten, the filters are matched as pycsw 2.6.1 compiles them
+PYCSW_VERSIONS = {"2.6.1"}
+# Tables with search indexes, by database file (path and inode: a full rebuild swaps in a new file) and table
+_INDEXED_TABLES = set()
+
+
+class SearchIndexes:
+    def __init__(self, database: str, table: str = "records"):
+        """
+        Constructor of the SearchIndexes class.
+
+        Search indexes of a SQLite pycsw repository, which otherwise evaluates every
+        spatial filter (`query_spatial()`) and `LIKE` filter on each record:
+
+        * `<table>_rtree`: R*Tree of the bounding boxes of the records (`wkt_geometry`).
+        * `<table>_fts`: FTS5 index, with the trigram tokenizer, of `FTS_COLUMNS`. It is
+          an external content table: the text is only stored in the records table.
+
+        The indexes are filled at once by `build()`, at the end of a harvest, and then kept
+        up to date by triggers on the records table. The R*Tree triggers call the
+        `BBOX_FUNCTION` SQL function: it must be registered, see `register_functions()`,
+        on every connection that writes records. The pycsw queries use the indexes once
+        `enable_query_rewrite()` is called, see `rewrite_query()`.
+
+        Attributes
+        ----------
+        database: str. SQLAlchemy URL of the SQLite pycsw repository.
+        table: str. Table of the pycsw records.
+        """
+        register_functions()
+        self.engine = create_engine(database)
+        self.table = table
+        self.rtree = f"{table}{RTREE_SUFFIX}"
+        self.fts = f"{table}{FTS_SUFFIX}"
+
+    def exists(self) -> bool:
+        """
+        Check if the search indexes of the records table exist.
+        """
+        with self.engine.connect() as conn:
+            names = {name for name, in conn.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE name IN (?, ?)", (self.rtree, self.fts)
+            )}
+        return names == {self.rtree, self.fts}
+
+    def build(self):
+        """
+        Create the search indexes from the current records, and the triggers that keep them up to date.
+        """
+        LOGGER.info(f"{log_module}:SearchIndexes | Building the R*Tree and FTS5 indexes of {self.table}")
+        columns = ", ".join(FTS_COLUMNS)
+        new_columns = ", ".join(f"new.{column}" for column in FTS_COLUMNS)
+        old_columns = ", ".join(f"old.{column}" for column in FTS_COLUMNS)
+
+        def bbox(row: str) -> str:
+            return ", ".join(f"{BBOX_FUNCTION}({row}wkt_geometry, {i})" for i in range(4))
+
+        insert_rtree = f'INSERT INTO "{self.rtree}" SELECT new.rowid, {bbox("new.")} WHERE {BBOX_FUNCTION}(new.wkt_geometry, 0) IS NOT NULL;'
+        delete_rtree = f'DELETE FROM "{self.rtree}" WHERE id = old.rowid;'
+        insert_fts = f'INSERT INTO "{self.fts}" (rowid, {columns}) VALUES (new.rowid, {new_columns});'
+        delete_fts = f'INSERT INTO "{self.fts}" ("{self.fts}", rowid, {columns}) VALUES (\'delete\', old.rowid, {old_columns});'
+        self.drop()
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(f'CREATE VIRTUAL TABLE "{self.rtree}" USING rtree(id, minx, maxx, miny, maxy)')
+            conn.exec_driver_sql(
+                f'INSERT INTO "{self.rtree}" SELECT rowid, {bbox("")} FROM "{self.table}" '
+                f"WHERE {BBOX_FUNCTION}(wkt_geometry, 0) IS NOT NULL"
+            )
+            conn.exec_driver_sql(
+                f'CREATE VIRTUAL TABLE "{self.fts}" USING fts5({columns}, '
+                f"content='{self.table}', content_rowid='rowid', tokenize='trigram')"
+            )
+            conn.exec_driver_sql(f'INSERT INTO "{self.fts}" ("{self.fts}") VALUES (\'rebuild\')')
+            conn.exec_driver_sql(f'CREATE TRIGGER "{self.table}_search_insert" AFTER INSERT ON "{self.table}" BEGIN {insert_rtree} {insert_fts} END')
+            conn.exec_driver_sql(f'CREATE TRIGGER "{self.table}_search_delete" AFTER DELETE ON "{self.table}" BEGIN {delete_rtree} {delete_fts} END')
+            conn.exec_driver_sql(f'CREATE TRIGGER "{self.table}_search_update" AFTER UPDATE ON "{self.table}" BEGIN {delete_rtree} {delete_fts} {insert_rtree} {insert_fts} END')
+            conn.exec_driver_sql(f'ANALYZE "{self.table}"')
+        LOGGER.info(f"{log_module}:SearchIndexes | Search indexes built: {self.rtree}, {self.fts}")
+
+    def drop(self):
+        """
+        Drop the search indexes and their triggers.
+        """
+        with self.engine.begin() as conn:
+            for trigger in ("insert", "delete", "update"):
+                conn.exec_driver_sql(f'DROP TRIGGER IF EXISTS "{self.table}_search_{trigger}"')
+            conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{self.rtree}"')
+            conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{self.fts}"')
+
+
+@lru_cache(maxsize=1024)
+def geometry_bounds(wkt: str) -> tuple:
+    """
+    Bounding box (minx, miny, maxx, maxy) of a WKT geometry, None if it is empty or not valid WKT.
+    """
+    from shapely import wkt as shapely_wkt
+
+    try:
+        bounds = shapely_wkt.loads(wkt).bounds
+    except Exception:
+        return None
+    return bounds if len(bounds) == 4 and all(coordinate == coordinate for coordinate in bounds) else None
+
+
+def bbox_coordinate(wkt: str, index: int) -> float:
+    """
+    `BBOX_FUNCTION` SQL function: coordinate of the bounding box of a WKT geometry, in the
+    order of the R*Tree columns (0: minx, 1: maxx, 2: miny, 3: maxy), NULL if it has none.
+    """
+    bounds = geometry_bounds(wkt) if wkt else None
+    if bounds is None:
+        return None
+    minx, miny, maxx, maxy = bounds
+    return (minx, maxx, miny, maxy)[index]
+
+
+def _connect(dbapi_connection, connection_record):
+    if type(dbapi_connection).__module__.startswith("sqlite3"):
+        dbapi_connection.create_function(BBOX_FUNCTION, 2, bbox_coordinate, deterministic=True)
+
+
+def register_functions():
+    """
+    Register `BBOX_FUNCTION` on every SQLite connection of SQLAlchemy, as pycsw does with its own SQL functions.
+    """
+    if not event.contains(Pool, "connect", _connect):
+        event.listen(Pool, "connect", _connect)
+
+
+def _connect_file(dbapi_connection, connection_record):
+    if type(dbapi_connection).__module__.startswith("sqlite3"):
+        path = dbapi_connection.execute("PRAGMA database_list").fetchone()[2]
+        if path:
+            connection_record.info["ckan2pycsw_file"] = (path, os.stat(path).st_ino)
+
+
+def _checkout_file(dbapi_connection, connection_record, connection_proxy):
+    file = connection_record.info.get("ckan2pycsw_file")
+    if file is None:
+        return
+    path, inode = file
+    try:
+        replaced = os.stat(path).st_ino != inode
+    except OSError:
+        replaced = True
+    if replaced:
+        raise DisconnectionError(f"SQLite database replaced: {path}")
+
+
+def reopen_replaced_databases():
+    """
+    Reopen the pooled SQLite connections whose database file was replaced, e.g. by the full rebuild of a harvest.
+
+    pycsw memoizes its engines by URL (`Repository._engines`): with a pool that keeps the
+    connections open (SQLAlchemy 2.x `QueuePool` for SQLite files), the pycsw server would
+    keep reading the replaced file. A connection is checked out only if its file was not
+    replaced, otherwise the pool opens a new one.
+    """
+    if not event.contains(Pool, "connect", _connect_file):
+        event.listen(Pool, "connect", _connect_file)
+    if not event.contains(Pool, "checkout", _checkout_file):
+        event.listen(Pool, "checkout", _checkout_file)
+
+
+def enable_query_rewrite() -> bool:
+    """
+    Rewrite the queries of pycsw on SQLite repositories to use their search indexes, see `rewrite_query()`.
+
+    The filters are matched in the SQL of the pycsw versions of `PYCSW_VERSIONS`, with other
+    versions the queries are not rewritten.
+
+    Returns
+    -------
+    bool: True if the queries are rewritten.
+    """
+    if pycsw.__version__ not in PYCSW_VERSIONS:
+        LOGGER.warning(f"{log_module}:enable_query_rewrite | pycsw {pycsw.__version__} not supported ({', '.join(sorted(PYCSW_VERSIONS))}), the search indexes are not used by the pycsw queries")
+        return False
+    register_functions()
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute, retval=True)
+    return True
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if executemany or conn.dialect.name != "sqlite":
+        return statement, parameters
+    return rewrite_query(conn, statement, parameters)
+
+
+def rewrite_query(conn, statement: str, parameters):
+    """
+    Rewrite the filters of a pycsw query to select the candidate records with the search indexes.
+
+    The filters are kept and only evaluated on the candidates, so the results are the same:
+    `query_spatial(..., '<predicate>', ...) = 'true'` is narrowed down to the records whose
+    bounding box intersects the one of the query geometry (`<table>_rtree`), for the predicates
+    of `BBOX_PREDICATES`, and `<column> like ?` to the records that match the pattern in
+    `<table>_fts`, see `like_fts_query()`. Queries on a table without search indexes are not rewritten.
+
+    Parameters
+    ----------
+    conn: sqlalchemy.engine.Connection. Connection of the query.
+    statement: str. SQL statement, with `?` or named (`:name`) parameters.
+    parameters: tuple, list or dict. Values of the parameters.
+
+    Returns
+    -------
+    tuple: The statement and its parameters, of the same type.
+    """
+    if "query_spatial(" not in statement and " like " not in statement:
+        return statement, parameters
+    table = FROM_TABLE.search(statement)
+    if table is None:
+        return statement, parameters
+    table = table.group(1)
+    if not has_search_indexes(conn, table):
+        return statement, parameters
+
+    if isinstance(parameters, dict):
+        return rewrite_named_query(table, statement, parameters)
+
+    parameters_type = type(parameters)
+    parameters = list(parameters)
+    matches = sorted(list(SPATIAL_FILTER.finditer(statement)) + list(LIKE_FILTER.finditer(statement)), key=lambda match: match.start())
+    parts, values, position, placeholder = [], [], 0, 0
+    for match in matches:
+        before = statement[position:match.start()]
+        placeholders = count_placeholders(before)
+        values.extend(parameters[placeholder:placeholder + placeholders])
+        placeholder += placeholders
+        parts.append(before)
+        if match.re is SPATIAL_FILTER:
+            parts.append(spatial_candidates(table, match) or match.group(0))
+        else:
+            pattern = parameters[placeholder]
+            fts_query = like_fts_query(pattern)
+            if fts_query:
+                parts.append(fts_candidates(table, match, "?"))
+                values.append(fts_query)
+            else:
+                parts.append(match.group(0))
+            values.append(pattern)
+            placeholder += 1
+        position = match.end()
+    parts.append(statement[position:])
+    values.extend(parameters[placeholder:])
+    return "".join(parts), parameters_type(values)
+
+
+def rewrite_named_query(table: str, statement: str, parameters: dict) -> tuple:
+    """
+    Rewrite the filters of a pycsw query with named parameters, see `rewrite_query()`.
+
+    The FTS5 queries are added as new parameters, `FTS_PARAMETER`.
+
+    Returns
+    -------
+    tuple: The statement and its parameters, of the same type.
+    """
+    values = dict(parameters)
+    matches = sorted(list(SPATIAL_FILTER.finditer(statement)) + list(NAMED_LIKE_FILTER.finditer(statement)), key=lambda match: match.start())
+    parts, position = [], 0
+    for match in matches:
+        parts.append(statement[position:match.start()])
+        position = match.end()
+        if match.re is SPATIAL_FILTER:
+            parts.append(spatial_candidates(table, match) or match.group(0))
+            continue
+        fts_query = like_fts_query(parameters.get(match.group(2)))
+        if not fts_query:
+            parts.append(match.group(0))
+            continue
+        name = FTS_PARAMETER.format(len(values) - len(parameters))
+        values[name] = fts_query
+        parts.append(fts_candidates(table, match, f":{name}"))
+    parts.append(statement[position:])
+    return "".join(parts), type(parameters)(values)
+
+
+def fts_candidates(table: str, match, placeholder: str) -> str:
+    """
+    LIKE filter of `LIKE_FILTER` or `NAMED_LIKE_FILTER` restricted to the records matching an FTS5 query, the parameter `placeholder`.
+    """
+    return f'("{table}".rowid IN (SELECT rowid FROM "{table}{FTS_SUFFIX}" WHERE {match.group(1)} MATCH {placeholder}) AND {match.group(0)})'
+
+
+def like_fts_query(pattern) -> str:
+    """
+    FTS5 query of the records that may match a LIKE pattern, None if it cannot narrow them down.
+
+    Each literal part of the pattern (between `%` and `_` wildcards) of 3 characters or more
+    is a phrase: with the trigram tokenizer, the records that contain it as a substring,
+    ignoring case like LIKE. Unlike a LIKE query on the FTS5 table, the phrases are only
+    looked up in the index, without reading the text of each candidate.
+    """
+    if not isinstance(pattern, str):
+        return None
+    phrases = ['"{}"'.format(literal.replace('"', '""')) for literal in LIKE_LITERAL.findall(pattern)]
+    return " AND ".join(phrases) or None
+
+
+def spatial_candidates(table: str, match) -> str:
+    """
+    Spatial filter of `SPATIAL_FILTER` restricted to the R*Tree candidates, None if it cannot be.
+    """
+    column, wkt, predicate, _ = match.groups()
+    if column != "wkt_geometry" or predicate not in BBOX_PREDICATES:
+        return None
+    bounds = geometry_bounds(wkt)
+    if bounds is None:
+        return None
+    minx, miny, maxx, maxy = bounds
+    return (
+        f'("{table}".rowid IN (SELECT id FROM "{table}{RTREE_SUFFIX}" '
+        f"WHERE minx <= {maxx!r} AND maxx >= {minx!r} AND miny <= {maxy!r} AND maxy >= {miny!r}) "
+        f"AND {match.group(0)})"
+    )
+
+
+def count_placeholders(sql: str) -> int:
+    """
+    Number of `?` parameters in a piece of SQL, outside of quoted strings and identifiers.
+    """
+    count, quote = 0, None
+    for char in sql:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == "?":
+            count += 1
+    return count
+
+
+def has_search_indexes(conn, table: str) -> bool:
+    """
+    Check if a table has search indexes.
+
+    The tables found with search indexes are cached by database file, not by connection:
+    pycsw opens a connection per request (`NullPool`). A table without them is checked
+    again by the next query, its indexes are built at the end of the next harvest. The
+    server processes must be restarted if the indexes are dropped from the live database
+    (`PYCSW_SQLITE_SEARCH_INDEXES` disabled in the harvest only).
+    """
+    database = conn.engine.url.database
+    try:
+        key = (os.path.abspath(database), os.stat(database).st_ino, table)
+    except (TypeError, OSError):
+        # In-memory database
+        key = None
+    if key in _INDEXED_TABLES:
+        return True
+    names = {name for name, in conn.connection.execute(
+        "SELECT name FROM sqlite_master WHERE name IN (?, ?)", (f"{table}{RTREE_SUFFIX}", f"{table}{FTS_SUFFIX}")
+    )}
+    if len(names) < 2:
+        return False
+    if key is not None:
+        _INDEXED_TABLES.add(key)
+    return True
@@ -0,0 +1,306 @@
+# inbuilt libraries
+import hashlib
+import json
+import logging
+import pathlib
+
+# third-party libraries
+from sqlalchemy import Column, MetaData, String, Table, Text, create_engine, inspect, select
+
+
+LOGGER = logging.getLogger(__name__)
+log_module = "[sync_state]"
+WATERMARK_KEY = "metadata_modified"
+TEMPLATES_VERSION_KEY = "templates_version"
+# Keep IN (...) clauses under the SQLite host parameter limit
+CHUNK_SIZE = 500
+
+
+class SyncState:
+    def __init__(self, database: str, table_prefix: str = "ckan2pycsw", table_suffix: str = ""):
+        """
+        Constructor of the SyncState class.
+
+        Keeps the harvest state next to the pycsw records: the last successful CKAN
+        `metadata_modified` watermark, the CKAN package id of every stored record and
+        the CKAN packages that could not be harvested. The state is updated after each
+        batch of records, see `save_checkpoint()`, so an interrupted harvest resumes
+        from its last checkpoint.
+
+        Attributes
+        ----------
+        database: str. SQLAlchemy URL of the pycsw repository.
+        table_prefix: str. Prefix of the sync-state tables.
+        table_suffix: str. Suffix of the sync-state tables, e.g. of the staging tables of a PostgreSQL full rebuild.
+        """
+        self.engine = create_engine(database)
+        self.metadata = MetaData()
+        self.state_table = Table(
+            f"{table_prefix}_sync_state{table_suffix}",
+            self.metadata,
+            Column("key", String(64), primary_key=True),
+            Column("value", String(256)),
+        )
+        self.records_table = Table(
+            f"{table_prefix}_sync_records{table_suffix}",
+            self.metadata,
+            Column("ckan_id", String(256), primary_key=True),
+            Column("identifier", String(256), nullable=False),
+            Column("content_hash", String(64)),
+        )
+        self.failed_table = Table(
+            f"{table_prefix}_sync_failed{table_suffix}",
+            self.metadata,
+            Column("ckan_id", String(256), primary_key=True),
+            Column("name", String(256)),
+            Column("error", Text),
+        )
+        self.metadata.create_all(self.engine)
+        self.upgrade()
+
+    def upgrade(self):
+        """
+        Add the columns missing in sync-state tables created by previous versions.
+        """
+        columns = [column["name"] for column in inspect(self.engine).get_columns(self.records_table.name)]
+        if "content_hash" not in columns:
+            LOGGER.info(f"{log_module}:SyncState | Adding column content_hash to {self.records_table.name}")
+            with self.engine.begin() as conn:
+                conn.exec_driver_sql(f"ALTER TABLE {self.records_table.name} ADD COLUMN content_hash VARCHAR(64)")
+
+    def has_table(self, table_name: str) -> bool:
+        """
+        Check if a table exists in the repository database.
+
+        Parameters
+        ----------
+        table_name: str. Name of the table.
+
+        Returns
+        -------
+        bool: True if the table exists.
+        """
+        return inspect(self.engine).has_table(table_name)
+
+    def get_value(self, key: str):
+        """
+        Get a value from the sync-state table.
+
+        Parameters
+        ----------
+        key: str. Key of the stored value.
+
+        Returns
+        -------
+        str or None: The stored value, None if not found.
+        """
+        with self.engine.connect() as conn:
+            return conn.execute(
+                select(self.state_table.c.value).where(self.state_table.c.key == key)
+            ).scalar()
+
+    def set_value(self, key: str, value: str):
+        """
+        Insert or update a value of the sync-state table.
+
+        Parameters
+        ----------
+        key: str. Key of the stored value.
+        value: str. Value to store.
+        """
+        with self.engine.begin() as conn:
+            conn.execute(self.state_table.delete().where(self.state_table.c.key == key))
+            conn.execute(self.state_table.insert().values(key=key, value=value))
+
+    def get_watermark(self):
+        """
+        Get the `metadata_modified` of the last successful harvest.
+
+        Returns
+        -------
+        str or None: ISO 8601 timestamp, None if there is no previous harvest.
+        """
+        return self.get_value(WATERMARK_KEY)
+
+    def set_watermark(self, watermark: str):
+        """
+        Store the `metadata_modified` of the last successful harvest.
+
+        Parameters
+        ----------
+        watermark: str. ISO 8601 timestamp (CKAN `metadata_modified`).
+        """
+        LOGGER.info(f"{log_module}:SyncState | Watermark: {watermark}")
+        self.set_value(WATERMARK_KEY, watermark)
+
+    def get_identifiers(self) -> dict:
+        """
+        Get the pycsw record identifier of every harvested CKAN package.
+
+        Returns
+        -------
+        dict: CKAN package id to pycsw record identifier.
+        """
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(self.records_table.c.ckan_id, self.records_table.c.identifier))
+            return {ckan_id: identifier for ckan_id, identifier in rows}
+
+    def get_hashes(self) -> dict:
+        """
+        Get the content hash of every harvested CKAN package, see `content_hash()`.
+
+        Returns
+        -------
+        dict: CKAN package id to content hash.
+        """
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(self.records_table.c.ckan_id, self.records_table.c.content_hash))
+            return {ckan_id: content_hash for ckan_id, content_hash in rows}
+
+    def get_templates_version(self):
+        """
+        Get the version of the templates and mappings used by the last harvest, see `files_version()`.
+
+        Returns
+        -------
+        str or None: Version digest, None if there is no previous harvest.
+        """
+        return self.get_value(TEMPLATES_VERSION_KEY)
+
+    def set_templates_version(self, version: str):
+        """
+        Store the version of the templates and mappings used by the harvest.
+
+        Parameters
+        ----------
+        version: str. Version digest, see `files_version()`.
+        """
+        self.set_value(TEMPLATES_VERSION_KEY, version)
+
+    def get_failed(self) -> dict:
+        """
+        Get the CKAN packages that could not be harvested, see `save_checkpoint()`.
+
+        Returns
+        -------
+        dict: CKAN package id to package name.
+        """
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(self.failed_table.c.ckan_id, self.failed_table.c.name))
+            return {ckan_id: name for ckan_id, name in rows}
+
+    def save_identifiers(self, identifiers: dict, hashes: dict = None):
+        """
+        Insert or update the pycsw record identifiers of the harvested CKAN packages.
+
+        Parameters
+        ----------
+        identifiers: dict. CKAN package id to pycsw record identifier.
+        hashes: dict, optional. CKAN package id to content hash.
+        """
+        self.save_checkpoint(identifiers, hashes)
+
+    def save_checkpoint(self, identifiers: dict, hashes: dict = None, failed: dict = None, watermark: str = None, templates_version: str = None):
+        """
+        Store the progress of a harvest in one transaction: the records written, the
+        packages that failed and, optionally, the watermark to resume from.
+
+        A package written is removed from the failed packages, and a failed package
+        keeps its previous record and content hash, so it is harvested again.
+
+        Parameters
+        ----------
+        identifiers: dict. CKAN package id to pycsw record identifier of the records written.
+        hashes: dict, optional. CKAN package id to content hash.
+        failed: dict, optional. CKAN package id to (name, error) of the packages that failed.
+        watermark: str, optional. `metadata_modified` up to which every package was harvested.
+        templates_version: str, optional. Version of the templates and mappings of the harvest, see `files_version()`.
+        """
+        hashes = hashes or {}
+        failed = failed or {}
+        with self.engine.begin() as conn:
+            delete_ids(conn, self.records_table, list(identifiers))
+            delete_ids(conn, self.failed_table, list(identifiers) + list(failed))
+            if identifiers:
+                conn.execute(
+                    self.records_table.insert(),
+                    [{"ckan_id": ckan_id, "identifier": identifier, "content_hash": hashes.get(ckan_id)} for ckan_id, identifier in identifiers.items()]
+                )
+            if failed:
+                conn.execute(
+                    self.failed_table.insert(),
+                    [{"ckan_id": ckan_id, "name": name, "error": error} for ckan_id, (name, error) in failed.items()]
+                )
+            for key, value in ((WATERMARK_KEY, watermark), (TEMPLATES_VERSION_KEY, templates_version)):
+                if value is not None:
+                    conn.execute(self.state_table.delete().where(self.state_table.c.key == key))
+                    conn.execute(self.state_table.insert().values(key=key, value=value))
+        if watermark is not None:
+            LOGGER.debug(f"{log_module}:SyncState | Checkpoint: {watermark}")
+
+    def remove_identifiers(self, ckan_ids):
+        """
+        Remove CKAN packages from the sync-state.
+
+        Parameters
+        ----------
+        ckan_ids: iterable. CKAN package ids.
+        """
+        ckan_ids = list(ckan_ids)
+        if not ckan_ids:
+            return
+        with self.engine.begin() as conn:
+            delete_ids(conn, self.records_table, ckan_ids)
+            delete_ids(conn, self.failed_table, ckan_ids)
+
+
+def delete_ids(conn, table: Table, ckan_ids: list):
+    """
+    Delete the rows of CKAN packages from a sync-state table.
+
+    Parameters
+    ----------
+    conn: sqlalchemy.engine.Connection. Connection of the transaction.
+    table: sqlalchemy.Table. Sync-state table with a `ckan_id` column.
+    ckan_ids: list. CKAN package ids.
+    """
+    for i in range(0, len(ckan_ids), CHUNK_SIZE):
+        conn.execute(table.delete().where(table.c.ckan_id.in_(ckan_ids[i:i + CHUNK_SIZE])))
+
+
+def files_version(*folders) -> str:
+    """
+    Digest of the content of all the files in the folders, e.g. the templates and mappings of a harvest.
+
+    Parameters
+    ----------
+    folders: str or pathlib.Path. Folders to digest recursively.
+
+    Returns
+    -------
+    str: SHA-256 hex digest.
+    """
+    digest = hashlib.sha256()
+    for folder in folders:
+        folder = pathlib.Path(folder)
+        for path in sorted(p for p in folder.rglob("*") if p.is_file() and "__pycache__" not in p.parts):
+            digest.update(str(path.relative_to(folder)).encode("utf-8"))
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def content_hash(dataset: dict, version: str) -> str:
+    """
+    Hash of a CKAN package: its canonical JSON plus the version of the templates and mappings.
+
+    Parameters
+    ----------
+    dataset: dict. Dataset data from CKAN API.
+    version: str. Version of the templates and mappings, see `files_version()`.
+
+    Returns
+    -------
+    str: SHA-256 hex digest.
+    """
+    canonical = json.dumps(dataset, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(f"{version}\n{canonical}".encode("utf-8")).hexdigest()
@@ -1,22 +1,27 @@
 # inbuilt libraries
 from datetime import date, datetime
+import importlib.metadata
 import yaml
 import os
 import pathlib
 import logging
 import simplejson as json
+from simplejson.encoder import encode_basestring_ascii
 import six
 
 # third-party libraries
 from shapely.geometry import shape
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, ModuleLoader, Template, nodes
 from jinja2.exceptions import TemplateNotFound
+from lxml import etree
+from markupsafe import escape
+
+# custom classes
+from model.codelists import CODELISTS
 
 # pygeometa deps
-from xml.dom import minidom
 from typing import Union
 import re
-import pkg_resources
 
 
 log_module = "[template]"
@@ -25,8 +30,29 @@ LOGGER = logging.getLogger(__name__)
 SCHEMAS_CKAN = pathlib.Path(__file__).resolve().parent.parent / 'schemas/ckan'
 SCHEMAS_PYGEOMETA = pathlib.Path(__file__).resolve().parent.parent / 'schemas/pygeometa'
 MAPPINGS = pathlib.Path(__file__).resolve().parent.parent / 'mappings'
-VERSION = pkg_resources.require('pygeometa')[0].version
+VERSION = importlib.metadata.version('pygeometa')
 DEFAULT_LABEL_LANG = 'en'
+# Optional folder of precompiled templates, see compile_j2_templates()
+J2_COMPILED_DIR = os.environ.get("PYCSW_J2_COMPILED_DIR")
+# Compiled templates per (schema_type, template_dir, mappings_folder), see get_j2_template()
+_J2_TEMPLATES = {}
+# Field choices indexes per loaded CKAN schema, see get_ckan_schema_index()
+_CKAN_SCHEMA_INDEXES = {}
+# CKAN templates that build the MCF dict in their `mcf` variable, per template_dir, see is_mcf_template()
+_MCF_TEMPLATES = {}
+# CKAN dataset preprocessors per (template_dir, mappings_folder), see get_record_preprocessor()
+_RECORD_PREPROCESSORS = {}
+# CKAN scheming validators and presets of the fields stored as JSON lists or objects, see ckan_schema_json_fields()
+JSON_FIELD_VALIDATORS = ('scheming_multiple_text', 'scheming_multiple_choice', 'scheming_valid_json_object')
+JSON_FIELD_PRESETS = ('multiple_text', 'multiple_checkbox', 'multiple_select', 'json_object')
+# CKAN dataset fields read by the template helpers that take the whole record, see get_ckan_template_fields()
+RECORD_HELPER_FIELDS = {
+    'get_languages_from_dataset': ['title_translated'],
+}
+# Indent the generated ISO XML, False: compact XML, less work and smaller records
+XML_PRETTY_PRINT = str(os.environ.get("PYCSW_XML_PRETTY_PRINT", True)).lower() == "true"
+# Blank text is dropped on parsing, so indentation is only added by etree.indent()
+XML_PARSER = etree.XMLParser(remove_blank_text=True, resolve_entities=False)
 
 # Custom exceptions.
 class MappingValueNotFoundError(Exception):
@@ -43,6 +69,11 @@ def render_j2_template(mcf: dict, schema_type: str, url: str = None, template_di
     Convenience function to render Jinja2 template given
     an mcf file, string, or dict
 
+    The template environment of each (schema_type, template_dir, mappings_folder)
+    is created once and cached, see `get_j2_template()`. CKAN templates that set an
+    `mcf` variable build the MCF dict straight away, see `render_mcf()`; the others
+    are rendered to JSON, see `render_json_mcf()`.
+
     Attributes
     ----------
     mcf: dict. Dictionary of MCF data.
@@ -55,6 +86,257 @@ def render_j2_template(mcf: dict, schema_type: str, url: str = None, template_di
     ----------
     MCF dictionary rendered with JINJA template.
     """
+    if schema_type == 'ckan':
+        template = get_j2_template(schema_type, template_dir, mappings_folder)
+        preprocessor = get_record_preprocessor(template_dir, mappings_folder)
+        if is_mcf_template(template_dir):
+            LOGGER.debug('Processing CKAN template to MCF')
+            return render_mcf(template, mcf, url, preprocessor)
+
+        LOGGER.debug('Processing CKAN template to JSON')
+        return render_json_mcf(template, mcf, url, preprocessor)
+
+    if schema_type == 'pygeometa':
+        return serialize_xml(render_xml_tree(mcf, template_dir, mappings_folder))
+
+def render_xml_tree(mcf: dict, template_dir: str, mappings_folder: str = 'ckan2pycsw/mappings', pretty_print: bool = None) -> etree._Element:
+    """
+    Render a pygeometa template into an lxml tree, parsed only once.
+
+    The tree can be passed to `pycsw.core.metadata.parse_record()` as is, or
+    serialized with `serialize_xml()`.
+
+    Attributes
+    ----------
+    mcf: dict. Dictionary of MCF data.
+    template_dir: str. Directory of schema template.
+    mappings_folder: str. Folder where the mappings are stored.
+    pretty_print: bool, optional. Indent the tree, default: `PYCSW_XML_PRETTY_PRINT`.
+
+    Return
+    ----------
+    lxml.etree._Element: Root element of the ISO XML document.
+    """
+    LOGGER.debug('Processing Pygeometa template to XML')
+    template = get_j2_template('pygeometa', template_dir, mappings_folder)
+    root = etree.fromstring(template.render(record=mcf).encode('utf-8'), XML_PARSER)
+    if XML_PRETTY_PRINT if pretty_print is None else pretty_print:
+        etree.indent(root, space=' '*2)
+    return root
+
+def serialize_xml(root: etree._Element) -> str:
+    """
+    Serialize an lxml tree, with the indentation it already has.
+
+    Attributes
+    ----------
+    root: lxml.etree._Element. Root element of the XML document.
+
+    Return
+    ----------
+    str: XML document.
+    """
+    return etree.tostring(root, encoding='unicode')
+
+def get_j2_template(schema_type: str, template_dir: str = 'iso19139_base', mappings_folder: str = 'ckan2pycsw/mappings') -> Template:
+    """
+    Get the compiled `main.j2` template of a schema.
+
+    Environments and templates are cached per (schema_type, template_dir, mappings_folder)
+    for the whole process. Call `clear_j2_templates()` when the template files change.
+
+    Attributes
+    ----------
+    schema_type: str. Type of schema to render, 'ckan' or 'pygeometa'.
+    template_dir: str. Directory of schema template.
+    mappings_folder: str. Folder where the mappings are stored.
+
+    Return
+    ----------
+    jinja2.Template: Compiled main template.
+    """
+    key = (schema_type, template_dir, mappings_folder)
+    template = _J2_TEMPLATES.get(key)
+    if template is None:
+        env = create_j2_environment(schema_type, template_dir, mappings_folder)
+        try:
+            LOGGER.debug('Loading template')
+            template = env.get_template('main.j2')
+        except TemplateNotFound:
+            msg = 'Missing metadata template'
+            LOGGER.error(msg)
+            raise RuntimeError(msg)
+        _J2_TEMPLATES[key] = template
+    return template
+
+def clear_j2_templates():
+    """
+    Invalidate the cached template environments and codelists, e.g. when the template or mapping files change.
+    """
+    LOGGER.debug('Clearing template cache')
+    _J2_TEMPLATES.clear()
+    _CKAN_SCHEMA_INDEXES.clear()
+    _MCF_TEMPLATES.clear()
+    _RECORD_PREPROCESSORS.clear()
+    CODELISTS.clear()
+
+def render_json_mcf(template: Template, mcf: dict, url: str = None, preprocessor=None) -> dict:
+    """
+    Render a CKAN `main.j2` template to JSON and deserialize it into the MCF dictionary.
+
+    Attributes
+    ----------
+    template: jinja2.Template. CKAN schema template, see `get_j2_template()`.
+    mcf: dict. Dataset data from CKAN API, not modified.
+    url: str. URL of the CKAN endpoint retrieved from envvars.
+    preprocessor: RecordPreprocessor, optional. Preprocessor of the dataset, see `get_record_preprocessor()`,
+        default: every field, JSON detected from the values.
+
+    Return
+    ----------
+    dict: MCF dictionary.
+    """
+    output = template.render(record=(preprocessor or RecordPreprocessor()).preprocess(mcf, escape=True), url=url)
+    try:
+        # Correct and deserialize the JSON string
+        return json.loads(re.sub(r'\\(?!["\\/bfnrtu])', r'\\\\', output), strict=False)
+    except json.JSONDecodeError as e:
+        LOGGER.error("Error deserializing the template output: %s", e)
+        LOGGER.error("Problematic output: %s", output)
+        raise
+
+def render_mcf(template: Template, mcf: dict, url: str = None, preprocessor=None) -> dict:
+    """
+    Build the MCF dictionary of a CKAN dataset with a `main.j2` template that sets it in its
+    `mcf` variable, see `is_mcf_template()`: the template is run as a module and its `mcf`
+    variable is returned, no JSON text is rendered and deserialized.
+
+    Attributes
+    ----------
+    template: jinja2.Template. CKAN schema template, see `get_j2_template()`.
+    mcf: dict. Dataset data from CKAN API, not modified.
+    url: str. URL of the CKAN endpoint retrieved from envvars.
+    preprocessor: RecordPreprocessor, optional. Preprocessor of the dataset, see `get_record_preprocessor()`,
+        default: every field, JSON detected from the values.
+
+    Return
+    ----------
+    dict: MCF dictionary.
+    """
+    module = template.make_module({'record': (preprocessor or RecordPreprocessor()).preprocess(mcf), 'url': url})
+    return module.mcf
+
+def is_mcf_template(template_dir: str) -> bool:
+    """
+    Whether the `main.j2` of a CKAN schema builds the MCF dict: it sets an `mcf` variable at
+    its top level, e.g. `{% set mcf = {"mcf": {"version": 1.0}, ...} %}`. Cached per template_dir.
+    """
+    if template_dir not in _MCF_TEMPLATES:
+        path = SCHEMAS_CKAN / os.path.basename(template_dir) / 'main.j2'
+        try:
+            body = Environment().parse(path.read_text(encoding='utf-8')).body
+        except OSError:
+            body = []
+        _MCF_TEMPLATES[template_dir] = any(
+            isinstance(node, nodes.Assign) and isinstance(node.target, nodes.Name) and node.target.name == 'mcf'
+            for node in body
+        )
+    return _MCF_TEMPLATES[template_dir]
+
+def load_ckan_schema(template_dir: str, mappings_folder: str = 'ckan2pycsw/mappings'):
+    """
+    Load the CKAN schema YAML (`ckan_schema.yaml`) assigned to a template directory.
+
+    Attributes
+    ----------
+    template_dir: str. Directory of schema template.
+    mappings_folder: str. Folder where the mappings are stored.
+
+    Return
+    ----------
+    dict or None: The CKAN schema, None for "iso19139_base".
+    """
+    if template_dir == "iso19139_base":
+        return None
+    LOGGER.debug(f'Adding CKAN Schema mapping:{template_dir}')
+    ckan_schema_path = get_mapping_value(value=template_dir, codelist="ckan-pycsw_assigments",mappings_folder=mappings_folder)
+    schema_file = MAPPINGS / f"{ckan_schema_path}" / "ckan_schema.yaml"
+    with open(schema_file, "r", encoding='utf-8') as f:
+        ckan_schema = yaml.safe_load(f)
+    get_ckan_schema_index(ckan_schema)
+    return ckan_schema
+
+def get_ckan_template_fields(template_dir: str) -> list:
+    """
+    CKAN dataset fields read by the `main.j2` template of a CKAN schema.
+
+    The templates are parsed, not rendered: `record['field']`, `record.field`, `'field' in record`
+    and `record.get('field')` are fields read, the record passed to a helper of `RECORD_HELPER_FIELDS`
+    is allowed.
+
+    Attributes
+    ----------
+    template_dir: str. Directory of schema template.
+
+    Return
+    ----------
+    list or None: Sorted field names, None if the record is read in any other way (e.g. `record[key]`
+    with a variable key), so the fields cannot be known.
+    """
+    fields = set()
+    try:
+        path = SCHEMAS_CKAN / template_dir / 'main.j2'
+        if path.exists():
+            fields.update(j2_record_fields(path.read_text(encoding='utf-8')))
+    except ValueError as e:
+        LOGGER.warning(f'{log_module}:get_ckan_template_fields | Fields of {template_dir} not known: {e}')
+        return None
+    return sorted(fields)
+
+def j2_record_fields(source: str) -> set:
+    """
+    Fields of `record` read by a Jinja template, see `get_ckan_template_fields()`.
+
+    Raises
+    ----------
+    ValueError: If the record is read in any other way.
+    """
+    fields = set()
+
+    def visit(node, parent, grandparent):
+        if isinstance(node, nodes.Name) and node.name == 'record':
+            if isinstance(parent, nodes.Getitem) and isinstance(parent.arg, nodes.Const) and isinstance(parent.arg.value, str):
+                fields.add(parent.arg.value)
+            elif isinstance(parent, nodes.Getattr) and parent.attr not in dir(dict):
+                fields.add(parent.attr)
+            elif isinstance(parent, nodes.Filter) and parent.name in RECORD_HELPER_FIELDS:
+                fields.update(RECORD_HELPER_FIELDS[parent.name])
+            elif isinstance(parent, nodes.Operand) and parent.op in ('in', 'notin') and isinstance(grandparent.expr, nodes.Const):
+                fields.add(grandparent.expr.value)
+            else:
+                raise ValueError(f'record read by {type(parent).__name__} at line {node.lineno}')
+        for child in node.iter_child_nodes():
+            visit(child, node, parent)
+
+    visit(Environment().parse(source), None, None)
+    return fields
+
+def create_j2_environment(schema_type: str, template_dir: str = 'iso19139_base', mappings_folder: str = 'ckan2pycsw/mappings', loader=None) -> Environment:
+    """
+    Create the Jinja2 environment of a schema with its filters and globals.
+
+    Attributes
+    ----------
+    schema_type: str. Type of schema to render, 'ckan' or 'pygeometa'.
+    template_dir: str. Directory of schema template.
+    mappings_folder: str. Folder where the mappings are stored.
+    loader: jinja2.BaseLoader, optional. Template loader, default: precompiled
+        templates in `J2_COMPILED_DIR` if available, else the template files.
+
+    Return
+    ----------
+    jinja2.Environment: Template environment.
+    """
     FILTERS = {
         'get_mapping_value_from_yaml_list':get_mapping_value_from_yaml_list,
         'get_mapping_values_dict_from_yaml_list':get_mapping_values_dict_from_yaml_list,
@@ -76,6 +358,8 @@ def render_j2_template(mcf: dict, schema_type: str, url: str = None, template_di
         'get_languages_from_dataset': get_languages_from_dataset,
         'get_language_alternate': get_language_alternate,
         'get_localized_dataset_value': get_localized_dataset_value,
+        'text': text,
+        'raw_text': raw_text,
     }
 
     LOGGER.debug('Evaluating template directory')
@@ -84,54 +368,40 @@ def render_j2_template(mcf: dict, schema_type: str, url: str = None, template_di
         LOGGER.warn(msg)
         raise RuntimeError(msg)
 
+    if schema_type == 'ckan':
+        template_path = os.path.join(SCHEMAS_CKAN, template_dir)
+    elif schema_type == 'pygeometa':
+        template_path = os.path.join(SCHEMAS_PYGEOMETA, template_dir)
+    else:
+        raise RuntimeError(f'Unknown schema type: {schema_type}')
+
+    if loader is None:
+        compiled_path = os.path.join(J2_COMPILED_DIR, schema_type, os.path.basename(template_dir)) if J2_COMPILED_DIR else None
+        if compiled_path and os.path.isdir(compiled_path):
+            LOGGER.debug(f'Using precompiled templates: {compiled_path}')
+            loader = ModuleLoader(compiled_path)
+        else:
+            loader = FileSystemLoader(template_path)
 
+    # Template files are not checked for changes, see clear_j2_templates()
+    LOGGER.debug(f'Setting up template environment {template_dir} of type {schema_type}')
     if schema_type == 'ckan':
-        LOGGER.debug(f'Setting up template environment {template_dir} of type {schema_type}')
-        env = Environment(loader=FileSystemLoader(os.path.join(SCHEMAS_CKAN, template_dir)), autoescape=True)
+        env = Environment(loader=loader, autoescape=True, auto_reload=False)
 
         if template_dir != "iso19139_base":
-            LOGGER.debug(f'Adding CKAN Schema mapping:{template_dir}')
-            ckan_schema_path = get_mapping_value(value=template_dir, codelist="ckan-pycsw_assigments",mappings_folder=mappings_folder)
-            schema_file = MAPPINGS / f"{ckan_schema_path}" / "ckan_schema.yaml"
-            with open(schema_file, "r", encoding='utf-8') as f:
-                ckan_schema = yaml.safe_load(f)
-            env.globals.update(ckan_schema=ckan_schema)
+            env.globals.update(ckan_schema=load_ckan_schema(template_dir, mappings_folder))
 
         LOGGER.debug('Adding template filters')
         env.filters.update(FILTERS)
 
         LOGGER.debug('Adding globals')
-        env.globals.update(url=url)
         env.globals.update(mappings_folder=mappings_folder)
         env.globals.update(zip=zip)
         env.globals.update(default_label_lang=DEFAULT_LABEL_LANG)
         env.globals.update(FILTERS)
 
-        try:
-            LOGGER.debug('Loading template')
-            template = env.get_template('main.j2')
-        except TemplateNotFound:
-            msg = 'Missing metadata template'
-            LOGGER.error(msg)
-            raise RuntimeError(msg)
-
-        LOGGER.debug('Processing CKAN template to JSON')
-        mcf = update_object_lists(mcf)
-
-        try:
-            # Render the template and directly attempt to correct and deserialize the JSON string
-            mcf_dict = json.loads(re.sub(r'\\(?!["\\/bfnrtu])', r'\\\\', template.render(record=mcf)), strict=False)
-        except json.JSONDecodeError as e:
-            LOGGER.error("Error deserializing the template output: %s", e)
-            # Optionally: Save the problematic output for debugging
-            LOGGER.error("Problematic output: %s", template.render(record=mcf))
-            raise
-
-        return mcf_dict
-
-    if schema_type == 'pygeometa':
-        LOGGER.debug(f'Setting up template environment {template_dir} of type {schema_type}')
-        env = Environment(loader=FileSystemLoader(os.path.join(SCHEMAS_PYGEOMETA, template_dir)))
+    else:
+        env = Environment(loader=loader, auto_reload=False)
     
         LOGGER.debug('Adding template filters')
         env.globals.update(default_label_lang=DEFAULT_LABEL_LANG)
@@ -150,19 +420,33 @@ def render_j2_template(mcf: dict, schema_type: str, url: str = None, template_di
         env.globals.update(prune_transfer_option=prune_transfer_option)
         env.globals.update(get_mapping_value_from_yaml_list=get_mapping_value_from_yaml_list)
 
-        try:
-            LOGGER.debug('Loading template')
-            template = env.get_template('main.j2')
-        except TemplateNotFound:
-            msg = 'Missing metadata template'
-            LOGGER.error(msg)
-            raise RuntimeError(msg)
+    return env
 
-        LOGGER.debug('Processing Pygeometa template to XML')
-        xml = template.render(record=mcf).encode('utf-8')
-        #TODO: Delete Dumps to log
-        #print(pretty_print(xml),  file=open(APP_DIR + '/log/demo_pygeometa.xml', 'w'))
-        return pretty_print(xml, mcf['metadata']['charset'])
+def compile_j2_templates(schema_type: str, template_dir: str, target: str = None) -> str:
+    """
+    Precompile the templates of a schema to Python modules, so worker processes
+    do not need to parse and compile them on start-up.
+
+    Attributes
+    ----------
+    schema_type: str. Type of schema, 'ckan' or 'pygeometa'.
+    template_dir: str. Directory of schema template.
+    target: str, optional. Root folder of the compiled templates, default: `J2_COMPILED_DIR`.
+
+    Return
+    ----------
+    str: Folder of the compiled templates.
+    """
+    target = target or J2_COMPILED_DIR
+    if not target:
+        raise RuntimeError('A target folder or PYCSW_J2_COMPILED_DIR is required')
+    template_path = SCHEMAS_CKAN if schema_type == 'ckan' else SCHEMAS_PYGEOMETA
+    env = create_j2_environment(schema_type, template_dir, loader=FileSystemLoader(os.path.join(template_path, template_dir)))
+    compiled_path = os.path.join(target, schema_type, os.path.basename(template_dir))
+    os.makedirs(compiled_path, exist_ok=True)
+    LOGGER.info(f'{log_module}:compile_j2_templates | {schema_type}/{template_dir} -> {compiled_path}')
+    env.compile_templates(compiled_path, zip=None, ignore_errors=False)
+    return compiled_path
 
 #--Template functions--#
 def get_raw_value_from_ckan_schema(value: str, schema, field_name: str, fields_type: str = "dataset"):
@@ -181,16 +465,53 @@ def get_raw_value_from_ckan_schema(value: str, schema, field_name: str, fields_t
     ----------
     The mapped value in the codelist if found, else the source value itself.
     """
-    field_choices = {}
-    field_type = f'{fields_type}_fields'
-    field_choices = {field["field_name"]: field["choices"] for field in schema[field_type] if "field_name" in field and field.get("choices")}
-
-    for choice in field_choices.get(field_name, []):
-        if "value" in choice and choice["value"] == value:
-            value = choice["value"].rsplit('/', 1)[-1]
+    value = get_ckan_schema_index(schema)["raw"].get((fields_type, field_name, value), value)
 
     return value.lower()
 
+def get_ckan_schema_index(schema) -> dict:
+    """
+    Get the field choices index of a CKAN schema, built only once per loaded schema.
+
+    Parameters
+    ----------
+    schema : dict. The CKAN schema as a dictionary.
+
+    Return
+    ----------
+    dict: See `build_ckan_schema_index()`.
+    """
+    entry = _CKAN_SCHEMA_INDEXES.get(id(schema))
+    # Keep a reference to the schema, so its id is not reused by another object
+    if entry is None or entry[0] is not schema:
+        entry = _CKAN_SCHEMA_INDEXES[id(schema)] = (schema, build_ckan_schema_index(schema))
+    return entry[1]
+
+def build_ckan_schema_index(schema) -> dict:
+    """
+    Index the field choices of a CKAN schema by (fields_type, field_name, value).
+
+    Parameters
+    ----------
+    schema : dict. The CKAN schema as a dictionary.
+
+    Return
+    ----------
+    dict: {"raw": {key: raw value}, "uri": {key: URI}}, where raw value is the last part of the choice URI.
+    """
+    index = {"raw": {}, "uri": {}}
+    for fields_type in ("dataset", "resource"):
+        # As with a dict by field_name, the last field with the same name wins
+        fields = {field["field_name"]: field.get("choices") or [] for field in schema.get(f"{fields_type}_fields") or [] if "field_name" in field}
+        for field_name, choices in fields.items():
+            for choice in choices:
+                value = choice.get("value")
+                if not isinstance(value, str):
+                    continue
+                index["raw"].setdefault((fields_type, field_name, value), value.rsplit('/', 1)[-1])
+                index["uri"].setdefault((fields_type, field_name, value), value)
+    return index
+
 def get_uri_value_from_ckan_schema(value: str, schema, field_name: str, fields_type: str = "dataset"):
     """
     Maps a CKAN schema field value to a codelist URI.
@@ -206,13 +527,7 @@ def get_uri_value_from_ckan_schema(value: str, schema, field_name: str, fields_t
     ----------
     The URI corresponding to the input value in the codelist, or the original value if it is not in the codelist.
     """
-    field_choices_dict = {}
-    field_choices_dict = {field["field_name"]: field.get("choices", []) for field in schema.get(f"{fields_type}_fields", [])}
-
-    choices = field_choices_dict.get(field_name, [])
-    value = next((choice["value"] for choice in choices if "value" in choice and choice["value"] == value), value)
-
-    return value
+    return get_ckan_schema_index(schema)["uri"].get((fields_type, field_name, value), value)
 
 def get_mapping_value(
     value: str,
@@ -221,7 +536,7 @@ def get_mapping_value(
     """
     Returns the mapping value in YAML for a given codelist value. 
 
-    This function loads a YAML file from the specified mappings folder and returns the value
+    This function gets a YAML file from the specified mappings folder (loaded once by the codelist registry) and returns the value
     for the specified codelist value. If the value is not found in the YAML file, the category itself is returned.
     
     Parameters
@@ -239,12 +554,10 @@ def get_mapping_value(
     MappingValueNotFoundError: ValueError. If the given value is not found in the mapping.
     """
     try:
-        map_yaml = yaml.safe_load(open(os.path.join(mappings_folder, codelist + ".yaml"), encoding="utf-8"))
+        return CODELISTS.get(value, codelist, mappings_folder)
     except ValueError:
         raise MappingValueNotFoundError(value, codelist) from None
 
-    return map_yaml.get(value, value)
-
 #TODO:--Template: CKAN data--#
 
 # Having a string, it searches a list if it exists, and returns the value
@@ -275,20 +588,14 @@ def get_mapping_value_from_yaml_list(
     MappingValueNotFoundError: If the codelist YAML file cannot be loaded.
     """
     try:
-        map_yaml = yaml.safe_load(open(os.path.join(mappings_folder, codelist + ".yaml"), encoding="utf-8"))
+        item = CODELISTS.find(value, input_field, codelist, mappings_folder)
     except ValueError:
         raise MappingValueNotFoundError(value, codelist) from None
     
-    output_value = value
-    for item in map_yaml:
-        if value in item[input_field]:
-            if item[output_field] is not None:
-                output_value = item[output_field]
-            else:
-                output_value = value
-            break
+    if item is None or item[output_field] is None:
+        return value
         
-    return output_value
+    return item[output_field]
 
 def get_mapping_values_dict_from_yaml_list(
     value: str,
@@ -316,20 +623,15 @@ def get_mapping_values_dict_from_yaml_list(
     MappingValueNotFoundError: If the codelist YAML file cannot be loaded.
     """
     try:
-        map_yaml = yaml.safe_load(open(os.path.join(mappings_folder, codelist + ".yaml"), encoding="utf-8"))
+        item = CODELISTS.find(value, input_field, codelist, mappings_folder)
     except ValueError:
         raise MappingValueNotFoundError(value, codelist) from None
     
-    output_value = value
-    for item in map_yaml:
-        if value in item[input_field]:
-            if item[output_field] is not None:
-                output_value = item
-            else:
-                output_value = value
-            break
+    if item is None or item[output_field] is None:
+        return value
         
-    return output_value
+    # Copy, the cached codelist item must not be modified by the templates
+    return dict(item)
 
 def scheming_clean_json_list(value):
     """
@@ -410,28 +712,146 @@ def scheming_get_object_list(ckan_field, data):
     json_data = scheming_clean_json_list(data[ckan_field])
     return json_data
 
-def process_string(s):
-    if s.startswith('["') or s.endswith('"]') or s.startswith('{"') or s.endswith('"}'):
+def looks_like_json(s: str) -> bool:
+    """
+    Whether a string of a field not described by the CKAN schema may be a JSON list or object.
+    """
+    return s.startswith('["') or s.endswith('"]') or s.startswith('{"') or s.endswith('"}')
+
+def escape_json_text(s: str) -> str:
+    """
+    Text of a string as written into the JSON output of `main.j2`: escaped as a JSON string
+    (non-ASCII characters as `\\uXXXX`), without the enclosing quotes, and with double quotes
+    replaced by single quotes. Printable ASCII text without quotes or backslashes is returned as is.
+    """
+    if s.isascii() and s.isprintable() and '"' not in s and '\\' not in s:
+        return s
+    return encode_basestring_ascii(s.replace('"', "'"))[1:-1]
+
+def ckan_schema_json_fields(schema) -> set:
+    """
+    Dataset fields of a CKAN schema stored as JSON lists or objects (multiple text, multiple choice and JSON object fields).
+
+    Parameters
+    ----------
+    schema : dict. The CKAN schema as a dictionary.
+
+    Return
+    ----------
+    set: Field names.
+    """
+    fields = set()
+    for field in schema.get("dataset_fields") or []:
+        validators = str(field.get("validators", "")).split()
+        if field.get("preset") in JSON_FIELD_PRESETS or any(validator in JSON_FIELD_VALIDATORS for validator in validators):
+            fields.add(field.get("field_name"))
+    return fields
+
+def get_record_preprocessor(template_dir: str, mappings_folder: str = 'ckan2pycsw/mappings'):
+    """
+    Get the preprocessor of the CKAN datasets rendered by a CKAN schema template, created once and cached like the templates.
+
+    Attributes
+    ----------
+    template_dir: str. Directory of schema template.
+    mappings_folder: str. Folder where the mappings are stored.
+
+    Return
+    ----------
+    RecordPreprocessor: Preprocessor of the fields read by the template, see `get_ckan_template_fields()`,
+    with the JSON fields of its CKAN schema, see `load_ckan_schema()`.
+    """
+    key = (template_dir, mappings_folder)
+    if key not in _RECORD_PREPROCESSORS:
         try:
-            return json.loads(s, strict=False)
-        except:
-            pass
-    return json.dumps(s)[1:-1].replace('\\"', "'").replace('"', "'")
+            schema = load_ckan_schema(template_dir, mappings_folder)
+        except (MappingValueNotFoundError, OSError) as e:
+            LOGGER.warning(f'{log_module}:get_record_preprocessor | No CKAN schema for {template_dir}, JSON fields are detected from their values: {e}')
+            schema = None
+        _RECORD_PREPROCESSORS[key] = RecordPreprocessor(
+            fields=get_ckan_template_fields(os.path.basename(template_dir)),
+            json_fields=ckan_schema_json_fields(schema) if schema else set(),
+            schema_fields={field.get("field_name") for field in schema.get("dataset_fields") or []} if schema else None,
+            )
+    return _RECORD_PREPROCESSORS[key]
+
+class RecordPreprocessor:
+    def __init__(self, fields: list = None, json_fields: set = None, schema_fields: set = None):
+        """
+        Constructor of the RecordPreprocessor class.
+
+        Values of a CKAN dataset as read by the CKAN templates, in a new dict: the dataset
+        is not modified. Strings of the JSON fields of the CKAN schema are parsed, other
+        strings are text; strings of fields not described by the schema are parsed if they
+        look like a JSON list or object. Only the fields read by the template are processed,
+        the others are passed as they are.
+
+        Attributes
+        ----------
+        fields: list. Fields read by the template, see `get_ckan_template_fields()`, None: all the fields.
+        json_fields: set. Fields stored as JSON lists or objects, see `ckan_schema_json_fields()`.
+        schema_fields: set. Dataset fields of the CKAN schema, None without a schema: every string is checked for JSON.
+        """
+        self.fields = fields
+        self.json_fields = json_fields or set()
+        self.schema_fields = schema_fields
+
+    def preprocess(self, data: dict, escape: bool = False) -> dict:
+        """
+        Preprocess a CKAN dataset in one pass over the fields read by the template.
+
+        Parameters
+        ----------
+        data: dict. Dataset data from CKAN API, not modified.
+        escape: bool. Escape the text for the JSON output of `main.j2`, see `escape_json_text()`,
+            False: only double quotes are replaced by single quotes (templates that set the MCF dict, see `render_mcf()`).
+
+        Return
+        ----------
+        dict: Dataset with the processed values.
+        """
+        record = dict(data)
+        keys = data.keys() if self.fields is None else [key for key in self.fields if key in data]
+        for key in keys:
+            value = data[key]
+            if isinstance(value, str):
+                record[key] = self.process_string(key, value, escape)
+            elif isinstance(value, list):
+                record[key] = [self.process_string(key, item, escape, item=True) if isinstance(item, str) else item for item in value]
+            elif isinstance(value, dict) and 'resources' in value:
+                record[key] = {**value, 'resources': [
+                    {k: self.process_string(k, v, escape) if isinstance(v, str) else v for k, v in resource.items()}
+                    for resource in value['resources']
+                ]}
+        return record
+
+    def process_string(self, key: str, s: str, escape: bool = False, item: bool = False):
+        """
+        Value of a string of the field `key`: the parsed JSON list or object of a JSON field, otherwise the text.
+
+        Items of a list of a JSON field (already decoded by CKAN) are text.
+        """
+        if (key in self.json_fields and not item) or ((self.schema_fields is None or key not in self.schema_fields) and looks_like_json(s)):
+            try:
+                value = json.loads(s, strict=False)
+            except ValueError:
+                pass
+            else:
+                if isinstance(value, (list, dict)) or key not in self.json_fields:
+                    return value
+        return escape_json_text(s) if escape else s.replace('"', "'")
 
-def update_object_lists(data):
-    for key in data:
-        if isinstance(data[key], str):
-            data[key] = process_string(data[key])
-        elif isinstance(data[key], list):
-            for i in range(len(data[key])):
-                if isinstance(data[key][i], str):
-                    data[key][i] = process_string(data[key][i])
-        elif isinstance(data[key], dict) and 'resources' in data[key]:
-            for resource in data[key]['resources']:
-                for k in resource:
-                    if isinstance(resource[k], str):
-                        resource[k] = process_string(resource[k])
-    return data
+def text(value) -> str:
+    """
+    String of a value as rendered by `{{ value }}` in an autoescaped template, e.g. `record['title']|text`.
+    """
+    return str(escape(value))
+
+def raw_text(value) -> str:
+    """
+    String of a value as rendered by `{{ value|safe }}`, e.g. `record['notes']|raw_text`.
+    """
+    return str(value)
 
 def update_large_text_lists(data):
     for key in data:
@@ -630,31 +1050,21 @@ def prune_transfer_option(formats: dict) -> list:
             unique_transfer.append(v)
     return unique_transfer
 
-def pretty_print_encoding(xml: str, encoding: str = 'UTF-8') -> str:
-    """
-    clean up indentation and spacing
-
-    :param xml: str of XML data
-
-    :returns: str of pretty-printed XML data
-    """
-
-    LOGGER.debug('pretty-printing XML')
-    val = minidom.parseString(xml)
-    return '\n'.join([val for val in val.toprettyxml(indent=' '*2, encoding=encoding).decode(encoding).split('\n') if val.strip()])
-
-def pretty_print(xml: str, encoding: str = 'UTF-8') -> str:
+def pretty_print(xml: bytes, encoding: str = 'UTF-8') -> str:
     """
     clean up indentation and spacing
 
-    :param xml: str of XML data
+    :param xml: bytes of XML data
+    :param encoding: encoding of the XML data, if not declared in the document
 
     :returns: str of pretty-printed XML data
     """
 
     LOGGER.debug('pretty-printing XML')
-    val = minidom.parseString(xml.decode(encoding))
-    return '\n'.join([val for val in val.toprettyxml(indent=' '*2).split('\n') if val.strip()])  # noqa
+    parser = etree.XMLParser(remove_blank_text=True, resolve_entities=False, encoding=encoding)
+    root = etree.fromstring(xml, parser)
+    etree.indent(root, space=' '*2)
+    return serialize_xml(root)
 
 def escape_json(value):
     """
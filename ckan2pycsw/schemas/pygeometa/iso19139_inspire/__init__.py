@@ -14,7 +14,7 @@ from owslib.iso import CI_OnlineResource, CI_ResponsibleParty, MD_Metadata
 from pygeometa.schemas.base import BaseOutputSchema
 
 # custom functions
-from model.template import render_j2_template
+from model.template import render_j2_template, render_xml_tree
 
 
 LOGGER = logging.getLogger(__name__)
@@ -33,15 +33,15 @@ class ISO19139_inspireOutputSchema(BaseOutputSchema):
 
         super().__init__('iso19139_inspire', 'xml', THISDIR)
 
-    def write(self, mcf: dict, stringify: str = True, mappings_folder: str = 'ckan2pycsw/mappings/iso19139_inspire') -> Union[dict, str]:
+    def write(self, mcf: dict, stringify: str = True, mappings_folder: str = 'ckan2pycsw/mappings/iso19139_inspire') -> Union[etree._Element, str]:
         """
         Write outputschema to string buffer
 
         :param mcf: dict of MCF content model
         :param stringify: whether to return a string representation (default)
-                          else native (dict, etree)
+                          else native (etree)
 
-        :returns: `dict` or `str` of metadata in outputschema representation
+        :returns: `etree.Element` or `str` of metadata in outputschema representation
         """
 
         LOGGER.debug('Writing INSPIRE ISO19139 metadata')
@@ -49,7 +49,7 @@ class ISO19139_inspireOutputSchema(BaseOutputSchema):
         if stringify:
             return render_j2_template(mcf=mcf, schema_type="pygeometa", template_dir=self.template_dir, mappings_folder=mappings_folder)
 
-        return mcf
+        return render_xml_tree(mcf=mcf, template_dir=self.template_dir, mappings_folder=mappings_folder)
 
     def import_(self, metadata: str) -> dict:
         """
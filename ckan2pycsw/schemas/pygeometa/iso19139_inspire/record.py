@@ -0,0 +1,279 @@
+# =================================================================
+# pycsw record columns of the MCF written by main.j2, as parsed by
+# pycsw.core.metadata.parse_record() (OWSLib MD_Metadata). Any change
+# of main.j2 must be made here too, checked by
+# tests/test_record_builder.py (benchmarks/record_diff.py at scale).
+# =================================================================
+# inbuilt libraries
+import re
+
+# third-party libraries
+from geolinks import sniff_link
+from jinja2 import Environment, Undefined
+from lxml import etree
+from pycsw.core import util
+
+# custom functions
+from model.template import get_charstring, normalize_datestring
+
+
+# Item lookup of the templates, record['metadata']["key"] missing is Undefined
+getitem = Environment().getitem
+
+GMD = "http://www.isotc211.org/2005/gmd"
+# Only written by the template when the resource is a service
+SERVICE_TYPE = "other"
+SERVICE_LINK = "None,None,OGC:WMS-http-get-capabilities,http://my-service-endpoint"
+# Line breaks as normalized by the XML parser
+LINE_BREAKS = re.compile(r"\r\n?")
+ATTRIBUTE_WHITESPACE = re.compile(r"[\t\n\r]")
+
+
+class UnsupportedRecord(ValueError):
+    """
+    The MCF has values the XML parser would not read back as written, the
+    record must be built with parse_record().
+    """
+
+
+def record_values(context, mcf: dict, xml: etree._Element) -> dict:
+    """
+    Column values of the pycsw record of an MCF, without parsing its ISO XML.
+
+    The values are the same as those of `pycsw.core.metadata.parse_record()`
+    for the XML written by main.j2: `xml` is only serialized for the `xml`
+    column and scanned for the `anytext` column.
+
+    Parameters
+    ----------
+    context: pycsw.core.config.StaticContext. The pycsw context.
+    mcf: dict. MCF of the record, as read by pygeometa.core.read_mcf().
+    xml: lxml.etree._Element. ISO XML written by ISO19139_inspireOutputSchema from `mcf`.
+
+    Returns
+    -------
+    dict: Column values of the pycsw record.
+
+    Raises
+    ------
+    UnsupportedRecord: If a value written without escaping has XML markup or is blank.
+    """
+    if xml.tag != f"{{{GMD}}}MD_Metadata":
+        raise UnsupportedRecord(f"Unexpected root element: {xml.tag}")
+
+    mappings = context.md_core_model["mappings"]
+    values = {}
+
+    def set_value(name, value):
+        values[mappings[name]] = value
+
+    metadata = getitem(mcf, "metadata")
+    identification = getitem(mcf, "identification")
+    contact = getitem(mcf, "contact")
+    language = getitem(metadata, "language")
+    language_alternate = getitem(metadata, "language_alternate")
+    resource_type = getitem(getitem(metadata, "hierarchylevel"), "value")
+    service = resource_type == "service"
+
+    def freetext(value):
+        return charstring_text(get_charstring(value, language, language_alternate)[0])
+
+    set_value("pycsw:Identifier", raw_text(getitem(metadata, "identifier")))
+    set_value("pycsw:Typename", "gmd:MD_Metadata")
+    set_value("pycsw:Schema", context.namespaces["gmd"])
+    set_value("pycsw:MdSource", "local")
+    set_value("pycsw:InsertDate", util.get_today_and_now())
+    set_value("pycsw:XML", etree.tostring(xml))
+    set_value("pycsw:AnyText", util.get_anytext(xml))
+    # gmd:language is a gmd:LanguageCode, read as gco:CharacterString
+    set_value("pycsw:Language", None)
+    set_value("pycsw:Type", attribute_text(resource_type))
+    parent_identifier = getitem(metadata, "parentidentifier")
+    set_value("pycsw:ParentIdentifier", raw_text(parent_identifier) if parent_identifier else None)
+    datestamp = raw_text(normalize_datestring(getitem(metadata, "datestamp")))
+    set_value("pycsw:Date", datestamp)
+    set_value("pycsw:Modified", datestamp)
+    # No gmd:dataSetURI
+    set_value("pycsw:Source", None)
+    # gmx:Anchor "EPSG:<code>", never an integer
+    set_value("pycsw:CRS", raw_text("EPSG:" + render(getitem(getitem(getitem(mcf, "spatial"), "crs"), "value"))))
+
+    set_value("pycsw:Title", freetext(identification.get("title")))
+    set_value("pycsw:AlternateTitle", None)
+    set_value("pycsw:Abstract", freetext(identification.get("abstract")))
+    set_value("pycsw:Relation", None)
+
+    time_begin = time_end = None
+    temporal_extents = list(getitem(getitem(identification, "extents"), "temporal"))
+    if temporal_extents:
+        temporal = temporal_extents[0]
+        time_begin = raw_text(getitem(temporal, "begin"))
+        end = getitem(temporal, "end")
+        time_end = None if end == "now" else raw_text(end)
+    set_value("pycsw:TempExtent_begin", time_begin)
+    set_value("pycsw:TempExtent_end", time_end)
+
+    if not service:
+        topics = [topic for topic in (raw_text(tc) for tc in getitem(identification, "topiccategory")) if topic is not None]
+        if topics:
+            set_value("pycsw:TopicCategory", topics[0])
+
+    # Keywords are gmx:Anchor, only gco:CharacterString keywords are read
+    if len(getitem(identification, "keywords")) > 0:
+        set_value("pycsw:Keywords", "")
+        set_value("pycsw:KeywordType", None)
+
+    point_of_contact = "pointOfContact" in contact
+    if point_of_contact:
+        organization = freetext(getitem(contact, "pointOfContact").get("organization"))
+        set_value("pycsw:OrganizationName", organization if organization is not None else "")
+
+    set_value("pycsw:AccessConstraints", "otherRestrictions")
+
+    for date_type, date in getitem(identification, "dates").items():
+        date_type = attribute_text(date_type)
+        if date_type == "revision":
+            set_value("pycsw:RevisionDate", raw_text(normalize_datestring(date)))
+        elif date_type == "creation":
+            set_value("pycsw:CreationDate", raw_text(normalize_datestring(date)))
+        elif date_type == "publication":
+            set_value("pycsw:PublicationDate", raw_text(normalize_datestring(date)))
+
+    set_value("pycsw:GeographicDescriptionCode", None)
+
+    spatial_resolution = getitem(getitem(mcf, "spatial"), "spatialresolution")
+    if spatial_resolution and not service:
+        denominator = raw_text(spatial_resolution)
+        if denominator is not None:
+            set_value("pycsw:Denominator", denominator)
+
+    if service:
+        set_value("pycsw:ServiceType", SERVICE_TYPE)
+        set_value("pycsw:ServiceTypeVersion", None)
+        # srv:couplingType, read as gmd:couplingType
+        set_value("pycsw:CouplingType", None)
+    else:
+        set_value("pycsw:ServiceType", "")
+
+    if point_of_contact:
+        set_value("pycsw:ResponsiblePartyRole", "pointOfContact")
+
+    links = distribution_links(getitem(mcf, "distribution"), freetext, service)
+    if service:
+        links.append(SERVICE_LINK)
+    if links:
+        set_value("pycsw:Links", "^".join(links))
+
+    set_value("pycsw:BoundingBox", bounding_box(getitem(getitem(identification, "extents"), "spatial")))
+    return values
+
+
+def distribution_links(distribution, freetext, service: bool) -> list:
+    """
+    pycsw links ("name,description,protocol,url") of the gmd:onLine resources of the distributions.
+    """
+    links = []
+    if not distribution:
+        return links
+    for value in distribution.values():
+        if not getitem(value, "url"):
+            continue
+        url = escaped_text(value["url"])
+        protocol = raw_text(getitem(value, "type"))
+        name = freetext(value.get("name"))
+        # Service descriptions are gmx:Anchor, only gco:CharacterString is read
+        description = None
+        if not service and getitem(value, "description"):
+            description = freetext(value.get("description"))
+        if url is not None and protocol is None:
+            protocol = sniff_link(url)
+        links.append(f"{name},{description},{protocol},{url}")
+    return links
+
+
+def bounding_box(extents) -> str:
+    """
+    WKT polygon of the first spatial extent, None if it is not in EPSG:4326 (a gmd:EX_BoundingPolygon).
+    """
+    extents = list(extents)
+    if not extents:
+        return None
+    spatial = extents[0]
+    if getitem(spatial, "crs") != 4326:
+        return None
+    try:
+        minx, miny, maxx, maxy = ["{:.2f}".format(coord) for coord in map(float, spatial["bbox"].strip("[]").split(","))]
+        return util.bbox2wktpolygon(f"{minx},{miny},{maxx},{maxy}")
+    except Exception:
+        # Corrupted coordinates are not included
+        return None
+
+
+def render(value) -> str:
+    """
+    String of a value as rendered by `{{ value }}` in the templates: Undefined is empty, None is "None".
+    """
+    return "" if isinstance(value, Undefined) else str(value)
+
+
+def xml_text(text: str) -> str:
+    """
+    Text content as read back by OWSLib: line breaks normalized, stripped, None if empty.
+    """
+    text = LINE_BREAKS.sub("\n", text).strip()
+    return text or None
+
+
+def raw_text(value) -> str:
+    """
+    Text of an element written as `{{ value }}`, not escaped.
+
+    Raises
+    ------
+    UnsupportedRecord: If the text has markup or only whitespace.
+    """
+    text = render(value)
+    if "<" in text or "&" in text:
+        raise UnsupportedRecord(f"Markup in an unescaped value: {text!r}")
+    if text and not text.strip():
+        # Blank text nodes are dropped by the parser
+        raise UnsupportedRecord("Blank value")
+    return xml_text(text)
+
+
+def escaped_text(value) -> str:
+    """
+    Text of an element written as `{{ value|e }}`.
+
+    Raises
+    ------
+    UnsupportedRecord: If the text has only whitespace.
+    """
+    text = render(value)
+    if text and not text.strip():
+        raise UnsupportedRecord("Blank value")
+    return xml_text(text)
+
+
+def charstring_text(value) -> str:
+    """
+    Text of an element written escaped, e.g. by the get_freetext macro (`{{ value|trim|e }}`), None if not written.
+    """
+    text = render(value).strip()
+    if text == "None":
+        return None
+    return xml_text(text)
+
+
+def attribute_text(value) -> str:
+    """
+    Value of an attribute written as `"{{ value }}"` and read by OWSLib _testCodeListValue().
+
+    Raises
+    ------
+    UnsupportedRecord: If the value has markup or quotes.
+    """
+    text = render(value)
+    if any(char in text for char in '<&"'):
+        raise UnsupportedRecord(f"Markup in an attribute: {text!r}")
+    return ATTRIBUTE_WHITESPACE.sub(" ", LINE_BREAKS.sub("\n", text)).strip()
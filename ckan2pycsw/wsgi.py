@@ -0,0 +1,47 @@
+# inbuilt libraries
+import os
+
+# third-party libraries
+from pycsw.wsgi import application as pycsw_application
+
+# custom classes
+from model.record_payloads import PayloadServer
+from model.response_cache import ResponseCache
+from model.sqlite_search import enable_query_rewrite, reopen_replaced_databases
+
+# Ennvars
+PYCSW_SQLITE_SEARCH_INDEXES = os.environ.get("PYCSW_SQLITE_SEARCH_INDEXES", True)
+PYCSW_RESPONSE_CACHE = os.environ.get("PYCSW_RESPONSE_CACHE", True)
+try:
+    PYCSW_CACHE_MAX_ENTRIES = int(os.environ["PYCSW_CACHE_MAX_ENTRIES"])
+except (KeyError, ValueError):
+    PYCSW_CACHE_MAX_ENTRIES = 1024
+try:
+    PYCSW_CACHE_MAX_MB = int(os.environ["PYCSW_CACHE_MAX_MB"])
+except (KeyError, ValueError):
+    PYCSW_CACHE_MAX_MB = 64
+PYCSW_CACHE_DIR = os.environ.get("PYCSW_CACHE_DIR")
+PYCSW_CACHE_METRICS_PATH = os.environ.get("PYCSW_CACHE_METRICS_PATH", "/metrics")
+PYCSW_RECORD_PAYLOADS = os.environ.get("PYCSW_RECORD_PAYLOADS", True)
+PYCSW_CONFIG = os.environ.get("PYCSW_CONFIG")
+
+# A full rebuild of the harvest replaces the SQLite database file, see ckan2pycsw.swap_database()
+reopen_replaced_databases()
+# pycsw queries on SQLite use the search indexes built by the harvest, see model.sqlite_search
+if str(PYCSW_SQLITE_SEARCH_INDEXES).lower() == "true":
+    enable_query_rewrite()
+
+# WSGI application of the pycsw server, e.g. `gunicorn --pythonpath ckan2pycsw wsgi:application`
+application = pycsw_application
+if str(PYCSW_RESPONSE_CACHE).lower() == "true":
+    # Responses cached until the next harvest ends, see model.response_cache
+    application = ResponseCache(
+        pycsw_application,
+        max_entries=PYCSW_CACHE_MAX_ENTRIES,
+        max_bytes=PYCSW_CACHE_MAX_MB * 1024 * 1024,
+        cache_dir=PYCSW_CACHE_DIR or None,
+        metrics_path=PYCSW_CACHE_METRICS_PATH or None,
+    )
+if str(PYCSW_RECORD_PAYLOADS).lower() == "true" and PYCSW_CONFIG:
+    # GetRecordById of a record in ISO 19139 answered with the payload stored by the harvest, see model.record_payloads
+    application = PayloadServer(application, PYCSW_CONFIG)
@@ -0,0 +1,52 @@
+# inbuilt libraries
+import os
+import sys
+import threading
+from pathlib import Path
+
+# third-party libraries
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+# The application modules are imported as in ckan2pycsw/ckan2pycsw.py, e.g. `from model.metrics import METRICS`,
+# and the benchmark modules as in benchmarks/run.py, e.g. `from catalogue import make_dataset`
+sys.path.insert(0, str(REPO_DIR / "ckan2pycsw"))
+sys.path.insert(0, str(REPO_DIR / "benchmarks"))
+# Read when model.template is imported, as in the container
+os.environ.setdefault("APP_DIR", str(REPO_DIR / "ckan2pycsw"))
+
+
+def iter_datasets(size: int, seed: int = 0):
+    """
+    Synthetic CKAN datasets (benchmarks/catalogue.py), each as generated and with one of its fields
+    missing and empty, so the optional branches of the mappings are run.
+    """
+    from catalogue import make_dataset
+
+    for index in range(size):
+        dataset = make_dataset(index, seed)
+        yield dataset
+        field = list(dataset)[index % len(dataset)]
+        yield {name: value for name, value in dataset.items() if name != field}
+        yield dict(dataset, **{field: ""})
+
+
+@pytest.fixture
+def ckan_stub():
+    """
+    Start a CKAN stand-in (benchmarks/ckan_stub.py), e.g. `url = ckan_stub(size=25, rows_max=10)`.
+    """
+    from ckan_stub import create_server
+
+    servers = []
+
+    def start(size: int, **kwargs) -> str:
+        server = create_server(size, **kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://{server.server_address[0]}:{server.server_address[1]}/"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
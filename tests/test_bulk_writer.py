@@ -0,0 +1,114 @@
+# inbuilt libraries
+import os
+
+# third-party libraries
+import pytest
+
+# custom classes
+from model import bulk_writer
+from model.bulk_writer import BulkWriter
+
+
+@pytest.fixture
+def pycsw_repository(tmp_path):
+    """
+    pycsw context and repository of a new temporary SQLite database.
+    """
+    import pycsw.core.config
+    from pycsw.core import admin, repository
+
+    path = tmp_path / "cite.db"
+    database = f"sqlite:///{path}"
+    admin.setup_db(database, "records", "")
+    context = pycsw.core.config.StaticContext()
+    repo = repository.Repository(database, context, table="records")
+    yield path, context, repo
+    repo.session.close()
+    repo.engine.dispose()
+
+
+def result(ckan_id: str, identifier: str, title: str, **values) -> dict:
+    """
+    Converted dataset with the record values of `identifier`, see model.converter.DatasetConverter.convert_result().
+    """
+    return {
+        "id": ckan_id,
+        "name": ckan_id,
+        "dcat_type": "dataset",
+        "payload": None,
+        "values": {
+            "identifier": identifier,
+            "typename": "gmd:MD_Metadata",
+            "schema": "http://www.isotc211.org/2005/gmd",
+            "mdsource": "local",
+            "xml": f"<record>{title}</record>",
+            "anytext": title,
+            "title": title,
+            **values,
+        },
+    }
+
+
+def titles(repo) -> dict:
+    return dict(repo.session.query(repo.dataset.identifier, repo.dataset.title).all())
+
+
+def test_batches(pycsw_repository, monkeypatch):
+    # Records are written in batches (delete + bulk_insert_mappings), replacing the records already stored
+    _, context, repo = pycsw_repository
+    BulkWriter(repo, context).write_one(result("ckan-0", "record-0", "Old title"))
+
+    def no_upsert(*args):
+        raise AssertionError("record written one by one")
+
+    monkeypatch.setattr(bulk_writer, "upsert_record", no_upsert)
+    flushed = []
+    writer = BulkWriter(repo, context, batch_size=2, on_flush=lambda batch: flushed.append([item["id"] for item in batch]))
+    for index in range(3):
+        writer.add(result(f"ckan-{index}", f"record-{index}", f"Title {index}"))
+    writer.close()
+    assert flushed == [["ckan-0", "ckan-1"], ["ckan-2"]]
+    assert writer.identifiers == {f"ckan-{index}": f"record-{index}" for index in range(3)}
+    assert writer.failed == {}
+    assert titles(repo) == {f"record-{index}": f"Title {index}" for index in range(3)}
+    assert all(repo.session.query(repo.dataset.insert_date).all())
+
+
+def test_record_by_record(pycsw_repository):
+    # A batch that fails is written one record at a time (upsert_record), only the invalid records are lost
+    _, context, repo = pycsw_repository
+    writer = BulkWriter(repo, context, batch_size=10)
+    writer.add(result("ckan-0", "record-0", "Title 0"))
+    # The same record twice in a batch, e.g. modified while the harvest paged through CKAN
+    writer.add(result("ckan-0", "record-0", "Title 0, modified"))
+    writer.add(result("ckan-1", "record-1", "Title 1", unknown_column="value"))
+    writer.add(result("ckan-2", "record-2", "Title 2"))
+    writer.close()
+    assert writer.identifiers == {"ckan-0": "record-0", "ckan-2": "record-2"}
+    assert list(writer.failed) == ["ckan-1"]
+    assert titles(repo) == {"record-0": "Title 0, modified", "record-2": "Title 2"}
+
+
+def test_fresh_sqlite_build(pycsw_repository):
+    # A new database is built with journal_mode=WAL and synchronous=OFF, then switched back to the default journal
+    path, context, repo = pycsw_repository
+    writer = BulkWriter(repo, context, fresh_build=True)
+    with repo.engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 0
+    writer.add(result("ckan-0", "record-0", "Title 0"))
+    writer.close()
+    with repo.engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "delete"
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 2
+    assert not os.path.exists(f"{path}-wal")
+    assert titles(repo) == {"record-0": "Title 0"}
+
+
+def test_existing_database(pycsw_repository):
+    # The live database keeps its journal and synchronous settings
+    _, context, repo = pycsw_repository
+    BulkWriter(repo, context).close()
+    with repo.engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "delete"
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 2
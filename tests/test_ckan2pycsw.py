@@ -0,0 +1,198 @@
+# inbuilt libraries
+import sqlite3
+from types import SimpleNamespace
+
+# third-party libraries
+import pytest
+from pycsw.core import repository
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+# custom classes
+import ckan2pycsw
+import ckan_stub as ckan_stub_module
+from conftest import REPO_DIR
+from ckan2pycsw import harvest, swap_database
+from model.converter import DatasetConverter
+from model.sync_state import SyncState
+
+PYCSW_CONFIG = """[server]
+home={home}
+url=http://localhost:8000/
+mimetype=application/xml; charset=UTF-8
+encoding=UTF-8
+language=en-US
+maxrecords=10
+
+[manager]
+transactions=false
+
+[metadata:main]
+identification_title=Test catalogue
+
+[repository]
+database=sqlite:///{home}/cite.db
+table=records
+
+[metadata:inspire]
+enabled=false
+"""
+CATALOGUE_SIZE = 12
+
+
+def create_database(path, value: str):
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE catalogue (value TEXT)")
+        conn.exec_driver_sql("INSERT INTO catalogue VALUES (?)", (value,))
+    engine.dispose()
+
+
+def test_swap_database(tmp_path, monkeypatch):
+    # The memoized pycsw engine of the live database does not keep reading the previous file
+    database_path, shadow_path = str(tmp_path / "cite.db"), str(tmp_path / "cite.db.shadow")
+    create_database(database_path, "old")
+    create_database(shadow_path, "new")
+    database = f"sqlite:///{database_path}"
+    monkeypatch.setattr(repository.Repository, "_engines", {database: create_engine(database, poolclass=QueuePool)})
+    with repository.Repository.create_engine(database).connect() as conn:
+        assert conn.exec_driver_sql("SELECT value FROM catalogue").scalar() == "old"
+    swap_database(shadow_path, database_path)
+    assert database not in repository.Repository._engines
+    with repository.Repository.create_engine(database).connect() as conn:
+        assert conn.exec_driver_sql("SELECT value FROM catalogue").scalar() == "new"
+
+
+@pytest.fixture
+def catalogue(tmp_path, ckan_stub, monkeypatch):
+    """
+    Harvest a CKAN stand-in of `CATALOGUE_SIZE` datasets into a temporary SQLite repository, datasets converted in this process.
+
+    Returns the repository and the names of the datasets converted by `harvest()`, e.g. `catalogue.converted`.
+    """
+    config = tmp_path / "pycsw.conf"
+    config.write_text(PYCSW_CONFIG.format(home=tmp_path))
+    monkeypatch.chdir(REPO_DIR)
+    for name, value in {
+        "URL": ckan_stub(size=CATALOGUE_SIZE),
+        "PYCSW_CONF": str(config),
+        "APP_DIR": str(tmp_path),
+        "PYCSW_CONVERT_WORKERS": 1,
+        "PYCSW_CKAN_ROWS": 5,
+        "PYCSW_INSERT_BATCH_SIZE": 4,
+        "PYCSW_RECORD_PAYLOADS": False,
+        "PYCSW_FULL_REBUILD": False,
+    }.items():
+        monkeypatch.setattr(ckan2pycsw, name, value)
+    converted = []
+    convert_result = DatasetConverter.convert_result
+
+    def recorded(self, dataset):
+        converted.append(dataset["name"])
+        return convert_result(self, dataset)
+
+    monkeypatch.setattr(DatasetConverter, "convert_result", recorded)
+    return SimpleNamespace(converted=converted, database=f"sqlite:///{tmp_path}/cite.db", path=tmp_path / "cite.db")
+
+
+def harvested(catalogue, **kwargs) -> list:
+    """
+    Names of the datasets converted by a harvest of `catalogue`.
+    """
+    catalogue.converted.clear()
+    assert harvest(**kwargs)
+    return sorted(catalogue.converted)
+
+
+def records(catalogue) -> dict:
+    with sqlite3.connect(catalogue.path) as conn:
+        return dict(conn.execute("SELECT identifier, title FROM records").fetchall())
+
+
+def test_unchanged_datasets_skipped(catalogue):
+    # The datasets whose content hash did not change are not converted again
+    names = harvested(catalogue)
+    assert len(names) == CATALOGUE_SIZE
+    stored = records(catalogue)
+    assert stored
+    hashes = SyncState(catalogue.database).get_hashes()
+    assert len(hashes) == CATALOGUE_SIZE
+    # Incremental harvest from the watermark: the newest dataset is retrieved again, it did not change
+    assert harvested(catalogue) == []
+    assert SyncState(catalogue.database).get_hashes() == hashes
+    assert records(catalogue) == stored
+
+
+def test_changed_dataset_rendered(catalogue, monkeypatch):
+    harvested(catalogue)
+    make_dataset = ckan_stub_module.make_dataset
+    newest = make_dataset(CATALOGUE_SIZE - 1)
+
+    def changed(index, seed=0):
+        dataset = make_dataset(index, seed)
+        if index == CATALOGUE_SIZE - 1:
+            dataset["title"] = f"{dataset['title']} (changed)"
+            dataset["title_translated"] = {lang: f"{title} (changed)" for lang, title in dataset["title_translated"].items()}
+        return dataset
+
+    monkeypatch.setattr(ckan_stub_module, "make_dataset", changed)
+    assert harvested(catalogue) == [newest["name"]]
+    assert f"{newest['title']} (changed)" in records(catalogue).values()
+
+
+def test_templates_change_rendered(catalogue, monkeypatch):
+    # Every dataset is harvested and converted again with other templates or mappings
+    harvested(catalogue)
+    files_version = ckan2pycsw.files_version
+    monkeypatch.setattr(ckan2pycsw, "files_version", lambda *folders: files_version(*folders) + "-changed")
+    assert len(harvested(catalogue)) == CATALOGUE_SIZE
+    assert harvested(catalogue) == []
+
+
+def test_interrupted_rebuild_resumed(catalogue, monkeypatch):
+    # A full rebuild interrupted after 2 batches resumes from its checkpoint, the datasets written are not converted again
+    harvested(catalogue)
+    stored = records(catalogue)
+    monkeypatch.setattr(ckan2pycsw, "PYCSW_FULL_REBUILD", True)
+    checkpoint = ckan2pycsw.HarvestRun.checkpoint
+
+    def interrupted(run, batch):
+        checkpoint(run, batch)
+        if run.sync_state.get_watermark() and len(run.sync_state.get_identifiers()) >= 2 * ckan2pycsw.PYCSW_INSERT_BATCH_SIZE:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(ckan2pycsw.HarvestRun, "checkpoint", interrupted)
+    catalogue.converted.clear()
+    with pytest.raises(KeyboardInterrupt):
+        harvest()
+    written = sorted(catalogue.converted)[:2 * ckan2pycsw.PYCSW_INSERT_BATCH_SIZE]
+    # The previous catalogue is served meanwhile
+    assert records(catalogue) == stored
+    monkeypatch.setattr(ckan2pycsw.HarvestRun, "checkpoint", checkpoint)
+    resumed = harvested(catalogue)
+    assert resumed and not set(resumed) & set(written)
+    assert len(written) + len(resumed) == CATALOGUE_SIZE
+    assert records(catalogue) == stored
+    assert not (catalogue.path.parent / (catalogue.path.name + ckan2pycsw.SHADOW_SUFFIX)).exists()
+
+
+@pytest.mark.parametrize("retry_only", [False, True])
+def test_failed_datasets_retried(catalogue, monkeypatch, retry_only):
+    # The datasets that failed are converted again by the next run, whatever their content hash
+    failing = ckan_stub_module.make_dataset(3)["name"]
+    convert = DatasetConverter.convert
+
+    def failed(self, dataset, *args, **kwargs):
+        if dataset["name"] == failing:
+            raise ValueError("Conversion failed")
+        return convert(self, dataset, *args, **kwargs)
+
+    monkeypatch.setattr(DatasetConverter, "convert", failed)
+    harvested(catalogue)
+    assert list(SyncState(catalogue.database).get_failed().values()) == [failing]
+    assert len(records(catalogue)) == CATALOGUE_SIZE - 1
+    monkeypatch.setattr(DatasetConverter, "convert", convert)
+    assert harvested(catalogue, retry_only=retry_only) == [failing]
+    assert SyncState(catalogue.database).get_failed() == {}
+    assert len(records(catalogue)) == CATALOGUE_SIZE
+    assert harvested(catalogue) == []
@@ -0,0 +1,100 @@
+# third-party libraries
+import pytest
+
+# custom classes
+from model.ckan_fetcher import KEYSET_SORT, CKANFetcher, keyset_filter
+
+
+def test_dataset_ids_with_rows_max(ckan_stub):
+    # CKAN caps rows at ckan.search.rows_max, below the 1000 rows requested
+    url = ckan_stub(size=25, rows_max=10)
+    ids = CKANFetcher(url, retries=0).get_dataset_ids()
+    assert len(ids) == 25
+
+
+def test_dataset_ids_filter(ckan_stub, monkeypatch):
+    # The deletion sweep lists the datasets of the harvest filters only
+    fetcher = CKANFetcher(ckan_stub(size=5), retries=0)
+    get_page = fetcher.get_page
+    queries = []
+
+    def recorded_page(params, start, rows=None):
+        queries.append(params)
+        return get_page(params, start, rows)
+
+    monkeypatch.setattr(fetcher, "get_page", recorded_page)
+    fetcher.get_dataset_ids("dataset_type:dataset")
+    assert queries and all(params["fq"] == "dataset_type:dataset" for params in queries)
+
+
+def test_dataset_ids_incomplete(ckan_stub, monkeypatch):
+    fetcher = CKANFetcher(ckan_stub(size=25, rows_max=10), retries=0)
+    get_page = fetcher.get_page
+
+    def lost_page(params, start, rows=None):
+        # A page that comes back empty, e.g. a dataset deleted while paging
+        page = get_page(params, start, rows)
+        return {**page, "results": []} if start == 10 else page
+
+    monkeypatch.setattr(fetcher, "get_page", lost_page)
+    with pytest.raises(ValueError):
+        fetcher.get_dataset_ids()
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_datasets_with_rows_max(ckan_stub, stream):
+    # 100 rows requested, CKAN returns 30 per page
+    url = ckan_stub(size=95, rows_max=30)
+    fetcher = CKANFetcher(url, rows=100, workers=3, retries=0, stream=stream)
+    names = [dataset["name"] for dataset in fetcher.get_datasets({"sort": "metadata_modified asc"})]
+    reference = [dataset["name"] for dataset in CKANFetcher(url, rows=30, retries=0).get_datasets({"sort": "metadata_modified asc"})]
+    assert len(reference) == 95
+    assert names == reference
+    assert fetcher.failed_pages == []
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_datasets_concurrent_pages(ckan_stub, stream):
+    url = ckan_stub(size=95)
+    fetcher = CKANFetcher(url, rows=10, workers=4, retries=0, stream=stream)
+    starts = [start for start, datasets in fetcher.iter_pages({}) if list(datasets)]
+    assert starts == list(range(0, 95, 10))
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_datasets_keyset_pages(ckan_stub, stream):
+    # 100 rows requested, CKAN returns 30 per page
+    url = ckan_stub(size=95, rows_max=30)
+    fetcher = CKANFetcher(url, rows=100, retries=0, stream=stream)
+    names = [dataset["name"] for dataset in fetcher.get_datasets({"fl": "name"}, keyset=True)]
+    reference = [dataset["name"] for dataset in CKANFetcher(url, rows=30, retries=0).get_datasets({"sort": KEYSET_SORT})]
+    assert len(reference) == 95
+    assert names == reference
+    assert fetcher.failed_pages == []
+
+
+def test_keyset_page_filters(ckan_stub, monkeypatch):
+    # Each page starts after the (metadata_modified, id) of the last dataset, not at an offset
+    fetcher = CKANFetcher(ckan_stub(size=25), rows=10, retries=0)
+    get_page = fetcher.get_page
+    queries = []
+
+    def recorded_page(params, start, rows=None):
+        page = get_page(params, start, rows)
+        queries.append((params, start, page["results"]))
+        return page
+
+    monkeypatch.setattr(fetcher, "get_page", recorded_page)
+    assert len(list(fetcher.get_datasets({"fq": "dataset_type:dataset"}, keyset=True))) == 25
+    assert [start for _, start, _ in queries] == [0, 0, 0]
+    assert queries[0][0]["fq"] == "dataset_type:dataset"
+    for (params, _, _), (_, _, previous) in zip(queries[1:], queries):
+        assert params["fq"] == keyset_filter("dataset_type:dataset", (previous[-1]["metadata_modified"], previous[-1]["id"]))
+
+
+def test_keyset_filter():
+    assert keyset_filter(None, None) is None
+    assert keyset_filter("dataset_type:dataset", ("2024-01-01T00:00:00.5", "a")) == (
+        'dataset_type:dataset AND metadata_modified:[2024-01-01T00:00:00.5Z TO *] '
+        'AND (metadata_modified:{2024-01-01T00:00:00.5Z TO *] OR id:{"a" TO *])'
+    )
@@ -0,0 +1,41 @@
+# inbuilt libraries
+import os
+
+# third-party libraries
+import pytest
+
+# custom classes
+from conftest import REPO_DIR
+from model.converter import convert_datasets
+
+MAPPINGS_FOLDER = str(REPO_DIR / "ckan2pycsw" / "mappings")
+
+
+class WorkerKiller(dict):
+    """
+    Dataset that kills the worker process that unpickles it.
+    """
+    def __reduce__(self):
+        return os._exit, (1,)
+
+
+@pytest.fixture(scope="module")
+def converter_args(tmp_path_factory):
+    from pycsw.core import admin
+
+    database = f"sqlite:///{tmp_path_factory.mktemp('pycsw') / 'cite.db'}"
+    admin.setup_db(database, "records", "")
+    return {"database": database, "table": "records", "base_url": "http://localhost:5000/", "mappings_folder": MAPPINGS_FOLDER}
+
+
+def test_convert_datasets_failures(converter_args):
+    # One dataset kills its worker process and another one cannot be sent to the pool, the others are converted
+    from catalogue import make_dataset
+
+    datasets = [make_dataset(index) for index in range(6)]
+    datasets[1] = WorkerKiller(datasets[1])
+    datasets[3] = dict(datasets[3], unpicklable=lambda: None)
+    results = list(convert_datasets(datasets, workers=2, in_flight=4, **converter_args))
+    assert [result["id"] for result in results] == [dataset["id"] for dataset in datasets]
+    assert [index for index, result in enumerate(results) if result["error"]] == [1, 3]
+    assert all(result["values"] for index, result in enumerate(results) if index not in (1, 3))
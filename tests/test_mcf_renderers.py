@@ -0,0 +1,127 @@
+# inbuilt libraries
+import copy
+import json
+
+# third-party libraries
+import pytest
+from jinja2 import DictLoader
+
+# custom classes
+from conftest import REPO_DIR, iter_datasets
+from model.template import (
+    SCHEMAS_CKAN,
+    RecordPreprocessor,
+    create_j2_environment,
+    get_j2_template,
+    get_record_preprocessor,
+    is_mcf_template,
+    render_j2_template,
+    render_json_mcf,
+    render_mcf,
+)
+
+MAPPINGS_FOLDER = str(REPO_DIR / "ckan2pycsw" / "mappings")
+URL = "http://localhost:5000/"
+# Datasets and their expected MCF, see test_mcf_snapshots()
+SNAPSHOTS = sorted((REPO_DIR / "tests" / "data" / "mcf").glob("*.json"))
+
+
+@pytest.mark.parametrize("template_dir", sorted(path.name for path in SCHEMAS_CKAN.iterdir() if (path / "main.j2").exists()))
+def test_mcf_templates(template_dir):
+    # The CKAN schemas of the repository build the MCF dict, no JSON is rendered
+    assert is_mcf_template(template_dir)
+
+
+@pytest.mark.parametrize("path", SNAPSHOTS, ids=[path.stem for path in SNAPSHOTS])
+def test_mcf_snapshots(path):
+    with open(path, encoding="utf-8") as f:
+        snapshot = json.load(f)
+    template_dir = path.stem.split("-")[0]
+    dataset = copy.deepcopy(snapshot["dataset"])
+    assert render_j2_template(dataset, "ckan", URL, template_dir, MAPPINGS_FOLDER) == snapshot["mcf"]
+    # The dataset is not modified
+    assert dataset == snapshot["dataset"]
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_mcf_catalogue(seed):
+    template = get_j2_template("ckan", "iso19139_geodcatap", MAPPINGS_FOLDER)
+    preprocessor = get_record_preprocessor("iso19139_geodcatap", MAPPINGS_FOLDER)
+    rendered = 0
+    for dataset in iter_datasets(100, seed):
+        original = copy.deepcopy(dataset)
+        try:
+            mcf = render_mcf(template, dataset, URL, preprocessor)
+        except Exception:
+            # e.g. a required field is missing
+            continue
+        assert dataset == original
+        # Plain data, as sent between the converter processes
+        assert json.loads(json.dumps(mcf)) == mcf
+        rendered += 1
+    assert rendered >= 250
+
+
+def test_mcf_template_json_equivalence():
+    # `text` and `raw_text` write the values as a JSON template with `{{ value }}` and `{{ value|safe }}`
+    env = create_j2_environment("ckan", "iso19139_base", MAPPINGS_FOLDER, loader=DictLoader({
+        "json.j2": '{"title": "{{ record[\'title\'] }}", "notes": "{{ record[\'notes\']|safe }}", "tags": [{% for tag in record[\'tags\'] %}"{{ tag }}"{% if not loop.last %},{% endif %}{% endfor %}]}',
+        "mcf.j2": '{% set mcf = {"title": record[\'title\']|text, "notes": record[\'notes\']|raw_text, "tags": record[\'tags\']|map("text")|list} %}',
+    }))
+    dataset = {"title": 'Roads & "rails" <2024>', "notes": "Línea 1", "tags": ["a&b", "c"]}
+    mcf = render_mcf(env.get_template("mcf.j2"), dataset)
+    assert mcf == render_json_mcf(env.get_template("json.j2"), dataset)
+    assert mcf == {"title": "Roads &amp; &#39;rails&#39; &lt;2024&gt;", "notes": "Línea 1", "tags": ["a&amp;b", "c"]}
+
+
+def legacy_string(s):
+    # Value of a string before RecordPreprocessor: JSON detected from the value of every field, double quotes replaced
+    if s.startswith('["') or s.endswith('"]') or s.startswith('{"') or s.endswith('"}'):
+        try:
+            return json.loads(s, strict=False)
+        except ValueError:
+            pass
+    return s.replace('"', "'")
+
+
+def legacy_preprocess(data):
+    # Every field of the dataset preprocessed in place, as before RecordPreprocessor
+    for key, value in data.items():
+        if isinstance(value, str):
+            data[key] = legacy_string(value)
+        elif isinstance(value, list):
+            data[key] = [legacy_string(item) if isinstance(item, str) else item for item in value]
+    return data
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_record_preprocessor(seed):
+    template = get_j2_template("ckan", "iso19139_geodcatap", MAPPINGS_FOLDER)
+    preprocessor = get_record_preprocessor("iso19139_geodcatap", MAPPINGS_FOLDER)
+    unprocessed = RecordPreprocessor(fields=[])
+    compared = 0
+    for dataset in iter_datasets(100, seed):
+        original = copy.deepcopy(dataset)
+        record = preprocessor.preprocess(dataset)
+        assert record is not dataset
+        assert dataset == original
+        try:
+            mcf = render_mcf(template, dataset, URL, preprocessor)
+        except Exception:
+            continue
+        # Same MCF as the preprocessing of every field of the dataset, but the empty lists of the JSON fields of the schema
+        legacy = legacy_preprocess(copy.deepcopy(dataset))
+        legacy.update({key: [] for key in preprocessor.json_fields if dataset.get(key) == "[]"})
+        assert mcf == render_mcf(template, legacy, URL, unprocessed), dataset["name"]
+        compared += 1
+    assert compared >= 250
+
+
+def test_record_preprocessor_json_fields():
+    preprocessor = RecordPreprocessor(fields=["lineage_source", "notes", "extra"], json_fields={"lineage_source"}, schema_fields={"lineage_source", "notes"})
+    dataset = {"lineage_source": "[]", "notes": '["not JSON"]', "extra": '{"a": 1}', "tags": ['a "tag"']}
+    original = copy.deepcopy(dataset)
+    record = preprocessor.preprocess(dataset)
+    assert dataset == original
+    # JSON field of the schema (before: the string "[]"), text field of the schema, field not described by the schema, field not read
+    assert record == {"lineage_source": [], "notes": "['not JSON']", "extra": {"a": 1}, "tags": ['a "tag"']}
@@ -0,0 +1,42 @@
+# inbuilt libraries
+import threading
+import time
+
+# third-party libraries
+import pytest
+
+# custom classes
+from model import pipeline
+from model.metrics import HarvestMetrics
+from model.pipeline import pipe
+
+
+def test_pipe_order():
+    assert list(pipe(range(100), 3, "fetch", "convert", metrics=HarvestMetrics())) == list(range(100))
+
+
+def test_pipe_producer_error():
+    def source():
+        yield 1
+        raise ValueError("page")
+
+    with pytest.raises(ValueError):
+        list(pipe(source(), 3, "fetch", "convert", metrics=HarvestMetrics()))
+
+
+def test_pipe_consumer_error_blocked_producer(monkeypatch):
+    # The producer is blocked in its source (e.g. reading a CKAN page) when the consumer fails
+    monkeypatch.setattr(pipeline, "JOIN_TIMEOUT", 0.2)
+    release = threading.Event()
+
+    def source():
+        yield 1
+        release.wait()
+        yield 2
+
+    start = time.perf_counter()
+    with pytest.raises(RuntimeError):
+        for item in pipe(source(), 3, "fetch", "convert", metrics=HarvestMetrics()):
+            raise RuntimeError("write")
+    assert time.perf_counter() - start < 5
+    release.set()
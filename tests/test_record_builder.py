@@ -0,0 +1,57 @@
+# inbuilt libraries
+import warnings
+
+# third-party libraries
+import pytest
+
+# custom classes
+from conftest import REPO_DIR, iter_datasets
+
+MAPPINGS_FOLDER = str(REPO_DIR / "ckan2pycsw" / "mappings")
+URL = "http://localhost:5000/"
+
+
+@pytest.fixture(scope="module")
+def pycsw_repository(tmp_path_factory):
+    """
+    pycsw context and repository of a temporary SQLite database, as parse_record() needs one.
+    """
+    import pycsw.core.config
+    from pycsw.core import admin, repository
+
+    database = f"sqlite:///{tmp_path_factory.mktemp('pycsw') / 'cite.db'}"
+    admin.setup_db(database, "records", "")
+    context = pycsw.core.config.StaticContext()
+    return context, repository.Repository(database, context, table="records")
+
+
+@pytest.mark.parametrize("output_schema", ["iso19139_inspire"])
+def test_record_mapper_parity(pycsw_repository, output_schema):
+    # PYCSW_RECORD_BUILDER=mcf must store the same records as pycsw.core.metadata.parse_record()
+    from pycsw.core import metadata
+
+    from model.converter import OUPUT_SCHEMA, RECORD_MAPPERS, normalize_mcf, record_differences, record_values
+    from model.dataset import Dataset
+    from schemas.pygeometa.iso19139_inspire.record import UnsupportedRecord
+
+    warnings.filterwarnings("ignore", category=FutureWarning, module="owslib")
+    context, repo = pycsw_repository
+    iso_os = OUPUT_SCHEMA[output_schema]()
+    mapper = RECORD_MAPPERS[output_schema]
+    compared = 0
+    for dataset in iter_datasets(100):
+        try:
+            mcf = normalize_mcf(Dataset(dataset_raw=dataset, base_url=URL, mappings_folder=MAPPINGS_FOLDER, csw_schema="iso19139_geodcatap").render_template)
+            xml = iso_os.write(mcf=mcf, stringify=False, mappings_folder=MAPPINGS_FOLDER)
+        except Exception:
+            # Not converted by either builder
+            continue
+        try:
+            values = mapper(context, mcf, xml)
+        except UnsupportedRecord:
+            # Built by parse_record()
+            continue
+        reference = record_values(metadata.parse_record(context, xml, repo)[0])
+        assert record_differences(values, reference) == [], dataset.get("name")
+        compared += 1
+    assert compared >= 200
@@ -0,0 +1,97 @@
+# inbuilt libraries
+from urllib.parse import urlencode
+
+# third-party libraries
+import pytest
+
+# custom classes
+from model.metrics import HarvestMetrics
+from model.record_payloads import OUTPUT_SCHEMA, PayloadBuilder, PayloadServer, RecordPayloads
+
+PYCSW_CONFIG = """[server]
+home={home}
+url=http://localhost:8000/
+mimetype=application/xml; charset=UTF-8
+encoding=UTF-8
+language=en-US
+maxrecords=10
+profiles=apiso
+
+[manager]
+transactions=false
+
+[metadata:main]
+identification_title=Test catalogue
+
+[repository]
+database=sqlite:///{home}/cite.db
+table=records
+{filter}
+
+[metadata:inspire]
+enabled=false
+"""
+IDENTIFIER = "dataset-1"
+QUERY = urlencode({
+    "service": "CSW",
+    "version": "2.0.2",
+    "request": "GetRecordById",
+    "id": IDENTIFIER,
+    "outputSchema": OUTPUT_SCHEMA,
+    "elementSetName": "full",
+})
+
+
+def app(environ, start_response):
+    start_response("200 OK", [("Content-Type", "application/xml")])
+    return [b"<pycsw/>"]
+
+
+def request(server) -> tuple:
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"], response["headers"] = status, dict(headers)
+
+    body = b"".join(server({"REQUEST_METHOD": "GET", "QUERY_STRING": QUERY}, start_response))
+    return response["headers"], body
+
+
+@pytest.fixture
+def pycsw_config(tmp_path):
+    """
+    Write a pycsw configuration with a stored payload of `IDENTIFIER`, e.g. `path = pycsw_config(repository_filter="...")`.
+    """
+    def write(repository_filter: str = None) -> str:
+        path = tmp_path / "pycsw.conf"
+        path.write_text(PYCSW_CONFIG.format(home=tmp_path, filter=f"filter={repository_filter}" if repository_filter else ""))
+        payloads = RecordPayloads(f"sqlite:///{tmp_path}/cite.db")
+        with payloads.engine.begin() as conn:
+            conn.execute(payloads.table.delete())
+            conn.execute(payloads.table.insert(), [{
+                "identifier": IDENTIFIER,
+                "output_schema": OUTPUT_SCHEMA,
+                "format": PayloadBuilder(str(path)).format,
+                "etag": "1",
+                "body": b"<payload/>",
+            }])
+        return str(path)
+
+    return write
+
+
+def test_payload_served(pycsw_config):
+    server = PayloadServer(app, pycsw_config(), metrics=HarvestMetrics())
+    assert server.builder.available
+    headers, body = request(server)
+    assert body == b"<payload/>"
+    assert headers["ETag"] == '"1"'
+
+
+def test_repository_filter(pycsw_config):
+    # pycsw hides the records outside of the filter, the stored payloads are not filtered
+    server = PayloadServer(app, pycsw_config(repository_filter="type = 'http://purl.org/dc/dcmitype/Dataset'"), metrics=HarvestMetrics())
+    assert not server.builder.available
+    headers, body = request(server)
+    assert body == b"<pycsw/>"
+    assert "ETag" not in headers
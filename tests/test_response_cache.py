@@ -0,0 +1,84 @@
+# inbuilt libraries
+import gzip
+import io
+
+# custom classes
+from model.metrics import HarvestMetrics
+from model.response_cache import ResponseCache, bump_generation, is_success
+
+EXCEPTION_REPORT = (
+    b'<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n<!-- pycsw 2.6.1 -->\n'
+    b'<ows:ExceptionReport xmlns:ows="http://www.opengis.net/ows" version="1.2.0" language="en">'
+    b'<ows:Exception exceptionCode="NoApplicableCode" locator="service">'
+    b"<ows:ExceptionText>Could not initialize repository. Check server logs</ows:ExceptionText>"
+    b"</ows:Exception></ows:ExceptionReport>"
+)
+RECORDS = (
+    b'<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n<!-- pycsw 2.6.1 -->\n'
+    b'<csw:GetRecordsResponse xmlns:csw="http://www.opengis.net/cat/csw/2.0.2" version="2.0.2"/>'
+)
+QUERY = "service=CSW&version=2.0.2&request=GetRecords&typeNames=csw:Record&resultType=results"
+
+
+class FakePycsw:
+    """WSGI application answering with the next body of `bodies`, with 200 OK as pycsw 2.x."""
+
+    def __init__(self, *bodies):
+        self.bodies = list(bodies)
+        self.calls = 0
+
+    def __call__(self, environ, start_response):
+        body = self.bodies[min(self.calls, len(self.bodies) - 1)]
+        self.calls += 1
+        start_response("200 OK", [("Content-Type", "application/xml; charset=UTF-8"), ("Content-Length", str(len(body)))])
+        return [body]
+
+
+def request(app, query=QUERY):
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"], response["headers"] = status, dict(headers)
+
+    environ = {"REQUEST_METHOD": "GET", "QUERY_STRING": query, "PATH_INFO": "/", "wsgi.input": io.BytesIO(b"")}
+    body = b"".join(app(environ, start_response))
+    return response["status"], response["headers"], body
+
+
+def cache(tmp_path, app, **kwargs):
+    generation_file = str(tmp_path / "harvest_generation")
+    bump_generation(generation_file)
+    return ResponseCache(app, generation_file=generation_file, metrics=HarvestMetrics(), **kwargs)
+
+
+def test_successful_response_cached(tmp_path):
+    app = FakePycsw(RECORDS)
+    response_cache = cache(tmp_path, app)
+    assert request(response_cache)[1]["X-Cache"] == "MISS"
+    status, headers, body = request(response_cache)
+    assert (status, headers["X-Cache"], body) == ("200 OK", "HIT", RECORDS)
+    assert app.calls == 1
+
+
+def test_exception_report_not_cached(tmp_path):
+    # The repository is locked by a harvest on the first request, and released afterwards
+    app = FakePycsw(EXCEPTION_REPORT, RECORDS)
+    response_cache = cache(tmp_path, app, cache_dir=str(tmp_path / "cache"))
+    status, headers, body = request(response_cache)
+    assert (status, headers["X-Cache"], body) == ("200 OK", "MISS", EXCEPTION_REPORT)
+    status, headers, body = request(response_cache)
+    assert (headers["X-Cache"], body) == ("MISS", RECORDS)
+    assert request(response_cache)[1]["X-Cache"] == "HIT"
+    assert app.calls == 2
+
+
+def test_is_success():
+    headers = [("Content-Type", "application/xml; charset=UTF-8")]
+    assert is_success(("200 OK", headers, RECORDS))
+    assert not is_success(("200 OK", headers, EXCEPTION_REPORT))
+    assert not is_success(("500 Internal Server Error", headers, RECORDS))
+    assert not is_success(("200 OK", headers + [("Content-Encoding", "gzip")], gzip.compress(EXCEPTION_REPORT)))
+    assert is_success(("200 OK", headers + [("Content-Encoding", "gzip")], gzip.compress(RECORDS)))
+    json_headers = [("Content-Type", "application/json")]
+    assert not is_success(("200 OK", json_headers, b'{"ows:ExceptionReport": {"ows:Exception": {}}}'))
+    assert is_success(("200 OK", json_headers, b'{"csw:GetRecordsResponse": {}}'))
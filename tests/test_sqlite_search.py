@@ -0,0 +1,134 @@
+# inbuilt libraries
+import os
+
+# third-party libraries
+import pycsw
+import pytest
+from pycsw.core.repository import query_spatial
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+# custom classes
+from model import sqlite_search
+from model.sqlite_search import SearchIndexes, enable_query_rewrite, reopen_replaced_databases, rewrite_query
+
+TITLES = ["Air quality network", "Water reservoirs", "Air traffic", "Noise map"]
+# Bounding box of each record, None: no geometry
+BOXES = [(-4, 40, -3, 41), (-3.5, 40.5, 0, 42), None, (10, 50, 11, 51)]
+POSITIONAL = "SELECT identifier FROM records WHERE title like ? AND identifier != ? ORDER BY identifier"
+NAMED = "SELECT identifier FROM records WHERE title like :title AND identifier != :identifier ORDER BY identifier"
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = f"sqlite:///{tmp_path / 'records.db'}"
+    engine = create_engine(database)
+    # As pycsw.core.repository.Repository
+    event.listen(engine, "connect", lambda dbapi_connection, connection_record: dbapi_connection.create_function("query_spatial", 4, query_spatial))
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE records (identifier TEXT PRIMARY KEY, anytext TEXT, title TEXT, abstract TEXT, wkt_geometry TEXT)")
+        for i, (title, box) in enumerate(zip(TITLES, BOXES)):
+            conn.exec_driver_sql("INSERT INTO records VALUES (?, ?, ?, ?, ?)", (f"id-{i}", f"{title} {i}", title, f"Record {i} of {title.lower()}", box and polygon(*box)))
+    search_indexes = SearchIndexes(database, "records")
+    search_indexes.build()
+    search_indexes.engine.dispose()
+    yield engine
+    engine.dispose()
+
+
+def polygon(minx, miny, maxx, maxy) -> str:
+    return f"POLYGON(({minx} {miny},{minx} {maxy},{maxx} {maxy},{maxx} {miny},{minx} {miny}))"
+
+
+@pytest.mark.parametrize("parameters", [("%air%", "id-2"), ["%air%", "id-2"]])
+def test_positional_parameters(database, parameters):
+    with database.connect() as conn:
+        statement, values = rewrite_query(conn, POSITIONAL, parameters)
+        assert "MATCH ?" in statement
+        assert type(values) is type(parameters)
+        assert values == type(parameters)(['"air"', "%air%", "id-2"])
+        rows = conn.exec_driver_sql(statement, tuple(values)).fetchall()
+        assert rows == conn.exec_driver_sql(POSITIONAL, tuple(parameters)).fetchall() == [("id-0",)]
+
+
+def test_named_parameters(database):
+    parameters = {"title": "%air%", "identifier": "id-2"}
+    with database.connect() as conn:
+        statement, values = rewrite_query(conn, NAMED, parameters)
+        assert "MATCH :ckan2pycsw_fts_0" in statement
+        assert type(values) is dict
+        assert values == {**parameters, "ckan2pycsw_fts_0": '"air"'}
+        rows = conn.exec_driver_sql(statement, values).fetchall()
+        assert rows == conn.exec_driver_sql(NAMED, parameters).fetchall() == [("id-0",)]
+
+
+def test_not_rewritten(database):
+    # Patterns without 3 literal characters cannot use the FTS5 trigram index
+    with database.connect() as conn:
+        assert rewrite_query(conn, POSITIONAL, ("%a%", "id-2")) == (POSITIONAL, ("%a%", "id-2"))
+
+
+@pytest.mark.parametrize("statement, parameters", [
+    ("SELECT identifier FROM records WHERE anytext like :pvalue0 ORDER BY identifier", {"pvalue0": "%AIR%"}),
+    ("SELECT identifier FROM records WHERE anytext like :pvalue0 ORDER BY identifier", {"pvalue0": "%traffic 2"}),
+    ("SELECT identifier FROM records WHERE anytext like :pvalue0 ORDER BY identifier", {"pvalue0": "%qual_ty%"}),
+    ("SELECT identifier FROM records WHERE anytext like :pvalue0 ORDER BY identifier", {"pvalue0": "%no match%"}),
+    ("SELECT identifier FROM records WHERE title like :pvalue0 OR abstract like :pvalue1 ORDER BY identifier", {"pvalue0": "Water%", "pvalue1": "%of noise%"}),
+    ("SELECT identifier FROM records WHERE title like :pvalue0 AND anytext like :pvalue1 ORDER BY identifier", {"pvalue0": "%air%", "pvalue1": "%a%"}),
+    ("SELECT count(*) FROM records WHERE anytext like :pvalue0", {"pvalue0": "%ai%"}),
+    (f"SELECT identifier FROM records WHERE query_spatial(wkt_geometry,'{polygon(-3.8, 40.2, -3.2, 40.9)}','intersects','0') = 'true' ORDER BY identifier", {}),
+    (f"SELECT identifier FROM records WHERE query_spatial(wkt_geometry,'{polygon(-5, 39, 1, 43)}','within','0') = 'true' AND anytext like :pvalue0 ORDER BY identifier", {"pvalue0": "%air%"}),
+    (f"SELECT identifier FROM records WHERE query_spatial(wkt_geometry,'{polygon(-5, 39, 1, 43)}','disjoint','0') = 'true' ORDER BY identifier", {}),
+])
+def test_named_parameters_results(database, statement, parameters):
+    # The rewritten query selects the same records as the query of pycsw
+    with database.connect() as conn:
+        rewritten, values = rewrite_query(conn, statement, parameters)
+        assert conn.exec_driver_sql(rewritten, values).fetchall() == conn.exec_driver_sql(statement, parameters).fetchall()
+
+
+def test_search_indexes_cached(database, monkeypatch):
+    # The search indexes of a database file are looked up once, not by every connection (pycsw: one per request)
+    monkeypatch.setattr(sqlite_search, "_INDEXED_TABLES", set())
+    lookups = []
+    event.listen(database, "connect", lambda dbapi_connection, connection_record: dbapi_connection.set_trace_callback(
+        lambda sql: lookups.append(sql) if "sqlite_master" in sql else None
+    ))
+    database.dispose()
+    for _ in range(3):
+        with database.connect() as conn:
+            rewritten, _ = rewrite_query(conn, NAMED, {"title": "%air%", "identifier": "id-2"})
+            assert rewritten != NAMED
+    assert len(lookups) == 1
+
+
+def test_unsupported_pycsw(monkeypatch):
+    # The queries of other pycsw versions are not rewritten
+    monkeypatch.setattr(pycsw, "__version__", "3.0.0")
+    assert not enable_query_rewrite()
+    assert not event.contains(sqlite_search.Engine, "before_cursor_execute", sqlite_search._before_cursor_execute)
+
+
+def replace_database(path, value: str):
+    # A new file swapped in over `path`, as a full rebuild does
+    new_path = f"{path}.new"
+    engine = create_engine(f"sqlite:///{new_path}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE catalogue (value TEXT)")
+        conn.exec_driver_sql("INSERT INTO catalogue VALUES (?)", (value,))
+    engine.dispose()
+    os.replace(new_path, path)
+
+
+def test_reopen_replaced_databases(tmp_path):
+    # A pool that keeps its connections open (SQLAlchemy 2.x default for SQLite files) reads the new file
+    path = str(tmp_path / "cite.db")
+    replace_database(path, "old")
+    reopen_replaced_databases()
+    engine = create_engine(f"sqlite:///{path}", poolclass=QueuePool)
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT value FROM catalogue").scalar() == "old"
+    replace_database(path, "new")
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT value FROM catalogue").scalar() == "new"
+    engine.dispose()
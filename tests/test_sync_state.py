@@ -0,0 +1,35 @@
+# custom classes
+from model.sync_state import SyncState, content_hash, files_version
+
+
+def test_content_hash():
+    dataset = {"id": "1", "title": "Roads", "tags": [{"name": "a"}]}
+    assert content_hash(dataset, "1") == content_hash({"tags": [{"name": "a"}], "title": "Roads", "id": "1"}, "1")
+    assert content_hash(dataset, "1") != content_hash(dict(dataset, title="Rails"), "1")
+    assert content_hash(dataset, "1") != content_hash(dataset, "2")
+
+
+def test_files_version(tmp_path):
+    (tmp_path / "main.j2").write_text("{{ record['title'] }}")
+    (tmp_path / "__pycache__").mkdir()
+    (tmp_path / "__pycache__" / "module.pyc").write_bytes(b"1")
+    version = files_version(tmp_path)
+    (tmp_path / "__pycache__" / "module.pyc").write_bytes(b"2")
+    assert files_version(tmp_path) == version
+    (tmp_path / "main.j2").write_text("{{ record['name'] }}")
+    assert files_version(tmp_path) != version
+
+
+def test_checkpoint(tmp_path):
+    state = SyncState(f"sqlite:///{tmp_path}/cite.db")
+    state.save_checkpoint({"1": "dataset-1", "2": "dataset-2"}, {"1": "a", "2": "b"}, failed={"3": ("dataset-3", "error")}, watermark="2024-01-01T00:00:00Z", templates_version="v1")
+    state = SyncState(f"sqlite:///{tmp_path}/cite.db")
+    assert state.get_identifiers() == {"1": "dataset-1", "2": "dataset-2"}
+    assert state.get_hashes() == {"1": "a", "2": "b"}
+    assert state.get_watermark() == "2024-01-01T00:00:00Z"
+    assert state.get_templates_version() == "v1"
+    assert state.get_failed() == {"3": "dataset-3"}
+    # A failed package harvested again is no longer failed
+    state.save_checkpoint({"3": "dataset-3"}, {"3": "c"})
+    assert state.get_failed() == {}
+    assert state.get_hashes() == {"1": "a", "2": "b", "3": "c"}